@@ -0,0 +1,72 @@
+"""Measures the memory held by 10k teams and 100k tables with tracemalloc
+
+    python benchmarks/memory.py              the classes in the working tree
+    python benchmarks/memory.py 284010a .    a revision against the working tree
+
+Only TeamInfo and Table are taken from each waitlist.py, so a revision
+written for another python-telegram-bot version is measured the same way.
+"""
+import argparse
+import os
+import re
+import subprocess
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_classes(revision):
+    """Returns TeamInfo and Table as defined by waitlist.py at revision, "." being the working tree"""
+    if revision == ".":
+        with open(os.path.join(ROOT, "waitlist.py"), encoding="utf-8") as handle:
+            source = handle.read()
+    else:
+        source = subprocess.run(["git", "show", f"{revision}:waitlist.py"], cwd=ROOT, check=True, capture_output=True,
+                                text=True).stdout
+    # the rest of an old file may not even parse, so only its imports and the two classes are kept
+    kept = list()
+    keeping = False
+    for line in source.splitlines():
+        if line[:1].strip() and not line.startswith("#"):
+            keeping = re.match(r"(class (TeamInfo|Table)\b|import |from )", line) is not None
+            if re.match(r"(import|from) (telegram|outbox|roster|storage|shards)\b", line):
+                keeping = False
+        if keeping:
+            kept.append(line)
+    namespace = dict()
+    exec(compile("\n".join(kept), f"waitlist.py@{revision}", "exec"), namespace)
+    return namespace["TeamInfo"], namespace["Table"]
+
+
+def measure(team_info, table, teams=10000, tables=100000):
+    """Returns the bytes held by the teams, then by the tables, half of which are finalized"""
+    tracemalloc.start()
+    try:
+        team_list = [team_info(f"player{i}", f"partner{i}", i) for i in range(teams)]
+        after_teams = tracemalloc.get_traced_memory()[0]
+        table_list = list()
+        for i in range(tables):
+            current = table(team_list[i % teams], team_list[(i + 1) % teams], i, "abc")
+            if i % 2:
+                current.final(team_list[i % teams], None, "xyz")
+            table_list.append(current)
+        after_tables = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return after_teams, after_tables - after_teams
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("revisions", nargs="*", default=["."], help="git revisions to measure, . is the working tree")
+    parser.add_argument("--teams", type=int, default=10000)
+    parser.add_argument("--tables", type=int, default=100000)
+    arguments = parser.parse_args()
+    for revision in arguments.revisions:
+        team_bytes, table_bytes = measure(*load_classes(revision), teams=arguments.teams, tables=arguments.tables)
+        print(f"{revision:>10}: {arguments.teams} teams {team_bytes / 1e6:.2f} MB, "
+              f"{arguments.tables} tables {table_bytes / 1e6:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
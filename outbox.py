@@ -0,0 +1,274 @@
+import asyncio
+from collections import deque
+import os
+import time
+
+from loguru import logger
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+MESSAGE_LIMIT = 4096
+# what a call returns when the message it was for has been deleted or can't be edited any more
+MISSING = object()
+
+
+class Rendered:
+    """A reply built a line at a time, where a block of lines is never split across messages
+
+    A reply with a reply_markup, pin or sent is sent in messages of its own and they go with
+    the last one: the markup is put on it, it is pinned, sent is called with it.
+    """
+    __slots__ = ("blocks", "reply_markup", "pin", "sent")
+
+    def __init__(self, *lines, reply_markup=None, pin=False, sent=None):
+        self.blocks = list(lines)
+        self.reply_markup = reply_markup
+        self.pin = pin
+        self.sent = sent
+
+    @property
+    def alone(self):
+        return self.reply_markup is not None or self.pin or self.sent is not None
+
+    def line(self, text):
+        self.blocks.append(text)
+
+    def block(self, *lines):
+        self.blocks.append("\n".join(lines))
+
+    def __str__(self):
+        return "\n".join(self.blocks) + "\n"
+
+
+class Document:
+    """A file sent as a reply, in a message of its own, and deleted once sent when remove is set"""
+    __slots__ = ("path", "caption", "filename", "remove")
+
+    def __init__(self, path, caption=None, filename=None, remove=False):
+        self.path = path
+        self.caption = caption
+        self.filename = filename
+        self.remove = remove
+
+
+def coalesce(replies, limit=MESSAGE_LIMIT):
+    """Packs replies into as few messages under limit as possible, keeping their order
+
+    A plain string reply is kept whole when it fits, a Rendered one can be broken
+    between its blocks.  Linear in the length of the replies.
+    """
+    messages = list()
+    pieces = list()
+    length = -1
+    for reply in replies:
+        blocks = reply.blocks if isinstance(reply, Rendered) else (reply,)
+        for block in blocks:
+            for piece in _split(block, limit):
+                if pieces and length + 1 + len(piece) > limit:
+                    messages.append("\n".join(pieces))
+                    pieces.clear()
+                    length = -1
+                pieces.append(piece)
+                length = length + 1 + len(piece)
+    if pieces:
+        messages.append("\n".join(pieces))
+    return messages
+
+
+def _split(text, limit):
+    """Splits a piece that is too long on its own at line breaks, or mid line when a line is too long"""
+    text = text.rstrip("\n")
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        yield text[:cut]
+        text = text[cut:].lstrip("\n")
+    if text:
+        yield text
+
+
+class TokenBucket:
+    """Allows rate sends a second, with bursts of up to capacity"""
+    __slots__ = ("rate", "capacity", "_tokens", "_updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self):
+        """Takes a token and returns how long to wait before using it"""
+        self._refill()
+        self._tokens = self._tokens - 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    @property
+    def full(self):
+        self._refill()
+        return self._tokens >= self.capacity
+
+
+class Outbox:
+    """Sends replies in the background, in order within a chat and under Telegram's flood limits
+
+    Every chat with something to send gets its own task, so a chat that is being held
+    back by its limit or a 429 doesn't hold back the others.  Groups, which have a
+    negative chat id, are allowed about 20 messages a minute; the burst comes out of
+    those 20 so a full minute stays under the limit.
+    """
+    def __init__(self, bot, chat_rate=1.0, chat_burst=3, global_rate=30.0, attempts=5, group_rate=17 / 60, group_burst=3):
+        self._bot = bot
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._group_burst = group_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._attempts = attempts
+        self._queues = dict()
+        self._buckets = dict()
+        self._senders = dict()
+
+    def send(self, chat_id, texts, message_thread_id=None):
+        """Queues the replies of one update, coalesced into as few messages as they fit in"""
+        plain = list()
+        for text in texts:
+            if isinstance(text, Document):
+                self._send_messages(chat_id, coalesce(plain), message_thread_id)
+                plain.clear()
+                # opened here so it is closed once sent, the Bot leaves a file it opens itself open
+                handle = open(text.path, "rb")
+                self._queue(chat_id, "send_document", dict(document=handle, caption=text.caption, filename=text.filename,
+                                                           message_thread_id=message_thread_id),
+                            done=lambda handle=handle, document=text: self._sent_document(handle, document))
+                continue
+            if not isinstance(text, Rendered) or not text.alone:
+                plain.append(text)
+                continue
+            self._send_messages(chat_id, coalesce(plain), message_thread_id)
+            plain.clear()
+            self._send_messages(chat_id, coalesce([text]), message_thread_id, text)
+        self._send_messages(chat_id, coalesce(plain), message_thread_id)
+
+    def edit(self, chat_id, message_id, text, after=None, missing=None):
+        """Queues replacing the text, and the buttons when text has a reply_markup, of a message already sent
+
+        after is called with the edited message, missing when the message can't be edited any
+        more, because it was deleted or is too old.
+        """
+        messages = coalesce([text])
+        if len(messages) > 1:
+            logger.warning(f"Edit of message {message_id} in chat {chat_id} is too long, only its first {MESSAGE_LIMIT} characters are kept")
+        if messages:
+            self._queue(chat_id, "edit_message_text", dict(message_id=message_id, text=messages[0],
+                                                           reply_markup=getattr(text, "reply_markup", None)), after, missing=missing)
+
+    def pin(self, chat_id, message_id):
+        self._queue(chat_id, "pin_chat_message", dict(message_id=message_id, disable_notification=True))
+
+    def unpin(self, chat_id, message_id):
+        self._queue(chat_id, "unpin_chat_message", dict(message_id=message_id))
+
+    def _send_messages(self, chat_id, messages, message_thread_id, reply=None):
+        for count, message in enumerate(messages, start=1):
+            if reply is None or count < len(messages):
+                self._queue(chat_id, "send_message", dict(text=message, message_thread_id=message_thread_id))
+            else:
+                self._queue(chat_id, "send_message", dict(text=message, message_thread_id=message_thread_id,
+                                                          reply_markup=reply.reply_markup),
+                            lambda sent, reply=reply: self._sent(chat_id, reply, sent))
+
+    def _sent(self, chat_id, reply, message):
+        if reply.pin:
+            self.pin(chat_id, message.message_id)
+        if reply.sent is not None:
+            reply.sent(message)
+
+    @staticmethod
+    def _sent_document(handle, document):
+        handle.close()
+        if document.remove:
+            os.remove(document.path)
+
+    def _queue(self, chat_id, method, arguments, after=None, done=None, missing=None):
+        """Queues a Bot method call, after is called with what it returns once it succeeds
+
+        done is called once the call leaves the queue, whether it was sent or dropped, and
+        missing when it was dropped because the message it is for is gone.
+        """
+        self._queues.setdefault(chat_id, deque()).append((method, arguments, after, done, missing))
+        if chat_id not in self._senders:
+            self._senders[chat_id] = asyncio.create_task(self._send_chat(chat_id))
+
+    async def drain(self):
+        """Waits until everything queued so far has been sent"""
+        while self._senders:
+            await asyncio.gather(*self._senders.values(), return_exceptions=True)
+
+    async def _send_chat(self, chat_id):
+        queue = self._queues[chat_id]
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self._group_rate, self._group_burst)
+            else:
+                bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._buckets[chat_id] = bucket
+        try:
+            while queue:
+                method, arguments, after, done, missing = queue[0]
+                result = await self._deliver(chat_id, bucket, method, arguments)
+                queue.popleft()
+                if done is not None:
+                    done()
+                if result is MISSING:
+                    if missing is not None:
+                        missing()
+                elif after is not None and result is not None:
+                    after(result)
+        finally:
+            del self._senders[chat_id]
+            if not queue:
+                del self._queues[chat_id]
+            # a full bucket is the same as a new one
+            if bucket.full:
+                del self._buckets[chat_id]
+
+    async def _deliver(self, chat_id, bucket, method, arguments):
+        for attempt in range(1, self._attempts + 1):
+            await asyncio.sleep(bucket.delay())
+            await asyncio.sleep(self._global.delay())
+            if hasattr(arguments.get("document"), "seek"):
+                # a retry sends the whole file again
+                arguments["document"].seek(0)
+            try:
+                return await getattr(self._bot, method)(chat_id=chat_id, **arguments)
+            except RetryAfter as error:
+                retry_after = error.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Flood limit hit sending to chat {chat_id}, retrying in {retry_after}s")
+                await asyncio.sleep(retry_after)
+            except BadRequest as error:
+                if "not modified" in str(error):
+                    # the message already shows this text
+                    return
+                if "message_id" in arguments and ("not found" in str(error) or "can't be edited" in str(error)):
+                    logger.warning(f"Message {arguments['message_id']} in chat {chat_id} is gone: {error}")
+                    return MISSING
+                logger.exception(f"Telegram refused a message for chat {chat_id}, dropping it")
+                return
+            except NetworkError as error:
+                logger.warning(f"Unable to send to chat {chat_id} ({error}), attempt {attempt} of {self._attempts}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramError:
+                logger.exception(f"Telegram refused a message for chat {chat_id}, dropping it")
+                return
+        logger.error(f"Gave up sending to chat {chat_id} after {self._attempts} attempts: {arguments.get('text', method)[:50]}")
@@ -0,0 +1,93 @@
+import csv
+import json
+
+SEPARATORS = " \t\r\n,[]"
+
+
+def write_rows(path, header, rows, form="csv"):
+    """Writes rows to path as they come, as CSV or as a JSON array of objects, returns how many there were"""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as handle:
+        if form == "csv":
+            writer = csv.writer(handle)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                count = count + 1
+        elif form == "json":
+            handle.write("[")
+            for row in rows:
+                handle.write(",\n" if count else "\n")
+                handle.write(json.dumps(dict(zip(header, row))))
+                count = count + 1
+            handle.write("\n]\n")
+        else:
+            raise ValueError(f"ERROR: Unknown format {form}, expected csv or json")
+    return count
+
+
+def read_roster(path):
+    """Yields [player, partner, team_number] for each team of a CSV or JSON roster, a row at a time
+
+    CSV rows are player, partner, team_number unless there is a header naming the columns.
+    JSON is an array of objects, or one object per line, with player, partner and team_number.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as handle:
+        start = handle.read(1024).lstrip()
+        handle.seek(0)
+        rows = _json_rows(handle) if start[:1] in ("[", "{") else _csv_rows(handle)
+        for row in rows:
+            yield row
+
+
+def _csv_rows(handle):
+    columns = None
+    first = True
+    for row in csv.reader(handle):
+        if not any(cell.strip() for cell in row):
+            continue
+        if first and "player" in (cell.strip().lower() for cell in row):
+            columns = [cell.strip().lower() for cell in row]
+            first = False
+            continue
+        first = False
+        if columns is None:
+            yield row[:3]
+        else:
+            yield _team_fields(dict(zip(columns, row)))
+
+
+def _json_rows(handle, chunk_size=1 << 16):
+    """Decodes one object at a time from chunks of the file, skipping the brackets and commas between them"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    ended = False
+    while True:
+        while position < len(buffer) and buffer[position] in SEPARATORS:
+            position = position + 1
+        if position < len(buffer):
+            try:
+                row, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if ended:
+                    raise ValueError(f"ERROR: Unable to read JSON near: {buffer[position:position + 40]}")
+            else:
+                if not isinstance(row, dict):
+                    raise ValueError(f"ERROR: Expected an object for each team, not: {json.dumps(row)[:40]}")
+                yield _team_fields(row)
+                continue
+        elif ended:
+            return
+        chunk = handle.read(chunk_size)
+        ended = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def _team_fields(row):
+    fields = list()
+    for name in ("player", "partner", "team_number"):
+        value = row.get(name)
+        fields.append("" if value is None else str(value))
+    return fields
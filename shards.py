@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime
+import multiprocessing
+from queue import Queue
+import threading
+
+from loguru import logger
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from waitlist import GotNextBot, serve
+
+
+def shard_for(chat_id, shards):
+    """Every update of a chat goes to the same worker"""
+    return chat_id % shards
+
+
+def run_worker(shard, token, connection, options):
+    """Worker process: runs a GotNextBot for the chats of one shard"""
+    date = datetime.today().strftime("%Y-%m-%d")
+    logger.add(f"Log_{date}_GotNextBot_shard_{shard}.txt")
+    logger.info(f"Shard {shard} starting")
+    bot = GotNextBot(token, **options)
+    bot.add_handlers()
+    try:
+        asyncio.run(bot.process_updates(connection))
+    finally:
+        bot.close()
+    logger.info(f"Shard {shard} stopped")
+
+
+class ShardedBot:
+    """Front process: receives the updates and hands each one to the worker owning its chat
+
+    Workers keep their chats' sessions and journals under the same chats/<chat_id>
+    directories as a single process bot, so a restarted worker picks up where it left off.
+    Each shard has its own pipe, which the front process keeps open, so updates wait in
+    it while the worker restarts.  Every worker sends its own replies, so each one gets
+    an equal share of the bot's global send rate.
+    """
+    def __init__(self, token, workers=None, base_url=None, supervise_every=1.0, global_rate=30.0, **options):
+        self._token = token
+        self._workers = workers or multiprocessing.cpu_count()
+        self._options = dict(options, base_url=base_url, global_rate=global_rate / self._workers)
+        self._supervise_every = supervise_every
+        self._context = multiprocessing.get_context("spawn")
+        # (receiving end, sending end) of each shard's pipe
+        self._pipes = [self._context.Pipe(duplex=False) for shard in range(self._workers)]
+        self._outboxes = [Queue() for shard in range(self._workers)]
+        self._processes = [None] * self._workers
+        self._supervisor = None
+
+        builder = Application.builder().token(token).post_init(self._start).post_shutdown(self._stop)
+        if base_url is not None:
+            builder = builder.base_url(base_url)
+        self._application = builder.build()
+        self._application.add_handler(TypeHandler(Update, self._route))
+
+    def _spawn(self, shard):
+        process = self._context.Process(target=run_worker, name=f"GotNextBot-shard-{shard}",
+                                        args=(shard, self._token, self._pipes[shard][0], self._options))
+        process.start()
+        self._processes[shard] = process
+        logger.info(f"Shard {shard} running as process {process.pid}")
+
+    def _feed(self, shard):
+        """Sends a shard's updates down its pipe, off the event loop since a full pipe blocks"""
+        outbox, sending = self._outboxes[shard], self._pipes[shard][1]
+        while True:
+            data = outbox.get()
+            sending.send(data)
+            if data is None and self._supervisor is None:
+                break
+
+    async def _route(self, update, context):
+        chat = update.effective_chat
+        shard = shard_for(chat.id if chat is not None else 0, self._workers)
+        self._outboxes[shard].put(update.to_dict())
+
+    def restart(self, shard):
+        """Lets a worker finish the updates it was given, the supervisor then starts a new one"""
+        self._outboxes[shard].put(None)
+
+    async def _supervise(self):
+        """Starts a new worker for any shard whose process stopped or died"""
+        while True:
+            await asyncio.sleep(self._supervise_every)
+            for shard, process in enumerate(self._processes):
+                if not process.is_alive():
+                    if process.exitcode == 0:
+                        logger.info(f"Shard {shard} stopped, restarting it")
+                    else:
+                        logger.error(f"Shard {shard} exited with {process.exitcode}, restarting it")
+                    self._spawn(shard)
+
+    async def _start(self, application):
+        for shard in range(self._workers):
+            self._spawn(shard)
+            threading.Thread(target=self._feed, args=(shard,), name=f"GotNextBot-feed-{shard}", daemon=True).start()
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def _stop(self, application):
+        self._supervisor.cancel()
+        self._supervisor = None
+        for outbox in self._outboxes:
+            outbox.put(None)
+        for process in self._processes:
+            await asyncio.to_thread(process.join)
+
+    def main(self, webhook_url=None, listen="0.0.0.0", port=8443, url_path="", cert=None, key=None, secret_token=None,
+             max_connections=40):
+        logger.debug(f"starting {self._workers} shard(s)")
+        serve(self._application, webhook_url=webhook_url, listen=listen, port=port, url_path=url_path, cert=cert, key=key,
+              secret_token=secret_token, max_connections=max_connections)
@@ -0,0 +1,598 @@
+from collections import namedtuple
+from datetime import datetime
+import glob
+import json
+import mmap
+import os
+from queue import Empty, Queue
+import re
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+
+def write_lines(path, lines):
+    """Replaces a file with the given lines without ever leaving it half written"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as write_file:
+        for line in lines:
+            write_file.write(f"{line}\n")
+        write_file.flush()
+        os.fsync(write_file.fileno())
+    os.replace(temp_path, path)
+
+
+# table | code | team1 vs team2 | winner | loser | next code | next team
+TABLE_LINE = re.compile(rb"^[ \t]*(\d+) \|[ \t]*(.*?)[ \t]*\| (\d+) vs (\d+) \| (\d+|\*) \| (\d+|\*) \|"
+                        rb"[ \t]*(.*?)[ \t]*\|[ \t]*(\d+|\*|Table Destroyed)[ \t\r]*$", re.MULTILINE)
+# team | player & partner
+TEAM_LINE = re.compile(rb"^[ \t]*(\d+) \|[ \t]*(.*?)[ \t]*&[ \t]*(.*?)[ \t\r]*$", re.MULTILINE)
+ARCHIVE_NAME = re.compile(r"Tables_(\d{4}-\d{2}-\d{2})(?:_tourney_(\d+))?\.txt$")
+
+TableRecord = namedtuple("TableRecord", "table_number invite_code team1 team2 winner loser next_invite_code next_team destroyed")
+TeamRecord = namedtuple("TeamRecord", "team_number player partner")
+
+
+def _mapped_lines(path, pattern):
+    """Yields the decoded groups of every line matching pattern, reading the file through mmap"""
+    with open(path, "rb") as read_file:
+        if os.fstat(read_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(read_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for match in pattern.finditer(mapped):
+                yield [group.decode("utf-8", "replace") for group in match.groups()]
+
+
+def _placeholder(value):
+    """'*' is written for anything that is not set yet"""
+    if value == "*":
+        return None
+    return value
+
+
+def read_tables(path):
+    """Streams the table lines of a Tables_ file, lines that don't parse are skipped"""
+    for number, code, team1, team2, winner, loser, next_code, next_team in _mapped_lines(path, TABLE_LINE):
+        destroyed = next_team == "Table Destroyed"
+        if destroyed or next_team == "*":
+            next_team = None
+        winner, loser = _placeholder(winner), _placeholder(loser)
+        yield TableRecord(int(number), code, int(team1), int(team2),
+                          None if winner is None else int(winner), None if loser is None else int(loser),
+                          _placeholder(next_code), None if next_team is None else int(next_team), destroyed)
+
+
+def read_teams(path):
+    """Streams the team lines of a Teams_ file"""
+    for number, player, partner in _mapped_lines(path, TEAM_LINE):
+        yield TeamRecord(int(number), player, _placeholder(partner))
+
+
+def table_archives(since=None, directory="."):
+    """Returns (date, path) for every Tables_ file from since on, oldest first"""
+    archives = list()
+    for path in glob.glob(os.path.join(directory, "Tables_*.txt")):
+        found = ARCHIVE_NAME.search(path)
+        if found is None:
+            continue
+        if since is not None and found.group(1) < since.strftime("%Y-%m-%d"):
+            continue
+        archives.append((found.group(1), int(found.group(2) or 0), path))
+    archives.sort()
+    return [(date, path) for date, counter, path in archives]
+
+
+class WriteBehindWriter:
+    """Writes lines to files on a background thread so handlers never wait on the disk
+
+    Writes are queued and the thread takes everything waiting in one go, keeping
+    one open handle per file.  flush_policy decides when buffered lines are
+    pushed to disk: "always" after every record, "interval" every interval_ms and
+    "quit" only when flush() or close() is called.
+    """
+    POLICIES = ("always", "interval", "quit")
+
+    def __init__(self, flush_policy="interval", interval_ms=200):
+        if flush_policy not in self.POLICIES:
+            raise ValueError(f"ERROR: Unknown flush policy {flush_policy}.  Valid policies are {self.POLICIES}")
+        self._policy = flush_policy
+        self._interval = interval_ms / 1000
+        self._queue = Queue()
+        self._files = dict()
+        self._dirty = False
+        self._last_sync = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def write(self, path, line):
+        """Queues one line to be appended to a file"""
+        self._queue.put(("write", path, line))
+
+    def replace(self, path, lines):
+        """Queues a full rewrite of a file, done in order with the appends around it"""
+        self._queue.put(("replace", path, list(lines)))
+
+    def submit(self, function, *arguments):
+        """Queues a call to run on the writer thread, in order with the file writes"""
+        self._queue.put(("call", function, arguments))
+
+    def flush(self, wait=True):
+        """Pushes everything queued so far to disk"""
+        done = threading.Event()
+        self._queue.put(("flush", done, None))
+        if wait:
+            done.wait()
+
+    def close(self):
+        """Drains the queue, syncs and closes every file"""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(("stop", None, None))
+        self._thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            timeout = None
+            if self._dirty and self._policy == "interval":
+                timeout = max(0, self._last_sync + self._interval - time.monotonic())
+            try:
+                batch = [self._queue.get(timeout=timeout)]
+            except Empty:
+                self._sync()
+                continue
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+
+            for action, target, data in batch:
+                try:
+                    if action == "write":
+                        self._file(target).write(f"{data}\n")
+                        self._dirty = True
+                        if self._policy == "always":
+                            self._sync()
+                    elif action == "replace":
+                        self._close(target)
+                        write_lines(target, data)
+                    elif action == "call":
+                        target(*data)
+                    elif action == "flush":
+                        self._sync()
+                        target.set()
+                    elif action == "stop":
+                        running = False
+                except Exception:
+                    logger.exception(f"Unable to {action} {target}")
+
+            if self._dirty and self._policy == "interval" and time.monotonic() - self._last_sync >= self._interval:
+                self._sync()
+
+        self._sync()
+        for path in list(self._files):
+            self._close(path)
+
+    def _file(self, path):
+        write_file = self._files.get(path)
+        if write_file is None:
+            write_file = open(path, "a")
+            self._files[path] = write_file
+        return write_file
+
+    def _close(self, path):
+        write_file = self._files.pop(path, None)
+        if write_file is not None:
+            write_file.close()
+
+    def _sync(self):
+        if self._dirty:
+            for write_file in self._files.values():
+                write_file.flush()
+                os.fsync(write_file.fileno())
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+
+class EventJournal:
+    """Append-only log of every change made to the bot's state
+
+    Each event is written as one compact JSON list, ["event", argument, ...], so
+    the journal can be streamed back line by line on startup.  The first line is
+    a ["journal", generation] header; the generation goes up every time a
+    snapshot is taken and the journal is started over behind it.  Whether the
+    file exists is only looked up once, loading does it off the event loop.
+    """
+    def __init__(self, path, writer):
+        self.path = path
+        self._writer = writer
+        self._generation = None
+        self._started = False
+        self._exists = None
+
+    def record(self, event, *arguments):
+        if not self._started:
+            self._started = True
+            if not self.exists:
+                self._writer.write(self.path, json.dumps(["journal", self.generation]))
+                self._exists = True
+        self._writer.write(self.path, json.dumps([event, *arguments], separators=(",", ":")))
+
+    def replay(self):
+        """Yields (event, arguments) in the order they were recorded"""
+        if not self.exists:
+            return
+        with open(self.path, "r") as read_file:
+            for line in read_file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a crash can leave the last line half written
+                    logger.warning(f"Skipping unreadable journal entry: {line}")
+                    continue
+                if entry[0] == "journal":
+                    continue
+                yield entry[0], entry[1:]
+
+    def truncate(self, generation):
+        """Starts the journal over, everything before this point is in a snapshot"""
+        self._writer.replace(self.path, [json.dumps(["journal", generation])])
+        self._generation = generation
+        self._started = True
+        self._exists = True
+
+    @property
+    def generation(self):
+        if self._generation is None:
+            self._generation = 0
+            if self.exists:
+                with open(self.path, "r") as read_file:
+                    header = read_file.readline()
+                try:
+                    entry = json.loads(header)
+                    if entry[0] == "journal":
+                        self._generation = entry[1]
+                except (ValueError, IndexError):
+                    pass
+        return self._generation
+
+    @property
+    def exists(self):
+        if self._exists is None:
+            self._exists = os.path.exists(self.path)
+        return self._exists
+
+
+class Snapshot:
+    """Point in time copy of the whole state, saved as one JSON document"""
+    def __init__(self, path, writer):
+        self.path = path
+        self._writer = writer
+
+    def save(self, state):
+        self._writer.replace(self.path, [json.dumps(state, separators=(",", ":"))])
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "r") as read_file:
+            return json.load(read_file)
+
+
+class Storage:
+    """Where teams and tables are kept beyond the current session
+
+    GotNextBot only talks to this interface.  Writes are handed to the
+    write-behind writer so handlers never wait on them.
+    """
+    def save_team(self, team):
+        """A team was created, renamed or its results changed"""
+        raise NotImplementedError
+
+    def save_teams(self, teams):
+        """Several teams were created at once, saved in one write"""
+        raise NotImplementedError
+
+    def save_table(self, table):
+        """A table was created, finished or corrected"""
+        raise NotImplementedError
+
+    def compact(self, teams, tables):
+        """Saves the whole state of the session in one go"""
+        raise NotImplementedError
+
+    def new_session(self):
+        """Starts a new game session after /quit"""
+        raise NotImplementedError
+
+    def load_teams(self):
+        """Yields (team_number, player, partner) for the teams of the current session"""
+        raise NotImplementedError
+
+    def open(self):
+        """Opens whatever the storage reads from, GameSession.load_data calls it before anything else"""
+        pass
+
+    def tables_for_team(self, team_number, since=None):
+        """Returns every table a team number played since a date, across sessions"""
+        raise NotImplementedError(f"ERROR: Table history is not available with the {self.name} storage")
+
+    def tables_for_player(self, player, since=None):
+        """Returns every table a player was part of since a date, across sessions"""
+        raise NotImplementedError(f"ERROR: Table history is not available with the {self.name} storage")
+
+    @property
+    def session_name(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TextFileStorage(Storage):
+    """The pipe delimited Teams_<date>.txt and Tables_<date>.txt files"""
+    name = "text"
+
+    def __init__(self, team_file, table_file, writer):
+        self.team_file = team_file
+        self.table_file = table_file
+        self._writer = writer
+
+    def save_team(self, team):
+        self._writer.write(self.team_file, team.team_number_details())
+
+    def save_teams(self, teams):
+        self._writer.write(self.team_file, "\n".join(team.team_number_details() for team in teams))
+
+    def save_table(self, table):
+        self._writer.write(self.table_file, table.short_info())
+
+    def compact(self, teams, tables):
+        # one line per team and per table instead of a line for every change
+        self._writer.replace(self.team_file, [team.team_number_details() for team in teams])
+        if len(tables):
+            self._writer.replace(self.table_file, [table.short_info() for table in tables])
+
+    def new_session(self):
+        base = os.path.join(self._directory, f"Tables_{datetime.today().strftime('%Y-%m-%d')}")
+        taken = set(glob.glob(f"{base}*.txt"))
+        taken.add(self.table_file)
+        table_file = f"{base}.txt"
+        counter = 1
+        while table_file in taken:
+            table_file = f"{base}_tourney_{counter}.txt"
+            counter = counter + 1
+        self.table_file = table_file
+
+    def load_teams(self):
+        if os.path.exists(self.team_file):
+            yield from read_teams(self.team_file)
+
+    def tables_for_team(self, team_number, since=None):
+        return self._history(since, lambda date: {team_number})
+
+    def tables_for_player(self, player, since=None):
+        player = player.strip().lower()
+
+        def team_numbers(date):
+            team_file = os.path.join(self._directory, f"Teams_{date}.txt")
+            if not os.path.exists(team_file):
+                return set()
+            return {team.team_number for team in read_teams(team_file)
+                    if team.player.lower() == player or (team.partner or "").lower() == player}
+        return self._history(since, team_numbers)
+
+    @property
+    def _directory(self):
+        return os.path.dirname(self.table_file) or "."
+
+    def _history(self, since, team_numbers):
+        """Scans the table archives for tables with one of the team numbers of that day"""
+        history = list()
+        numbers_by_date = dict()
+        for date, path in table_archives(since, self._directory):
+            if date not in numbers_by_date:
+                numbers_by_date = {date: team_numbers(date)}
+            numbers = numbers_by_date[date]
+            if not numbers:
+                continue
+            # a table is written again when it finishes or is corrected, the last line wins
+            tables = dict()
+            for table in read_tables(path):
+                if table.team1 in numbers or table.team2 in numbers:
+                    tables[table.table_number] = table
+                else:
+                    tables.pop(table.table_number, None)
+            for table in tables.values():
+                history.append((path, table.table_number, table.invite_code, table.team1, table.team2, table.winner,
+                                table.next_team, table.next_invite_code, int(table.winner is None), date))
+        return history
+
+    @property
+    def session_name(self):
+        return self.table_file
+
+
+class SQLiteStorage(Storage):
+    """Teams, tables and sessions in a SQLite database, kept across sessions
+
+    Writes run on the write-behind thread with their own connection.  History
+    lookups read through a second connection; WAL mode lets them run while the
+    writer is busy.  The database is only opened on first use, so creating the
+    storage never touches the disk.
+    """
+    name = "sqlite"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY,
+            started TEXT NOT NULL,
+            ended TEXT
+        );
+        CREATE TABLE IF NOT EXISTS teams (
+            session_id INTEGER NOT NULL REFERENCES sessions (id),
+            team_number INTEGER NOT NULL,
+            player TEXT NOT NULL COLLATE NOCASE,
+            partner TEXT COLLATE NOCASE,
+            wins INTEGER NOT NULL DEFAULT 0,
+            losses INTEGER NOT NULL DEFAULT 0,
+            best_win_streak INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (session_id, team_number)
+        );
+        CREATE INDEX IF NOT EXISTS teams_by_number ON teams (team_number);
+        CREATE INDEX IF NOT EXISTS teams_by_player ON teams (player);
+        CREATE INDEX IF NOT EXISTS teams_by_partner ON teams (partner);
+        CREATE TABLE IF NOT EXISTS tables (
+            session_id INTEGER NOT NULL REFERENCES sessions (id),
+            table_number INTEGER NOT NULL,
+            invite_code TEXT,
+            team1 INTEGER NOT NULL,
+            team2 INTEGER NOT NULL,
+            winner INTEGER,
+            next_team INTEGER,
+            next_invite_code TEXT,
+            active INTEGER NOT NULL,
+            played TEXT NOT NULL,
+            PRIMARY KEY (session_id, table_number)
+        );
+        CREATE INDEX IF NOT EXISTS tables_by_team1 ON tables (team1, played);
+        CREATE INDEX IF NOT EXISTS tables_by_team2 ON tables (team2, played);
+        """
+    TABLE_COLUMNS = "session_id, table_number, invite_code, team1, team2, winner, next_team, next_invite_code, active, played"
+
+    def __init__(self, path, writer):
+        self.path = path
+        self._writer = writer
+        self._connection = None
+        self._reader = None
+        self._session_id = None
+
+    def open(self):
+        if self._reader is not None:
+            return
+        self._reader = sqlite3.connect(self.path, check_same_thread=False)
+        self._reader.execute("PRAGMA journal_mode=WAL")
+        self._reader.executescript(self.SCHEMA)
+        session = self._reader.execute("SELECT id, ended FROM sessions ORDER BY id DESC LIMIT 1").fetchone()
+        if session is None or session[1] is not None:
+            self._session_id = (session[0] if session else 0) + 1
+            self._writer.submit(self._start_session, self._session_id, self._now())
+        else:
+            self._session_id = session[0]
+
+    def save_team(self, team):
+        self.open()
+        self._writer.submit(self._save_teams, self._session_id, [team.snapshot()])
+
+    def save_teams(self, teams):
+        self.open()
+        self._writer.submit(self._save_teams, self._session_id, [team.snapshot() for team in teams])
+
+    def save_table(self, table):
+        self.open()
+        self._writer.submit(self._save_tables, self._session_id, [table.snapshot()], self._now())
+
+    def compact(self, teams, tables):
+        self.open()
+        # tables are saved as they change, only the team results need catching up
+        self._writer.submit(self._save_teams, self._session_id, [team.snapshot() for team in teams])
+
+    def new_session(self):
+        self.open()
+        now = self._now()
+        self._writer.submit(self._end_session, self._session_id, now)
+        self._session_id = self._session_id + 1
+        self._writer.submit(self._start_session, self._session_id, now)
+
+    def load_teams(self):
+        self.open()
+        rows = self._reader.execute("SELECT team_number, player, partner FROM teams WHERE session_id = ? ORDER BY team_number",
+                                    (self._session_id,))
+        yield from rows
+
+    def tables_for_team(self, team_number, since=None):
+        self.open()
+        since = self._since(since)
+        # one branch per team column so each side uses its own index
+        return self._reader.execute(
+            f"SELECT {self.TABLE_COLUMNS} FROM tables WHERE team1 = :team AND played >= :since "
+            f"UNION ALL SELECT {self.TABLE_COLUMNS} FROM tables WHERE team2 = :team AND played >= :since "
+            "ORDER BY played",
+            {"team": team_number, "since": since}).fetchall()
+
+    def tables_for_player(self, player, since=None):
+        self.open()
+        since = self._since(since)
+        columns = ", ".join(f"tables.{column.strip()}" for column in self.TABLE_COLUMNS.split(","))
+        return self._reader.execute(
+            f"SELECT {columns} FROM teams JOIN tables ON tables.session_id = teams.session_id "
+            "AND (tables.team1 = teams.team_number OR tables.team2 = teams.team_number) "
+            "WHERE (teams.player = :player OR teams.partner = :player) AND tables.played >= :since "
+            "ORDER BY tables.played",
+            {"player": player.strip(), "since": since}).fetchall()
+
+    @property
+    def session_name(self):
+        self.open()
+        return f"{self.path} session {self._session_id}"
+
+    def close(self):
+        if self._reader is None:
+            return
+        self._writer.submit(self._close)
+        self._reader.close()
+        self._reader = None
+
+    @staticmethod
+    def _now():
+        return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+    @staticmethod
+    def _since(since):
+        if since is None:
+            return ""
+        return since.isoformat(sep=" ", timespec="seconds")
+
+    # everything below runs on the writer thread
+    def _execute(self, statement, parameters=(), many=False):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+        if many:
+            self._connection.executemany(statement, parameters)
+        else:
+            self._connection.execute(statement, parameters)
+        self._connection.commit()
+
+    def _start_session(self, session_id, started):
+        self._execute("INSERT OR IGNORE INTO sessions (id, started) VALUES (?, ?)", (session_id, started))
+
+    def _end_session(self, session_id, ended):
+        self._execute("UPDATE sessions SET ended = ? WHERE id = ?", (ended, session_id))
+
+    def _save_teams(self, session_id, teams):
+        rows = [(session_id, team[0], team[1], team[2], team[3], team[4], team[7]) for team in teams]
+        self._execute(
+            "INSERT INTO teams (session_id, team_number, player, partner, wins, losses, best_win_streak) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (session_id, team_number) DO UPDATE SET "
+            "player = excluded.player, partner = excluded.partner, wins = excluded.wins, "
+            "losses = excluded.losses, best_win_streak = excluded.best_win_streak",
+            rows, many=True)
+
+    def _save_tables(self, session_id, tables, played):
+        rows = [(session_id, *table, played) for table in tables]
+        self._execute(
+            f"INSERT INTO tables ({self.TABLE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (session_id, table_number) DO UPDATE SET invite_code = excluded.invite_code, "
+            "team1 = excluded.team1, team2 = excluded.team2, winner = excluded.winner, next_team = excluded.next_team, "
+            "next_invite_code = excluded.next_invite_code, active = excluded.active",
+            rows, many=True)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
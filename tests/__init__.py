@@ -0,0 +1,4 @@
+from loguru import logger
+
+# the bot logs every command, keep the test output to the results
+logger.remove()
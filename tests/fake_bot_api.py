@@ -0,0 +1,286 @@
+"""A stand-in for the Telegram Bot API that the bot can be pointed at with base_url
+
+It answers on localhost, hands out the updates pushed to it through getUpdates and
+records every call the bot makes.  It keeps the text of the messages the bot sent, so
+editing one that was deleted fails the way it does on Telegram.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from email.parser import BytesParser
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from urllib.parse import parse_qs
+
+TOKEN = "123:abcdefghijklmnopqrstuvwxyz012345678"
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "GotNextBot", "username": "gotnextbot"}
+
+
+class Call:
+    """One Bot API request: its method, its parameters, when it arrived and what it returned"""
+    __slots__ = ("method", "data", "at", "result")
+
+    def __init__(self, method, data, at):
+        self.method = method
+        self.data = data
+        self.at = at
+        self.result = None
+
+    @property
+    def chat_id(self):
+        return int(self.data["chat_id"]) if "chat_id" in self.data else None
+
+    @property
+    def text(self):
+        return self.data.get("text")
+
+
+class FakeBotAPI:
+    def __init__(self, poll_wait=0.05):
+        self.calls = list()
+        self.files = dict()
+        # (chat_id, message_id) -> text of the messages the bot has sent
+        self.messages = dict()
+        # chat_id -> message_id of the pinned message
+        self.pinned = dict()
+        # method -> retry_after of each 429 to answer with before the calls go through
+        self.flood = dict()
+        self._poll_wait = poll_wait
+        self._updates = list()
+        self._next_update_id = 0
+        self._next_message_id = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def message(self, chat_id, text=None, chat_type=None, **fields):
+        """Returns an update for a message in chat_id, commands are marked as such the way Telegram does"""
+        with self._lock:
+            self._next_update_id = self._next_update_id + 1
+            update_id = self._next_update_id
+        chat_type = chat_type or ("private" if chat_id > 0 else "group")
+        message = {"message_id": update_id, "date": int(time.time()), "from": {"id": 7, "is_bot": False, "first_name": "Ann"},
+                   "chat": {"id": chat_id, "type": chat_type, "title": "Game night"}}
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        message.update(fields)
+        return {"update_id": update_id, "message": message}
+
+    def document(self, chat_id, file_name, content, caption=None):
+        """Returns an update for a file sent to chat_id, getFile then serves content for it"""
+        file_id = f"file{len(self.files)}"
+        self.files[file_id] = content
+        document = {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name, "file_size": len(content)}
+        return self.message(chat_id, caption=caption, document=document)
+
+    def callback(self, chat_id, message_id, data):
+        """Returns an update for a press of a button with data, on message_id in chat_id"""
+        update = self.message(chat_id)
+        message = update.pop("message")
+        message["message_id"] = message_id
+        message["from"] = BOT_USER
+        message["text"] = self.messages.get((chat_id, message_id), "")
+        update["callback_query"] = {"id": str(update["update_id"]), "from": {"id": 7, "is_bot": False, "first_name": "Ann"},
+                                    "chat_instance": str(chat_id), "data": data, "message": message}
+        return update
+
+    def delete(self, chat_id, message_id):
+        """Deletes a message the way a chat admin does"""
+        with self._lock:
+            del self.messages[(chat_id, message_id)]
+            if self.pinned.get(chat_id) == message_id:
+                del self.pinned[chat_id]
+
+    def unpin(self, chat_id):
+        """Unpins the chat's pinned message the way a chat admin does"""
+        with self._lock:
+            self.pinned.pop(chat_id, None)
+
+    def push(self, *updates):
+        """Queues updates for the next getUpdates"""
+        with self._lock:
+            self._updates.extend(updates)
+
+    def sent(self, chat_id=None, method="sendMessage"):
+        """Returns the calls made with method, to chat_id when it is given"""
+        with self._lock:
+            return [call for call in self.calls if call.method == method and (chat_id is None or call.chat_id == chat_id)]
+
+    def texts(self, chat_id=None):
+        return [call.text for call in self.sent(chat_id)]
+
+    async def wait_for(self, count, chat_id=None, method="sendMessage", timeout=20):
+        """Waits until count calls with method have been made, then returns them"""
+        deadline = time.monotonic() + timeout
+        while len(self.sent(chat_id, method)) < count:
+            if time.monotonic() > deadline:
+                raise AssertionError(f"{method} was called {len(self.sent(chat_id, method))} times, expected {count}")
+            await asyncio.sleep(0.01)
+        return self.sent(chat_id, method)
+
+    def _answer(self, method, data):
+        """Returns (status, body) for one call"""
+        if self.flood.get(method):
+            retry_after = self.flood[method].pop(0)
+            return 429, {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                         "parameters": {"retry_after": retry_after}}
+        if method == "getUpdates":
+            with self._lock:
+                updates, self._updates = self._updates, list()
+            if not updates:
+                time.sleep(self._poll_wait)
+            return 200, {"ok": True, "result": updates}
+        call = Call(method, data, time.monotonic())
+        with self._lock:
+            self.calls.append(call)
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getFile":
+            file_id = data["file_id"]
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files[file_id]),
+                      "file_path": f"documents/{file_id}"}
+        elif method in ("sendMessage", "sendDocument", "editMessageText"):
+            chat_id = int(data["chat_id"])
+            with self._lock:
+                if method == "editMessageText":
+                    message_id = int(data["message_id"])
+                    if (chat_id, message_id) not in self.messages:
+                        return 400, {"ok": False, "error_code": 400, "description": "Bad Request: message to edit not found"}
+                    if self.messages[(chat_id, message_id)] == data["text"]:
+                        return 400, {"ok": False, "error_code": 400,
+                                     "description": "Bad Request: message is not modified: specified new message content and "
+                                                    "reply markup are exactly the same as a current content and reply markup "
+                                                    "of the message"}
+                else:
+                    self._next_message_id = self._next_message_id + 1
+                    message_id = self._next_message_id
+                self.messages[(chat_id, message_id)] = data.get("text", "")
+            result = {"message_id": message_id, "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"}}
+            if "text" in data:
+                result["text"] = data["text"]
+        elif method == "pinChatMessage":
+            chat_id, message_id = int(data["chat_id"]), int(data["message_id"])
+            with self._lock:
+                if (chat_id, message_id) not in self.messages:
+                    return 400, {"ok": False, "error_code": 400, "description": "Bad Request: message to pin not found"}
+                self.pinned[chat_id] = message_id
+            result = True
+        elif method == "unpinChatMessage":
+            chat_id = int(data["chat_id"])
+            with self._lock:
+                if self.pinned.get(chat_id) == int(data.get("message_id", self.pinned.get(chat_id, 0))):
+                    self.pinned.pop(chat_id, None)
+            result = True
+        elif method == "getChat":
+            chat_id = int(data["chat_id"])
+            result = {"id": chat_id, "type": "private" if chat_id > 0 else "group", "accent_color_id": 0,
+                      "max_reaction_count": 11}
+            with self._lock:
+                if chat_id in self.pinned:
+                    message_id = self.pinned[chat_id]
+                    result["pinned_message"] = {"message_id": message_id, "date": int(time.time()), "from": BOT_USER,
+                                                "chat": {"id": chat_id, "type": result["type"]},
+                                                "text": self.messages[(chat_id, message_id)]}
+        else:
+            result = True
+        call.result = result
+        return 200, {"ok": True, "result": result}
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *arguments):
+                pass
+
+            def do_GET(self):
+                # /file/bot<token>/documents/<file_id>
+                content = api.files.get(self.path.rsplit("/", 1)[1])
+                if content is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self._reply(200, "application/octet-stream", content)
+
+            def do_POST(self):
+                method = self.path.rsplit("/", 1)[1]
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, answer = api._answer(method, _parameters(self.headers.get("Content-Type", ""), body))
+                self._reply(status, "application/json", json.dumps(answer).encode())
+
+            def _reply(self, status, content_type, body):
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+
+def _parameters(content_type, body):
+    """Decodes a request's parameters, an uploaded file comes back as (filename, content)"""
+    if content_type.startswith("application/json"):
+        return json.loads(body) if body else dict()
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        parameters = dict()
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            filename = part.get_filename()
+            content = part.get_payload(decode=True)
+            parameters[name] = (filename, content) if filename is not None else content.decode()
+        return parameters
+    return {name: values[0] for name, values in parse_qs(body.decode()).items()}
+
+
+@asynccontextmanager
+async def running(application, webhook=None):
+    """Runs an Application the way run_polling and run_webhook do, without taking over the event loop or signals
+
+    webhook is the keyword arguments of Updater.start_webhook, it polls when it is None.
+    """
+    async with application:
+        if application.post_init is not None:
+            await application.post_init(application)
+        if webhook is None:
+            await application.updater.start_polling(poll_interval=0, timeout=0)
+        else:
+            await application.updater.start_webhook(**webhook)
+        await application.start()
+        try:
+            yield application
+        finally:
+            await application.updater.stop()
+            await application.stop()
+            if application.post_stop is not None:
+                await application.post_stop(application)
+    if application.post_shutdown is not None:
+        await application.post_shutdown(application)
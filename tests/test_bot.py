@@ -0,0 +1,307 @@
+import asyncio
+import csv
+from datetime import datetime, timedelta
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from outbox import Outbox
+from tests.fake_bot_api import FakeBotAPI, running, TOKEN
+from waitlist import GotNextBot
+
+
+class Tomorrow(datetime):
+    """A clock a day ahead"""
+    @classmethod
+    def today(cls):
+        return datetime.today() + timedelta(days=1)
+
+    @classmethod
+    def now(cls, tz=None):
+        return datetime.now(tz) + timedelta(days=1)
+
+
+class BotTestCase(unittest.IsolatedAsyncioTestCase):
+    """Runs a GotNextBot against a FakeBotAPI"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.api = FakeBotAPI().start()
+        self.addCleanup(self.api.stop)
+
+    def bot(self, **options):
+        bot = GotNextBot(TOKEN, base_url=self.api.base_url, directory=self.directory, flush_policy="always", **options)
+        # Telegram's flood limits would only slow the tests down
+        bot._outbox = Outbox(bot._application.bot, chat_rate=1000, chat_burst=1000, global_rate=1000, group_rate=1000,
+                             group_burst=1000)
+        bot.add_handlers()
+        self.addCleanup(bot.close)
+        return bot
+
+    def commands(self, chat_id, *texts):
+        return [self.api.message(chat_id, text) for text in texts]
+
+
+class PollingTest(BotTestCase):
+    async def test_replies_to_commands(self):
+        bot = self.bot()
+        self.api.push(*self.commands(5, "/team create ann, bob", "/team create cy, dee", "/add 0 1", "/list get"))
+        async with running(bot._application):
+            replies = await self.api.wait_for(4, chat_id=5)
+        texts = [reply.text for reply in replies]
+        self.assertIn("0 | Ann & Bob", texts[0])
+        self.assertIn("1 | Cy & Dee", texts[1])
+        self.assertIn("Number of teams on the waitlist: 2", texts[3])
+        self.assertTrue(self.api.sent(method="getMe"))
+
+    async def test_chats_are_kept_apart(self):
+        bot = self.bot()
+        self.api.push(*self.commands(5, "/team create ann, bob"), *self.commands(6, "/team create cy, dee"),
+                      *self.commands(5, "/print teams"), *self.commands(6, "/print teams"))
+        async with running(bot._application):
+            await self.api.wait_for(2, chat_id=5)
+            await self.api.wait_for(2, chat_id=6)
+        self.assertIn("Ann & Bob", self.api.texts(5)[1])
+        self.assertNotIn("Cy & Dee", self.api.texts(5)[1])
+        self.assertIn("Cy & Dee", self.api.texts(6)[1])
+        self.assertEqual(sorted(bot._sessions), [5, 6])
+
+    async def test_sessions_are_saved(self):
+        bot = self.bot()
+        self.api.push(*self.commands(5, "/team create ann, bob", "/add 0"))
+        async with running(bot._application):
+            await self.api.wait_for(2, chat_id=5)
+        bot.close()
+
+        self.api.push(*self.commands(5, "/list get"))
+        async with running(self.bot()._application):
+            replies = await self.api.wait_for(3, chat_id=5)
+        self.assertIn("Ann & @Bob", replies[2].text)
+
+    async def test_idle_sessions_are_evicted(self):
+        bot = self.bot(idle_timeout=0.2, evict_every=0.05)
+        self.api.push(*self.commands(5, "/team create ann, bob"))
+        async with running(bot._application):
+            await self.api.wait_for(1, chat_id=5)
+            self.assertEqual(list(bot._sessions), [5])
+            # no update comes in to evict it
+            await asyncio.sleep(0.5)
+            self.assertEqual(list(bot._sessions), [])
+        self.assertTrue(os.listdir(os.path.join(self.directory, "5")))
+
+    async def test_evicted_sessions_outlive_the_day(self):
+        bot = self.bot(idle_timeout=0.2, evict_every=0.05)
+        self.api.push(*self.commands(5, "/team create ann, bob", "/add 0"))
+        async with running(bot._application):
+            await self.api.wait_for(2, chat_id=5)
+            await asyncio.sleep(0.5)
+            self.assertEqual(list(bot._sessions), [])
+            # the chat comes back after midnight
+            with mock.patch("waitlist.datetime", Tomorrow):
+                self.api.push(*self.commands(5, "/print teams", "/list get"))
+                replies = await self.api.wait_for(4, chat_id=5)
+        self.assertIn("Number of teams: 1", replies[2].text)
+        self.assertIn("1 | @Ann & @Bob", replies[3].text)
+
+
+class ConcurrentUpdatesTest(BotTestCase):
+    SCRIPT = ("/team create ann, bob", "/team create cy, dee", "/team create eve, fay", "/add 0 1 2", "/table create abc",
+              "/next 0, def", "/list position 2", "/stats", "/team info 1")
+
+    async def replies(self, chats, concurrent_updates):
+        bot = self.bot(concurrent_updates=concurrent_updates)
+        # interleaved the way a busy bot gets them, chat by chat for every command
+        self.api.push(*(self.api.message(chat_id, text) for text in self.SCRIPT for chat_id in chats))
+        async with running(bot._application):
+            for chat_id in chats:
+                await self.api.wait_for(len(self.SCRIPT), chat_id=chat_id)
+        return {chat_id: self.api.texts(chat_id) for chat_id in chats}
+
+    async def test_same_replies_as_one_at_a_time(self):
+        one_at_a_time = await self.replies([1], concurrent_updates=1)
+        concurrent = await self.replies(list(range(10, 18)), concurrent_updates=64)
+        for chat_id, texts in concurrent.items():
+            self.assertEqual(texts, one_at_a_time[1], chat_id)
+
+    async def test_each_update_keeps_its_own_arguments(self):
+        bot = self.bot(concurrent_updates=64)
+        self.api.push(*self.commands(5, *(f"/team create player{number}, partner{number}" for number in range(20))))
+        async with running(bot._application):
+            replies = await self.api.wait_for(20, chat_id=5)
+        for number, reply in enumerate(replies):
+            self.assertIn(f"{number:2d} | Player{number} & Partner{number}", reply.text)
+
+
+class TablePagesTest(BotTestCase):
+    def bot_with_tables(self):
+        """A bot that will answer with 12 tables a page of 5 at a time"""
+        bot = self.bot()
+        teams = "\n".join(f"player{number}, partner{number}" for number in range(24))
+        self.api.push(*self.commands(5, f"/team create {teams}", "/add " + " ".join(str(number) for number in range(24)),
+                                     *(f"/table create code{number}" for number in range(12)), "/table all size 5"))
+        return bot
+
+    def buttons(self, call):
+        markup = call.data["reply_markup"]
+        markup = json.loads(markup) if isinstance(markup, str) else markup
+        return [(button["text"], button["callback_data"]) for button in markup["inline_keyboard"][0]]
+
+    async def test_buttons_edit_the_page(self):
+        async with running(self.bot_with_tables()._application):
+            first = (await self.api.wait_for(15, chat_id=5))[-1]
+            self.assertIn("Tables 1-5 of 12, page 1 of 3", first.text)
+            self.assertIn("11 | CODE11", first.text)
+            self.assertEqual(self.buttons(first), [("Next >", "tables:5:5:::newest:")])
+
+            message_id = first.result["message_id"]
+            self.api.push(self.api.callback(5, message_id, "tables:5:5:::newest:"))
+            edited = (await self.api.wait_for(1, chat_id=5, method="editMessageText"))[-1]
+            self.assertEqual(int(edited.data["message_id"]), message_id)
+            self.assertIn("Tables 6-10 of 12, page 2 of 3", edited.text)
+            self.assertEqual(self.buttons(edited), [("< Prev", "tables:0:5:::newest:"), ("Next >", "tables:10:5:::newest:")])
+
+            # an offset past the end, from a button on an older page, shows the last page
+            self.api.push(self.api.callback(5, message_id, "tables:40:5:::newest:"))
+            edited = (await self.api.wait_for(2, chat_id=5, method="editMessageText"))[-1]
+            self.assertIn("Tables 11-12 of 12, page 3 of 3", edited.text)
+            self.assertIn(" 0 | CODE0", edited.text)
+            self.assertEqual(self.buttons(edited), [("< Prev", "tables:5:5:::newest:")])
+            # every press is answered, so the button stops spinning
+            await self.api.wait_for(2, method="answerCallbackQuery")
+        self.assertEqual(len(self.api.sent(chat_id=5)), 15)
+
+    async def test_page_of_a_deleted_message_is_sent_again(self):
+        async with running(self.bot_with_tables()._application):
+            first = (await self.api.wait_for(15, chat_id=5))[-1]
+            self.api.delete(5, first.result["message_id"])
+            self.api.push(self.api.callback(5, first.result["message_id"], "tables:5:5:::oldest:"))
+            resent = (await self.api.wait_for(16, chat_id=5))[-1]
+            await self.api.wait_for(1, method="answerCallbackQuery")
+        self.assertIn("Tables 6-10 of 12, page 2 of 3", resent.text)
+        self.assertIn(" 5 | CODE5", resent.text)
+        self.assertEqual(self.buttons(resent), [("< Prev", "tables:0:5:::oldest:"), ("Next >", "tables:10:5:::oldest:")])
+
+
+class BoardTest(BotTestCase):
+    async def posted_board(self, bot):
+        """Starts a board for five teams and returns its message once it is pinned"""
+        teams = "\n".join(f"player{number}, partner{number}" for number in range(5))
+        self.api.push(*self.commands(5, f"/team create {teams}", "/board"))
+        await self.api.wait_for(1, chat_id=5, method="pinChatMessage")
+        return self.api.sent(chat_id=5)[-1]
+
+    async def test_burst_is_one_edit(self):
+        bot = self.bot(board_delay=0.2)
+        async with running(bot._application):
+            board = await self.posted_board(bot)
+            self.assertIn("Waitlist: 0", board.text)
+            self.api.push(*self.commands(5, *(f"/add {number}" for number in range(5))))
+            edited = await self.api.wait_for(1, chat_id=5, method="editMessageText")
+            await asyncio.sleep(0.5)
+        self.assertEqual(self.api.sent(chat_id=5, method="editMessageText"), edited)
+        self.assertEqual(int(edited[0].data["message_id"]), board.result["message_id"])
+        self.assertIn("Waitlist: 5", edited[0].text)
+        self.assertIn("5 |  4 | Player4 & Partner4", edited[0].text)
+        # it was still pinned, so it isn't pinned again
+        self.assertEqual(len(self.api.sent(chat_id=5, method="pinChatMessage")), 1)
+
+    async def test_deleted_board_is_posted_again(self):
+        bot = self.bot(board_delay=0.05)
+        async with running(bot._application):
+            board = await self.posted_board(bot)
+            self.api.delete(5, board.result["message_id"])
+            self.api.push(*self.commands(5, "/add 0"))
+            pins = await self.api.wait_for(2, chat_id=5, method="pinChatMessage")
+            reposted = self.api.sent(chat_id=5)[-1]
+        self.assertIn("Waitlist: 1", reposted.text)
+        self.assertEqual(int(pins[-1].data["message_id"]), reposted.result["message_id"])
+        self.assertEqual(self.api.pinned[5], reposted.result["message_id"])
+        self.assertEqual(bot._sessions[5].board_message_id, reposted.result["message_id"])
+
+    async def test_unpinned_board_is_pinned_again(self):
+        bot = self.bot(board_delay=0.05)
+        async with running(bot._application):
+            board = await self.posted_board(bot)
+            self.api.unpin(5)
+            self.api.push(*self.commands(5, "/add 0"))
+            pins = await self.api.wait_for(2, chat_id=5, method="pinChatMessage")
+        self.assertIn("Waitlist: 1", self.api.sent(chat_id=5, method="editMessageText")[-1].text)
+        self.assertEqual(int(pins[-1].data["message_id"]), board.result["message_id"])
+        self.assertEqual(self.api.pinned[5], board.result["message_id"])
+        # and isn't posted again
+        self.assertEqual(len([text for text in self.api.texts(5) if "Board" in text]), 1)
+
+
+class WebhookTest(BotTestCase):
+    def setUp(self):
+        super().setUp()
+        with socket.socket() as listener:
+            listener.bind(("127.0.0.1", 0))
+            self.port = listener.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}/hook"
+
+    def post(self, update, secret_token="s3cret"):
+        """Posts an update the way Telegram does, returns the HTTP status"""
+        request = Request(self.url, data=json.dumps(update).encode(),
+                          headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret_token})
+        try:
+            with urlopen(request) as response:
+                return response.status
+        except HTTPError as error:
+            return error.code
+
+    async def test_posted_updates(self):
+        bot = self.bot()
+        webhook = dict(listen="127.0.0.1", port=self.port, url_path="hook", webhook_url=self.url, secret_token="s3cret")
+        async with running(bot._application, webhook=webhook):
+            set_webhook = self.api.sent(method="setWebhook")[0]
+            self.assertEqual((set_webhook.data["url"], set_webhook.data["secret_token"]), (self.url, "s3cret"))
+            for update in self.commands(5, "/team create ann, bob", "/add 0", "/list get"):
+                self.assertEqual(await asyncio.to_thread(self.post, update), 200)
+            # an update without the secret isn't from Telegram
+            self.assertEqual(await asyncio.to_thread(self.post, self.api.message(5, "/clear all"), "guess"), 403)
+            replies = await self.api.wait_for(3, chat_id=5)
+            await asyncio.sleep(0.2)
+        self.assertEqual(len(self.api.sent(chat_id=5)), 3)
+        self.assertIn("Number of teams on the waitlist: 1", replies[2].text)
+
+
+class RosterFileTest(BotTestCase):
+    def setUp(self):
+        super().setUp()
+        # the bot's temporary files land here, so any left behind can be seen
+        self.temporary = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temporary)
+        self.addCleanup(setattr, tempfile, "tempdir", tempfile.tempdir)
+        tempfile.tempdir = self.temporary
+
+    async def test_import_then_export(self):
+        bot = self.bot()
+        roster = "player,partner,team_number\nann,bob,\ncy,,12\n"
+        # the export is sent again in full after a flood wait
+        self.api.flood["sendDocument"] = [1]
+        self.api.push(self.api.document(5, "roster.csv", roster.encode(), caption="/team import"),
+                      *self.commands(5, "/print export roster"))
+        async with running(bot._application):
+            created = await self.api.wait_for(1, chat_id=5)
+            exported = await self.api.wait_for(1, chat_id=5, method="sendDocument")
+        self.assertIn(" 0 | Ann & Bob", created[0].text)
+        self.assertIn("12 | Cy & *", created[0].text)
+        filename, content = exported[0].data["document"]
+        self.assertTrue(filename.startswith("Export_roster_") and filename.endswith(".csv"), filename)
+        self.assertEqual(exported[0].data["caption"], "Roster: 2 row(s)")
+        self.assertEqual(list(csv.reader(io.StringIO(content.decode()))),
+                         [["team_number", "player", "partner"], ["0", "ann", "bob"], ["12", "cy", ""]])
+        self.assertEqual(os.listdir(self.temporary), [])
+        self.assertFalse([name for name in os.listdir(os.path.join(self.directory, "5")) if name.startswith(("Export", "Import"))])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from waitlist import Command, PRINT_COMMANDS, Subcommands, TEAM_COMMANDS
+
+
+class CommandTest(unittest.TestCase):
+    def test_subcommand_then_arguments(self):
+        self.assertEqual(Command.parse("/team create ann, bob, 7"), ("create", "ann", " bob", " 7"))
+        self.assertEqual(Command.parse("/list"), ("",))
+        self.assertEqual(Command.parse("/list", default="get"), ("get",))
+
+    def test_without_subcommand(self):
+        self.assertEqual(Command.parse("/next 3, abc", expect_subcommand=False), ("3", " abc"))
+        self.assertEqual(Command.parse("/stats", expect_subcommand=False), ())
+
+    def test_is_its_own(self):
+        first = Command.parse("/team create ann, bob")
+        second = Command.parse("/team delete 3")
+        self.assertEqual(first, ("create", "ann", " bob"))
+        with self.assertRaises(TypeError):
+            first[1] = second[1]
+
+
+class SubcommandsTest(unittest.TestCase):
+    def setUp(self):
+        self.commands = Subcommands("demo")
+        self.commands.add("create", None, "name [number:int]", "Makes one", aliases=("new",))
+        self.commands.add("count", None, "*numbers:int", "Counts them")
+        self.commands.add("group", None, "number:int action:add|delete [group]", "Groups one")
+
+    def parse(self, text):
+        return self.commands.parse(Command.parse(text))
+
+    def test_finds_names_aliases_and_prefixes(self):
+        self.assertEqual(self.commands.find("create").name, "create")
+        self.assertEqual(self.commands.find("NEW").name, "create")
+        self.assertEqual(self.commands.find("cr").name, "create")
+        self.assertEqual(self.commands.find("g").name, "group")
+        self.assertEqual(self.commands.find("h").name, "help")
+        with self.assertRaisesRegex(ValueError, "No such subcommand delete"):
+            self.commands.find("delete")
+
+    def test_ambiguous_prefix(self):
+        with self.assertRaisesRegex(ValueError, "^ERROR: c could be count or create.  See 'demo help'"):
+            self.commands.find("c")
+        with self.assertRaisesRegex(ValueError, "^ERROR: t could be tables or teams.  See 'print help'"):
+            PRINT_COMMANDS.parse(Command.parse("/print t"))
+        # a name that is also the prefix of another is still found
+        self.assertEqual(PRINT_COMMANDS.find("list").name, "list")
+
+    def test_converts_arguments(self):
+        self.assertEqual(self.parse("/demo create ann, 7")[1], ("create", "ann", 7))
+        self.assertEqual(self.parse("/demo new ann")[1], ("create", "ann"))
+        self.assertEqual(self.parse("/demo count 1 2, 3")[1], ("count", 1, 2, 3))
+        with self.assertRaisesRegex(ValueError, "^ERROR: number has to be a number, not seven.  "
+                                                "/demo create <name>, \\[<number>\\]$"):
+            self.parse("/demo create ann, seven")
+        with self.assertRaisesRegex(ValueError, "^ERROR: numbers has to be a number, not x"):
+            self.parse("/demo count 1 x")
+        with self.assertRaisesRegex(ValueError, "^ERROR: Not enough parameters.  /demo count <numbers...>$"):
+            self.parse("/demo count")
+        with self.assertRaisesRegex(ValueError, "^ERROR: Not enough parameters"):
+            self.parse("/demo create")
+
+    def test_choices(self):
+        self.assertEqual(self.parse("/demo group 3, add, vip")[1], ("group", 3, "add", "vip"))
+        self.assertEqual(self.parse("/demo group 3, DEL")[1], ("group", 3, "delete"))
+        with self.assertRaisesRegex(ValueError, "^ERROR: action has to be add or delete, not move.  "
+                                                "/demo group <number>, <add\\|delete>, \\[<group>\\]$"):
+            self.parse("/demo group 3, move, vip")
+        with self.assertRaisesRegex(ValueError, "^ERROR: Not enough parameters.  /team group"):
+            TEAM_COMMANDS.parse(Command.parse("/team group 3, add"))
+
+    def test_help(self):
+        self.assertEqual(self.commands.help(), "create   <name>, [<number>] -> Makes one\n"
+                                               "count    <numbers...> -> Counts them\n"
+                                               "group    <number>, <add|delete>, [<group>] -> Groups one\n"
+                                               "help     -> Displays commands for the demo command\n")
+        with self.assertRaisesRegex(ValueError, "Unknown kind float"):
+            self.commands.add("bad", None, "amount:float")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+from types import SimpleNamespace
+import time
+import unittest
+
+from telegram import Bot
+
+from outbox import coalesce, Outbox, Rendered
+from tests.fake_bot_api import FakeBotAPI, TOKEN
+
+
+class CoalesceTest(unittest.TestCase):
+    def test_packs_replies_in_order(self):
+        self.assertEqual(coalesce(["one", "two\n", Rendered("three", "four")]), ["one\ntwo\nthree\nfour"])
+        self.assertEqual(coalesce([]), [])
+
+    def test_starts_a_new_message_at_the_limit(self):
+        self.assertEqual(coalesce(["a" * 6, "b" * 6, "c" * 3], limit=10), ["a" * 6, "b" * 6 + "\n" + "c" * 3])
+
+    def test_keeps_blocks_together(self):
+        reply = Rendered()
+        reply.block("1 | a", "2 | b")
+        reply.block("3 | c", "4 | d")
+        self.assertEqual(coalesce(["title", reply], limit=17), ["title\n1 | a\n2 | b", "3 | c\n4 | d"])
+
+    def test_splits_what_can_not_fit(self):
+        self.assertEqual(coalesce(["abc\ndef\ngh"], limit=5), ["abc", "def", "gh"])
+        self.assertEqual(coalesce(["x" * 12], limit=5), ["xxxxx", "xxxxx", "xx"])
+
+    def test_every_message_fits(self):
+        replies = [Rendered(*(f"{number:4d} | player{number} & partner{number}" for number in range(1000))), "done"]
+        messages = coalesce(replies)
+        self.assertTrue(all(len(message) <= 4096 for message in messages))
+        self.assertEqual("\n".join(messages), "\n".join(replies[0].blocks + ["done"]))
+
+
+class RecordingBot:
+    """Takes the Bot calls an Outbox makes and notes when each one came"""
+    def __init__(self):
+        self.calls = list()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return self._record("send_message", chat_id, text)
+
+    async def edit_message_text(self, chat_id, text, message_id, **kwargs):
+        return self._record("edit_message_text", chat_id, text)
+
+    async def pin_chat_message(self, chat_id, message_id, **kwargs):
+        return self._record("pin_chat_message", chat_id, message_id)
+
+    def _record(self, method, chat_id, value):
+        self.calls.append((time.monotonic(), method, chat_id, value))
+        return SimpleNamespace(message_id=len(self.calls))
+
+    def times(self, chat_id):
+        return [at for at, method, called_chat_id, value in self.calls if called_chat_id == chat_id]
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    async def test_one_message_per_update(self):
+        bot = RecordingBot()
+        outbox = Outbox(bot)
+        outbox.send(5, ["TEAM CREATED", Rendered("0 | Ann & Bob"), "Added to the waitlist"])
+        outbox.send(5, [Rendered("board", pin=True)])
+        await outbox.drain()
+        self.assertEqual([call[1:] for call in bot.calls], [
+            ("send_message", 5, "TEAM CREATED\n0 | Ann & Bob\nAdded to the waitlist"), ("send_message", 5, "board"),
+            ("pin_chat_message", 5, 2)])
+
+    async def test_chat_rate(self):
+        bot = RecordingBot()
+        outbox = Outbox(bot, chat_rate=20, chat_burst=2, global_rate=1000)
+        started = time.monotonic()
+        for count in range(6):
+            outbox.send(5, [f"message {count}"])
+        outbox.send(6, ["another chat"])
+        await outbox.drain()
+        times = bot.times(5)
+        self.assertEqual([value for at, method, chat_id, value in bot.calls if chat_id == 5],
+                         [f"message {count}" for count in range(6)])
+        # the burst goes at once, the rest at the chat's rate
+        self.assertLess(times[1] - started, 0.03)
+        self.assertGreaterEqual(times[-1] - started, 4 / 20 - 0.01)
+        # and a chat being held back doesn't hold the others back
+        self.assertLess(bot.times(6)[0] - started, 0.03)
+
+    async def test_group_rate(self):
+        bot = RecordingBot()
+        outbox = Outbox(bot, chat_rate=1000, chat_burst=1000, global_rate=1000, group_rate=10, group_burst=1)
+        started = time.monotonic()
+        for count in range(4):
+            outbox.send(-100, [f"message {count}"])
+            outbox.send(100, [f"message {count}"])
+        await outbox.drain()
+        self.assertLess(bot.times(100)[-1] - started, 0.03)
+        self.assertGreaterEqual(bot.times(-100)[-1] - started, 3 / 10 - 0.01)
+
+    async def test_global_rate(self):
+        bot = RecordingBot()
+        outbox = Outbox(bot, chat_rate=1000, chat_burst=1000, global_rate=10)
+        started = time.monotonic()
+        for chat_id in range(15):
+            outbox.send(chat_id, ["hello"])
+        await outbox.drain()
+        self.assertGreaterEqual(max(at for at, *call in bot.calls) - started, 5 / 10 - 0.01)
+
+    async def test_retry_after(self):
+        api = FakeBotAPI().start()
+        self.addCleanup(api.stop)
+        api.flood["sendMessage"] = [1]
+        async with Bot(TOKEN, base_url=api.base_url) as bot:
+            outbox = Outbox(bot)
+            started = time.monotonic()
+            outbox.send(5, ["first"])
+            outbox.send(5, ["second"])
+            await outbox.drain()
+        self.assertEqual(api.texts(5), ["first", "second"])
+        self.assertGreaterEqual(api.sent(5)[0].at - started, 1)
+
+if __name__ == "__main__":
+    unittest.main()
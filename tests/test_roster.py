@@ -0,0 +1,50 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from roster import read_roster, write_rows
+
+
+class RosterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as write_file:
+            write_file.write(text)
+        return path
+
+    def test_round_trip(self):
+        rows = [("ann", "bob", 0), ("cy", "", 7)]
+        for form in ("csv", "json"):
+            path = os.path.join(self.directory, f"roster.{form}")
+            self.assertEqual(write_rows(path, ("player", "partner", "team_number"), iter(rows), form), 2)
+            self.assertEqual(list(read_roster(path)), [["ann", "bob", "0"], ["cy", "", "7"]])
+
+    def test_csv_columns(self):
+        self.assertEqual(list(read_roster(self.write("plain.csv", "ann,bob\n\ncy,dee,4\n"))), [["ann", "bob"], ["cy", "dee", "4"]])
+        path = self.write("header.csv", "team_number,Partner,Player\n3,bob,ann\n")
+        self.assertEqual(list(read_roster(path)), [["ann", "bob", "3"]])
+
+    def test_json_lines_and_chunks(self):
+        teams = [{"player": f"player{number}", "partner": None, "team_number": number} for number in range(50)]
+        path = self.write("lines.json", "\n".join(json.dumps(team) for team in teams))
+        self.assertEqual(list(read_roster(path)), [[f"player{number}", "", str(number)] for number in range(50)])
+
+    def test_bad_json(self):
+        with self.assertRaises(ValueError):
+            list(read_roster(self.write("bad.json", '[{"player": "ann"}, {"player": ')))
+        with self.assertRaises(ValueError):
+            list(read_roster(self.write("list.json", '[["ann", "bob"]]')))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            write_rows(os.path.join(self.directory, "roster.xml"), ("player",), [], "xml")
+
+
+if __name__ == "__main__":
+    unittest.main()
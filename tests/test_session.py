@@ -0,0 +1,228 @@
+import asyncio
+import random
+import shutil
+from types import SimpleNamespace
+import tempfile
+import unittest
+
+from storage import WriteBehindWriter
+from waitlist import BufferedUpdate, GameSession
+
+HANDLERS = {"/add": GameSession.add_waitlist, "/clear": GameSession.clear_commands, "/list": GameSession.list_commands,
+            "/next": GameSession.next_team_to_table, "/play": GameSession.gameplay_commands,
+            "/print": GameSession.print_commands, "/quit": GameSession.quit, "/stats": GameSession.print_stats,
+            "/table": GameSession.table_commands, "/team": GameSession.team_commands}
+# everything a session shows about its state
+VIEWS = ("/print teams", "/print all", "/print tables oldest, size 15", "/stats", "/list get", "/print groups", "/play")
+
+
+def command(session, text):
+    """Runs one command the way GotNextBot does and returns the replies"""
+    message = SimpleNamespace(text=text, caption=None, document=None, reply_to_message=None)
+    update = BufferedUpdate(SimpleNamespace(message=message, effective_chat=SimpleNamespace(id=session.chat_id),
+                                            callback_query=None))
+    asyncio.run(HANDLERS[text.split()[0]](session, update, None))
+    return [str(reply) for reply in update.replies]
+
+
+class SessionTestCase(unittest.TestCase):
+    storage = "text"
+    flush_policy = "always"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.writer = WriteBehindWriter(flush_policy=self.flush_policy)
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.directory)
+
+    def session(self):
+        return GameSession(42, self.writer, storage=self.storage, directory=self.directory)
+
+    def reload(self):
+        """Flushes what has been written and loads it into a new session"""
+        self.writer.flush()
+        session = self.session()
+        session.load_data()
+        return session
+
+    def views(self, session):
+        return [command(session, text) for text in VIEWS]
+
+    def play(self, session, games, seed=3):
+        """Plays games at random, deleting a seated team halfway through and making a new one"""
+        rng = random.Random(seed)
+        for number in range(8):
+            command(session, f"/team create player{number}, partner{number}")
+        command(session, "/add " + " ".join(str(number) for number in range(8)))
+        for code in ("abc", "def", "ghi"):
+            command(session, f"/table create {code}")
+        command(session, "/team group 1, add, vip")
+        for game in range(games):
+            if game == games // 2:
+                seated = min(session._tables._active)
+                command(session, f"/team delete {seated}")
+                command(session, "/team create new, guy")
+            winners = [number for number in sorted(session._tables._active) if number in session._teams]
+            replies = command(session, f"/next {rng.choice(winners)}, g{game}")
+            self.assertFalse([reply for reply in replies if "ERROR" in reply], replies)
+
+    def play_more(self, session):
+        command(session, "/team create late, comer")
+        command(session, "/add 8")
+        winners = sorted(session._tables._active)
+        command(session, f"/next {winners[0]}, zzz")
+
+
+class JournalReplayTest(SessionTestCase):
+    def test_replay_matches(self):
+        session = self.session()
+        self.play(session, 60)
+        command(session, "/team wins 4, 2")
+        command(session, "/list remove 6")
+        command(session, "/play shark")
+        self.assertEqual(self.views(self.reload()), self.views(session))
+
+    def test_snapshot_matches(self):
+        session = self.session()
+        session._snapshot_every = 25
+        self.play(session, 60)
+        self.assertGreater(session._journal.generation, 0)
+        reloaded = self.reload()
+        self.assertEqual(self.views(reloaded), self.views(session))
+        # numbers are handed out the same way after the reload
+        self.assertEqual(command(reloaded, "/team create one, more"), command(session, "/team create one, more"))
+
+    def test_compact_then_replay(self):
+        session = self.session()
+        self.play(session, 30)
+        session._compact()
+        self.play_more(session)
+        self.assertEqual(self.views(self.reload()), self.views(session))
+
+    def test_quit_starts_over(self):
+        session = self.session()
+        command(session, "/team create ann, bob")
+        command(session, "/team wins 0, 3")
+        self.assertIn("Tables cleared and team scores have been reset.", command(session, "/quit"))
+        command(session, "/team create cy, dee")
+        reloaded = self.reload()
+        self.assertEqual(self.views(reloaded), self.views(session))
+        self.assertEqual([team.wins for team in reloaded._teams], [0, 0])
+        self.assertEqual(reloaded._storage.session_name, session._storage.session_name)
+
+
+class SQLiteJournalReplayTest(JournalReplayTest):
+    storage = "sqlite"
+
+
+class RenderTest(SessionTestCase):
+    def test_views_follow_changes(self):
+        session = self.session()
+        command(session, "/team create ann, bob")
+        self.assertEqual(command(session, "/print teams"), command(session, "/print teams"))
+        command(session, "/team update 0, cy, dee")
+        self.assertIn(" 0 | Cy & Dee", command(session, "/print teams")[0])
+        command(session, "/team wins 0, 2")
+        self.assertIn("   2 |    0 | Cy & Dee", command(session, "/stats")[0])
+
+    def test_tables_are_let_go(self):
+        session = self.session()
+        command(session, "/team create ann, bob")
+        command(session, "/team create cy, dee")
+        command(session, "/add 0 1")
+        command(session, "/table create abc")
+        command(session, "/print tables")
+        self.assertTrue([key for key in session._renders._rows if key[0] == "table"])
+        command(session, "/quit")
+        command(session, "/next 0, -")
+        self.assertIn("Tables cleared and team scores have been reset.", command(session, "/quit"))
+        self.assertFalse([key for key in session._renders._rows if key[0] == "table"])
+        session.close()
+        self.assertEqual(session._renders._rows, {})
+
+
+class HistoryTest(SessionTestCase):
+    # nothing reaches the disk unless it is asked for
+    flush_policy = "quit"
+
+    def history(self, session, text):
+        """Returns (table number, teams, winner) for each table /team history lists"""
+        rows = [line.split(" | ") for reply in command(session, text) for line in reply.splitlines()]
+        return [(int(row[1]), row[3], row[4]) for row in rows if len(row) == 5 and row[1].isdigit()]
+
+    def test_tables_of_this_session(self):
+        session = self.session()
+        for players in ("ann, bob", "cy, dee", "eve, fay"):
+            command(session, f"/team create {players}")
+        command(session, "/add 0 1 2")
+        command(session, "/table create abc")
+        command(session, "/next 0, def")
+        self.assertEqual(self.history(session, "/team history 0"), [(0, "0 vs 1", "0"), (1, "0 vs 2", "Active")])
+        self.assertEqual(self.history(session, "/team history 1, 7"), [(0, "0 vs 1", "0")])
+        self.assertEqual(self.history(session, "/team history EVE"), [(1, "0 vs 2", "Active")])
+        self.assertEqual(self.history(session, "/team history 5"), [])
+        self.assertIn("ERROR: days has to be a number", command(session, "/team history 0, week")[0])
+
+
+class SQLiteHistoryTest(HistoryTest):
+    storage = "sqlite"
+
+
+class ClearTest(SessionTestCase):
+    def test_all_clears_the_waitlist(self):
+        session = self.session()
+        command(session, "/team create ann, bob")
+        command(session, "/team create cy, dee")
+        command(session, "/add 0 1")
+        command(session, "/team group 0, add, vip")
+        self.assertEqual(command(session, "/clear all"), ["Teams cleared", "Tables cleared", "Groups cleared",
+                                                          "Waitlist cleared"])
+        self.assertEqual(session._waitlist.size, 0)
+        self.assertEqual(self.views(self.reload()), self.views(session))
+
+
+class GroupTest(SessionTestCase):
+    def test_add_and_delete(self):
+        session = self.session()
+        command(session, "/team create ann, bob")
+        self.assertEqual(command(session, "/team group 0, add, vip"), ["Team 0 has been added to group: vip"])
+        self.assertEqual(command(session, "/team group 0, del, vip"), ["Team 0 has been removed from group: vip"])
+        self.assertEqual(command(session, "/team group 0, delete, vip"), ["Team 0 was never apart of group: vip"])
+        self.assertEqual(command(session, "/team group 4, add, vip"), ["ERROR: Team #4 was not found"])
+
+    def test_unknown_action_is_answered(self):
+        session = self.session()
+        command(session, "/team create ann, bob")
+        replies = command(session, "/team group 0, join, vip")
+        self.assertEqual(replies, ["ERROR: action has to be add or delete, not join.  "
+                                   "/team group <team_number>, <add|delete>, <group>"])
+
+
+class StatsTest(SessionTestCase):
+    def ranked(self, session, text):
+        """Returns the team numbers of a ranked /stats listing, in rank order"""
+        rows = [line.split("|") for reply in command(session, text) for line in reply.splitlines()]
+        return [int(row[1]) for row in rows if len(row) > 6 and row[1].strip().isdigit()]
+
+    def test_top_breaks_ties_and_follows_results(self):
+        session = self.session()
+        for number in range(4):
+            command(session, f"/team create player{number}, partner{number}")
+        for text in ("/team wins 2", "/team losses 2", "/team wins 1, 2", "/team wins 0, 2"):
+            command(session, text)
+        # 0 and 1 are both 2-0, the lower team number goes first
+        self.assertEqual(self.ranked(session, "/stats top 3"), [0, 1, 2])
+        command(session, "/team losses 0, 2")
+        # 0 is now 2-2 and level with 2 at 50%, but has more wins
+        self.assertEqual(self.ranked(session, "/stats top"), [1, 0, 2, 3])
+        command(session, "/team wins 3, 5")
+        # level at 100%, 3 has more wins
+        self.assertEqual(self.ranked(session, "/stats top 2"), [3, 1])
+        # level at 2 wins, 1 has fewer losses
+        self.assertEqual(self.ranked(session, "/stats wins"), [3, 1, 0, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+from shards import shard_for, ShardedBot
+from tests.fake_bot_api import FakeBotAPI, running, TOKEN
+
+
+class ShardForTest(unittest.TestCase):
+    def test_chat_stays_on_its_shard(self):
+        for chat_id in (5, -1001234567890, 0, 77):
+            self.assertEqual(shard_for(chat_id, 4), shard_for(chat_id, 4))
+            self.assertIn(shard_for(chat_id, 4), range(4))
+        self.assertEqual(sorted({shard_for(chat_id, 4) for chat_id in range(100, 140)}), [0, 1, 2, 3])
+
+    def test_global_rate_is_shared(self):
+        bot = ShardedBot(TOKEN, workers=3, global_rate=30.0)
+        self.assertEqual(bot._options["global_rate"], 10.0)
+
+
+class ShardedBotTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # workers write their logs where they are started
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory)
+        self.api = FakeBotAPI().start()
+        self.addCleanup(self.api.stop)
+
+    async def test_workers_answer_their_chats(self):
+        bot = ShardedBot(TOKEN, workers=2, base_url=self.api.base_url, directory=os.path.join(self.directory, "chats"),
+                         flush_policy="always", supervise_every=0.1)
+        chats = (10, 11, 12, 13)
+        async with running(bot._application):
+            self.api.push(*(self.api.message(chat_id, f"/team create ann{chat_id}, bob") for chat_id in chats))
+            for chat_id in chats:
+                await self.api.wait_for(1, chat_id=chat_id)
+
+            # a worker that dies is started again, and its chats' sessions are loaded from their journals
+            crashed = bot._processes[1]
+            os.kill(crashed.pid, signal.SIGKILL)
+            self.api.push(*(self.api.message(chat_id, "/print teams") for chat_id in chats))
+            for chat_id in chats:
+                replies = await self.api.wait_for(2, chat_id=chat_id)
+                self.assertIn(f"0 | Ann{chat_id} & Bob", replies[1].text)
+            self.assertIsNot(bot._processes[1], crashed)
+        self.assertEqual([process.exitcode for process in bot._processes], [0, 0])
+        self.assertEqual(sorted(os.listdir("chats")), [str(chat_id) for chat_id in chats])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from storage import EventJournal, read_tables, read_teams, Snapshot, TableRecord, TeamRecord, WriteBehindWriter
+from waitlist import Table, TeamInfo
+
+
+class StorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.writer = WriteBehindWriter(flush_policy="always")
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+
+class ReadArchivesTest(StorageTestCase):
+    def test_read_tables(self):
+        teams = [TeamInfo(f"player{number}", None if number == 2 else f"partner{number}", number) for number in range(4)]
+        waiting = Table(teams[0], teams[1], 0, "abc")
+        finished = Table(teams[0], teams[1], 1, "def")
+        finished.final(teams[1], teams[2], "ghi")
+        destroyed = Table(teams[2], teams[3], 12, "jkl")
+        destroyed.final(teams[2], None)
+        path = self.path("Tables_2024-01-05.txt")
+        for table in (waiting, finished, destroyed):
+            self.writer.write(path, table.short_info())
+        self.writer.write(path, "not | a table")
+        self.writer.flush()
+        self.assertEqual(list(read_tables(path)), [
+            TableRecord(0, "ABC", 0, 1, None, None, None, None, False),
+            TableRecord(1, "DEF", 0, 1, 1, 0, "GHI", 2, False),
+            TableRecord(12, "JKL", 2, 3, 2, 3, "", None, True),
+        ])
+
+    def test_read_teams(self):
+        path = self.path("Teams_2024-01-05.txt")
+        for team in (TeamInfo("ann", "bob", 0), TeamInfo("cy", team_number=17)):
+            self.writer.write(path, team.team_number_details())
+        self.writer.flush()
+        self.assertEqual(list(read_teams(path)), [TeamRecord(0, "Ann", "Bob"), TeamRecord(17, "Cy", None)])
+
+    def test_empty_file(self):
+        path = self.path("Tables_2024-01-05.txt")
+        open(path, "w").close()
+        self.assertEqual(list(read_tables(path)), [])
+
+
+class JournalTest(StorageTestCase):
+    def test_round_trip(self):
+        journal = EventJournal(self.path("Journal.txt"), self.writer)
+        journal.record("team_create", 0, "ann", "bob")
+        journal.record("list_add", 0)
+        journal.record("table_final", 3, 0, None, "abc")
+        self.writer.flush()
+        replayed = EventJournal(self.path("Journal.txt"), self.writer)
+        self.assertEqual(replayed.generation, 0)
+        self.assertEqual(list(replayed.replay()), [
+            ("team_create", [0, "ann", "bob"]), ("list_add", [0]), ("table_final", [3, 0, None, "abc"])])
+
+    def test_truncate_starts_a_generation(self):
+        journal = EventJournal(self.path("Journal.txt"), self.writer)
+        journal.record("list_add", 0)
+        journal.truncate(4)
+        journal.record("list_add", 1)
+        self.writer.flush()
+        replayed = EventJournal(self.path("Journal.txt"), self.writer)
+        self.assertEqual(replayed.generation, 4)
+        self.assertEqual(list(replayed.replay()), [("list_add", [1])])
+
+    def test_skips_a_half_written_line(self):
+        path = self.path("Journal.txt")
+        with open(path, "w") as write_file:
+            write_file.write('["journal",0]\n["list_add",0]\n["list_ad')
+        self.assertEqual(list(EventJournal(path, self.writer).replay()), [("list_add", [0])])
+
+    def test_snapshot_round_trip(self):
+        snapshot = Snapshot(self.path("Snapshot.json"), self.writer)
+        self.assertIsNone(snapshot.load())
+        state = {"generation": 1, "teams": [TeamInfo("ann", "bob", 0).snapshot()], "waitlist": [0]}
+        snapshot.save(state)
+        self.writer.flush()
+        self.assertEqual(Snapshot(self.path("Snapshot.json"), self.writer).load(), state)
+
+
+if __name__ == "__main__":
+    unittest.main()
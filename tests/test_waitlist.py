@@ -0,0 +1,231 @@
+import random
+import unittest
+
+from waitlist import Leaderboard, RematchMatchmaker, RenderCache, TeamInfo, TeamNumberAllocator, TeamRegistry, WaitList
+
+
+def teams(count):
+    return [TeamInfo(f"player{number}", f"partner{number}", number) for number in range(count)]
+
+
+class WaitListTest(unittest.TestCase):
+    def test_first_in_first_out(self):
+        waitlist = WaitList()
+        first, second, third = teams(3)
+        for team in (first, second, third):
+            self.assertTrue(waitlist.add(team))
+        self.assertFalse(waitlist.add(second))
+        self.assertEqual(waitlist.get(2), [first, second])
+        self.assertEqual(list(waitlist), [third])
+        with self.assertRaises(Exception):
+            waitlist.get(2)
+
+    def test_positions_after_removals(self):
+        waitlist = WaitList()
+        team_list = teams(5)
+        for team in team_list:
+            waitlist.add(team)
+        waitlist.remove_team(team_list[1])
+        self.assertEqual([waitlist.position(team.team_number) for team in team_list], [1, None, 2, 3, 4])
+        self.assertNotIn(1, waitlist)
+        with self.assertRaises(ValueError):
+            waitlist.remove_team(team_list[1])
+
+    def test_take_counts_skips(self):
+        waitlist = WaitList()
+        first, second, third = teams(3)
+        for team in (first, second, third):
+            waitlist.add(team)
+        waitlist.take(third)
+        self.assertEqual((waitlist.skips(0), waitlist.skips(1), waitlist.skips(2)), (1, 1, 0))
+        self.assertEqual(waitlist.get(), [first])
+        self.assertEqual(waitlist.skips(0), 0)
+        waitlist.add(first, skips=2)
+        self.assertEqual(waitlist.skips(0), 2)
+
+    def test_matches_a_list(self):
+        """Random adds, gets and removes against a plain list, past several ticket rebuilds"""
+        rng = random.Random(12)
+        team_list = teams(200)
+        waitlist = WaitList()
+        expected = list()
+        for step in range(5000):
+            team = rng.choice(team_list)
+            roll = rng.random()
+            if roll < 0.5:
+                self.assertEqual(waitlist.add(team), team not in expected)
+                if team not in expected:
+                    expected.append(team)
+            elif roll < 0.7 and expected:
+                self.assertIs(waitlist.get()[0], expected.pop(0))
+            elif team in expected:
+                waitlist.remove_team(team)
+                expected.remove(team)
+            for team in rng.sample(team_list, 5):
+                position = expected.index(team) + 1 if team in expected else None
+                self.assertEqual(waitlist.position(team.team_number), position)
+        self.assertEqual(list(waitlist), expected)
+        self.assertEqual(waitlist.size, len(expected))
+
+
+class RematchMatchmakerTest(unittest.TestCase):
+    def waitlist(self, team_list):
+        waitlist = WaitList()
+        for team in team_list:
+            waitlist.add(team)
+        return waitlist
+
+    def pair(self, matchmaker, waitlist, team):
+        """Takes the opponent matchmaker finds for team off the waitlist, the way a table is filled"""
+        opponent = matchmaker.opponent(waitlist, team)
+        waitlist.take(opponent)
+        return opponent.team_number
+
+    def test_looks_as_far_as_the_window(self):
+        team_list = teams(5)
+        team_list[0].teams_played.update((1, 2, 3))
+        self.assertEqual(RematchMatchmaker(window=3).opponent(self.waitlist(team_list[1:]), team_list[0]), team_list[1])
+        self.assertEqual(RematchMatchmaker(window=4).opponent(self.waitlist(team_list[1:]), team_list[0]), team_list[4])
+        # the team itself doesn't take up the window
+        self.assertEqual(RematchMatchmaker(window=4).opponent(self.waitlist(team_list), team_list[0]), team_list[4])
+        with self.assertRaises(Exception):
+            RematchMatchmaker().opponent(self.waitlist(team_list[:1]), team_list[0])
+
+    def test_first_team_is_taken_once_skipped_enough(self):
+        team_list = teams(6)
+        winner = team_list[0]
+        winner.teams_played.add(1)
+        waitlist = self.waitlist(team_list[1:])
+        matchmaker = RematchMatchmaker(max_skips=2)
+        self.assertEqual([self.pair(matchmaker, waitlist, winner) for _ in range(2)], [2, 3])
+        self.assertEqual(waitlist.skips(1), 2)
+        self.assertEqual(self.pair(matchmaker, waitlist, winner), 1)
+        # a team taken starts over when it comes back, and is skipped again
+        self.assertEqual(waitlist.skips(1), 0)
+        waitlist.add(team_list[1])
+        self.assertEqual(waitlist.skips(1), 0)
+        self.assertEqual([self.pair(matchmaker, waitlist, winner) for _ in range(2)], [4, 5])
+        self.assertEqual(waitlist.skips(1), 0)
+        self.assertEqual(self.pair(matchmaker, waitlist, winner), 1)
+
+    def test_skips_are_shared_by_the_teams_passed(self):
+        team_list = teams(5)
+        winner = team_list[0]
+        winner.teams_played.update((1, 2))
+        waitlist = self.waitlist(team_list[1:])
+        matchmaker = RematchMatchmaker(max_skips=1)
+        self.assertEqual(self.pair(matchmaker, waitlist, winner), 3)
+        self.assertEqual((waitlist.skips(1), waitlist.skips(2), waitlist.skips(4)), (1, 1, 0))
+        # only the first team is let through, 2 still waits behind it
+        self.assertEqual(self.pair(matchmaker, waitlist, winner), 1)
+        self.assertEqual(self.pair(matchmaker, waitlist, winner), 2)
+
+
+class LeaderboardTest(unittest.TestCase):
+    def test_orderings_follow_results(self):
+        """Every ordering matches a full sort after each win or loss"""
+        rng = random.Random(5)
+        registry = TeamRegistry()
+        for team in teams(30):
+            registry.add(team)
+        for step in range(2000):
+            team = rng.choice(list(registry))
+            amount = rng.choice((1, 1, -1))
+            if rng.random() < 0.5:
+                team.edit_wins(amount)
+            else:
+                team.edit_losses(amount)
+            for ordering, key in Leaderboard.ORDERINGS.items():
+                self.assertEqual(registry.leaderboard.top(ordering=ordering), sorted(registry, key=key))
+
+    def test_rank_and_remove(self):
+        leaderboard = Leaderboard()
+        team_list = teams(3)
+        for team in team_list:
+            leaderboard.add(team)
+        team_list[2].edit_wins(2)
+        team_list[1].edit_wins()
+        team_list[1].edit_losses()
+        self.assertEqual([leaderboard.rank(team.team_number) for team in team_list], [3, 2, 1])
+        self.assertEqual(leaderboard.top(1, ordering="wins"), [team_list[2]])
+        leaderboard.remove(2)
+        self.assertIsNone(leaderboard.rank(2))
+        self.assertEqual(leaderboard.rank(1), 1)
+        # a removed team no longer moves the board
+        team_list[2].edit_wins(5)
+        self.assertEqual(len(leaderboard), 2)
+
+    def test_paused_while_replaying(self):
+        leaderboard = Leaderboard()
+        team_list = teams(3)
+        leaderboard.pause()
+        for team in team_list:
+            leaderboard.add(team)
+        team_list[1].edit_wins(3)
+        leaderboard.resume()
+        self.assertEqual(leaderboard.top(ordering="percent"), [team_list[1], team_list[0], team_list[2]])
+
+
+class TeamNumberAllocatorTest(unittest.TestCase):
+    def test_lowest_free_number(self):
+        allocator = TeamNumberAllocator()
+        allocator.reserve(3)
+        allocator.reserve(1)
+        self.assertEqual([allocator.allocate() for count in range(4)], [0, 2, 4, 5])
+        allocator.free(2)
+        allocator.free(0)
+        self.assertEqual([allocator.allocate() for count in range(3)], [0, 2, 6])
+
+    def test_reserve_taken_number(self):
+        allocator = TeamNumberAllocator()
+        self.assertEqual(allocator.allocate(), 0)
+        self.assertFalse(allocator.reserve(0))
+        self.assertTrue(allocator.reserve(7))
+        self.assertIn(7, allocator)
+        allocator.free(7)
+        self.assertNotIn(7, allocator)
+        # freeing a number twice doesn't hand it out twice
+        allocator.free(7)
+        self.assertEqual([allocator.allocate() for count in range(7)], [1, 2, 3, 4, 5, 6, 7])
+
+    def test_registry_holds_number(self):
+        registry = TeamRegistry()
+        for team in teams(3):
+            registry.add(team)
+        registry.remove(1, free=False)
+        self.assertNotIn(1, registry)
+        self.assertIn(1, registry.allocator)
+        self.assertEqual(registry.allocator.allocate(), 3)
+        with self.assertRaises(ValueError):
+            registry.add(TeamInfo("again", "two", 2))
+
+
+class RenderCacheTest(unittest.TestCase):
+    def test_views_are_kept_for_their_version(self):
+        cache = RenderCache()
+        self.assertIsNone(cache.view("teams", 1))
+        self.assertEqual(cache.store("teams", 1, "one"), "one")
+        self.assertEqual(cache.view("teams", 1), "one")
+        self.assertIsNone(cache.view("list", 1))
+        # a change drops every view
+        self.assertIsNone(cache.view("teams", 2))
+        # and one finished after the change isn't kept
+        cache.store("list", 1, "old")
+        self.assertIsNone(cache.view("list", 2))
+
+    def test_rows_are_rebuilt_when_their_stamp_changes(self):
+        cache = RenderCache()
+        team = TeamInfo("ann", "bob", 0)
+        render = lambda: team.full_details()
+        first = cache.row(("stats", 0), (team, team._revision), render)
+        team._wins = 3
+        # unchanged stamp, the old row
+        self.assertEqual(cache.row(("stats", 0), (team, team._revision), render), first)
+        team.edit_wins()
+        self.assertIn("4 |    0 | Ann & Bob", cache.row(("stats", 0), (team, team._revision), render))
+        cache.clear()
+        self.assertEqual(cache._rows, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
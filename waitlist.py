@@ -1,17 +1,33 @@
-from datetime import datetime
-import operator
+import argparse
+import asyncio
+import bisect
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
+import heapq
+from itertools import islice
 import os
-from queue import Queue
 from random import randint
 import re
+import tempfile
 import time
 
 
 from loguru import logger
-from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, ConversationHandler, MessageHandler, filters
+
+from outbox import Document, MESSAGE_LIMIT, Outbox, Rendered
+from roster import read_roster, write_rows
+from storage import EventJournal, Snapshot, SQLiteStorage, TextFileStorage, WriteBehindWriter
 
 class TeamInfo:
+    __slots__ = ("_player", "_partner", "_wins", "_losses", "_team_number", "_current_win_streak",
+                 "_previous_win_streak", "_best_win_streak", "_previous_best_win_streak", "_group", "_teams_played", "_listener",
+                 "_revision")
+    default = "*"
+
     def __init__(self, player, partner=None, team_number=-1):
         self._player = player.strip()
         self._partner = None
@@ -19,14 +35,30 @@ class TeamInfo:
             self._partner = partner.strip()
         self._wins = 0
         self._losses = 0
-        self.default = "*"
         self._team_number = int(team_number)
         self._current_win_streak = 0
         self._previous_win_streak = 0
         self._best_win_streak = 0
         self._previous_best_win_streak = 0
-        self.group = set()
-        self.teams_played = set()
+        self._group = None
+        self._teams_played = None
+        self._listener = None
+        # bumped whenever something shown about the team changes
+        self._revision = 0
+
+    @property
+    def group(self):
+        """Groups the team belongs to, the set is only created once it is needed"""
+        if self._group is None:
+            self._group = set()
+        return self._group
+
+    @property
+    def teams_played(self):
+        """Team numbers this team has played, the set is only created once it is needed"""
+        if self._teams_played is None:
+            self._teams_played = set()
+        return self._teams_played
 
     @property
     def best_win_streak(self):
@@ -38,7 +70,7 @@ class TeamInfo:
 
     @property
     def team_number(self):
-        return int(self._team_number)
+        return self._team_number
 
     @property
     def player(self):
@@ -47,6 +79,7 @@ class TeamInfo:
     @player.setter
     def player(self, player):
         self._player = player.strip()
+        self._revision = self._revision + 1
 
     @property
     def partner(self):
@@ -56,7 +89,8 @@ class TeamInfo:
 
     @partner.setter
     def partner(self, partner):
-        self._partner = partner.strip()
+        self._partner = partner.strip() if partner is not None else None
+        self._revision = self._revision + 1
 
     @property
     def wins(self):
@@ -73,7 +107,9 @@ class TeamInfo:
         self._previous_win_streak = 0
         self._best_win_streak = 0
         self._previous_best_win_streak = 0
-        self._group.clear()
+        if self._group is not None:
+            self._group.clear()
+        self._changed()
 
     def edit_wins(self, amount=1):
         self._wins = self._wins + amount
@@ -95,6 +131,7 @@ class TeamInfo:
             if self._current_win_streak >= self._best_win_streak:
                 self._previous_best_win_streak = self.best_win_streak
                 self._best_win_streak = self._current_win_streak
+        self._changed()
     
     def edit_losses(self, amount=1):
         self._losses = self._losses + amount
@@ -110,12 +147,19 @@ class TeamInfo:
                 self._best_win_streak = self._current_win_streak
 
             self._current_win_streak = 0
-        
+        self._changed()
+
+    def _changed(self):
+        """Lets the leaderboard holding this team know its stats changed"""
+        self._revision = self._revision + 1
+        if self._listener is not None:
+            self._listener(self)
+
     def equals(self, team):
         match = False
         if team is None:
             return match
-        if self.team_number is team.team_number:
+        if self.team_number == team.team_number:
             if self.player.lower() == team.player.lower():
                 if self.partner.lower() == team.partner.lower():
                     match = True
@@ -128,7 +172,6 @@ class TeamInfo:
         win_percentage = 0
         if games_played > 0 and self.wins > 0:
             win_percentage = float((self.wins/games_played) * 100)
-            logger.debug(f"Win percentage full: {win_percentage}")
         return win_percentage
 
     def full_details(self, tag_team_members=False):
@@ -139,7 +182,6 @@ class TeamInfo:
             details = f"{self.team_number:4d} | {self.best_win_streak:3d} | {win_percentage:4d}% | {self.wins:4d} | {self.losses:4d} | {tag_team}"
         else:
             details = f"{self.team_number:4d} | {self.best_win_streak:3d} | {win_percentage:4d}% | {self.wins:4d} | {self.losses:4d} | {str(self)}"
-        logger.debug(details)
         return details
 
     def info(self):
@@ -151,8 +193,8 @@ class TeamInfo:
             f"{str(self)}\n"
             f"Record: {self.wins} W  - {self.losses} L\n"
             f"Win Percentage: {win_percentage}\n"
-            f"Group(s): {list(self.group)}\n"
-            f"Team(s) Played: {list(self.teams_played)}\n"
+            f"Group(s): {list(self._group or [])}\n"
+            f"Team(s) Played: {list(self._teams_played or [])}\n"
             )
         return info
     @property
@@ -162,6 +204,23 @@ class TeamInfo:
     def tag_team_members(self):
         return f"@{self.player} & @{self.partner}"
 
+    def snapshot(self):
+        """Returns everything needed to rebuild the team as a plain list"""
+        return [self._team_number, self._player, self._partner, self._wins, self._losses, self._current_win_streak,
+                self._previous_win_streak, self._best_win_streak, self._previous_best_win_streak,
+                sorted(self._group or []), sorted(self._teams_played or [])]
+
+    @classmethod
+    def from_snapshot(cls, entry):
+        team = cls(player=entry[1], partner=entry[2], team_number=entry[0])
+        (team._wins, team._losses, team._current_win_streak, team._previous_win_streak,
+         team._best_win_streak, team._previous_best_win_streak) = entry[3:9]
+        if entry[9]:
+            team._group = set(entry[9])
+        if entry[10]:
+            team._teams_played = set(entry[10])
+        return team
+
     def team_number_details(self, seperator="|"):
         details = f"{self.team_number:2d} {seperator} {str(self)}"
         return details
@@ -169,15 +228,215 @@ class TeamInfo:
     def __str__(self):
         return f"{self.player} & {self.partner}"
 
-class WaitList:
+class Leaderboard:
+    """Teams kept sorted by each stats ordering
+
+    Teams report their own changes (wins, losses, reset) so only the moved team is
+    re-slotted.  A team's rank is a binary search on its current key.
+    """
+    ORDERINGS = {
+        "number": lambda team: (team.team_number,),
+        "percent": lambda team: (-team.win_percentage, -team.wins, team.team_number),
+        "streak": lambda team: (-team.best_win_streak, -team.wins, team.team_number),
+        "wins": lambda team: (-team.wins, team.losses, team.team_number),
+    }
+
     def __init__(self):
-        self._queue = Queue(maxsize=0)
+        self._teams = dict()
+        self._keys = {ordering: dict() for ordering in self.ORDERINGS}
+        self._sorted = {ordering: list() for ordering in self.ORDERINGS}
+        self._paused = False
 
     def add(self, team):
+        self._teams[team.team_number] = team
+        team._listener = self.update
+        if self._paused:
+            return
+        for ordering, get_key in self.ORDERINGS.items():
+            key = get_key(team)
+            self._keys[ordering][team.team_number] = key
+            bisect.insort(self._sorted[ordering], key)
+
+    def remove(self, team_number):
+        team = self._teams.pop(team_number)
+        team._listener = None
+        if self._paused:
+            return
+        for ordering in self.ORDERINGS:
+            key = self._keys[ordering].pop(team_number)
+            ordered = self._sorted[ordering]
+            del ordered[bisect.bisect_left(ordered, key)]
+
+    def update(self, team):
+        if self._paused or self._teams.get(team.team_number) is not team:
+            return
+        for ordering, get_key in self.ORDERINGS.items():
+            old_key = self._keys[ordering][team.team_number]
+            key = get_key(team)
+            if key == old_key:
+                continue
+            ordered = self._sorted[ordering]
+            del ordered[bisect.bisect_left(ordered, old_key)]
+            bisect.insort(ordered, key)
+            self._keys[ordering][team.team_number] = key
+
+    def pause(self):
+        """Stops re-slotting teams until resume(), used while replaying a journal"""
+        self._paused = True
+
+    def resume(self):
+        """Sorts every team once and goes back to updating in place"""
+        self._paused = False
+        for ordering, get_key in self.ORDERINGS.items():
+            keys = {team_number: get_key(team) for team_number, team in self._teams.items()}
+            self._keys[ordering] = keys
+            self._sorted[ordering] = sorted(keys.values())
+
+    def rank(self, team_number, ordering="percent"):
+        """Returns the 1 based rank of a team or None if the team is not on the board"""
+        key = self._keys[ordering].get(team_number)
+        if key is None:
+            return None
+        return bisect.bisect_left(self._sorted[ordering], key) + 1
+
+    def top(self, count=None, ordering="percent"):
+        """Returns the first count teams for an ordering, all of them when count is None"""
+        ordered = self._sorted[ordering]
+        if count is not None:
+            ordered = ordered[:count]
+        return [self._teams[key[-1]] for key in ordered]
+
+    def clear(self):
+        for team in self._teams.values():
+            team._listener = None
+        self._teams.clear()
+        for ordering in self.ORDERINGS:
+            self._keys[ordering].clear()
+            self._sorted[ordering].clear()
+
+    def __len__(self):
+        return len(self._teams)
+
+class TeamNumberAllocator:
+    """Hands out the lowest free team number
+
+    Numbers given back by deleted teams sit on a min-heap.  Everything at or above
+    the high-water mark has never been handed out.  Reserved (hand assigned)
+    numbers are skipped when the heap or the high-water mark reaches them.
+    """
+    def __init__(self):
+        self._used = set()
+        self._free = list()
+        self._next = 0
+
+    def allocate(self):
+        while self._free:
+            team_number = heapq.heappop(self._free)
+            if team_number not in self._used:
+                self._used.add(team_number)
+                return team_number
+        while self._next in self._used:
+            self._next = self._next + 1
+        team_number = self._next
+        self._next = self._next + 1
+        self._used.add(team_number)
+        return team_number
+
+    def reserve(self, team_number):
+        if team_number in self._used:
+            return False
+        self._used.add(team_number)
+        return True
+
+    def free(self, team_number):
+        if team_number not in self._used:
+            return
+        self._used.discard(team_number)
+        if team_number < self._next:
+            heapq.heappush(self._free, team_number)
+
+    def rebuild(self, team_numbers):
+        self._used = set(team_numbers)
+        self._free = list()
+        self._next = 0
+
+    def clear(self):
+        self.rebuild([])
+
+    def __contains__(self, team_number):
+        return team_number in self._used
+
+class TeamRegistry:
+    """Teams keyed by team number, iterated in team number order"""
+    def __init__(self):
+        self._teams = dict()
+        self._numbers = list()
+        self.leaderboard = Leaderboard()
+        self.allocator = TeamNumberAllocator()
+
+    def add(self, team):
+        team_number = team.team_number
+        if team_number in self._teams:
+            raise ValueError(f"ERROR: Team number:{team_number} is already in use.")
+        self._teams[team_number] = team
+        bisect.insort(self._numbers, team_number)
+        self.leaderboard.add(team)
+        self.allocator.reserve(team_number)
+
+    def get(self, team_number, default=None):
+        return self._teams.get(team_number, default)
+
+    def remove(self, team_number, free=True):
+        """Removes a team, its number stays taken when free is False"""
+        team = self._teams.pop(team_number)
+        del self._numbers[bisect.bisect_left(self._numbers, team_number)]
+        self.leaderboard.remove(team_number)
+        if free:
+            self.allocator.free(team_number)
+        return team
+
+    def clear(self):
+        self._teams.clear()
+        self._numbers.clear()
+        self.leaderboard.clear()
+        self.allocator.clear()
+
+    def __contains__(self, team_number):
+        return team_number in self._teams
+
+    def __len__(self):
+        return len(self._teams)
+
+    def __iter__(self):
+        for team_number in self._numbers:
+            yield self._teams[team_number]
+
+class WaitList:
+    """FIFO of teams keyed by team number
+
+    Every team gets an increasing ticket when it is added.  A Fenwick tree over
+    the tickets counts the teams still waiting, which gives a team's position
+    without walking the list.  Teams passed over by take count a skip each.
+    """
+    def __init__(self):
+        self._teams = OrderedDict()
+        self._tickets = dict()
+        self._tree = [0]
+        self._next_ticket = 0
+        self._skips = dict()
+
+    def add(self, team, skips=0):
         if isinstance(team, TeamInfo):
-            if team in self._queue.queue:
+            if team.team_number in self._teams:
                 return False
-            self._queue.put(team)
+            if self._next_ticket >= len(self._tree) - 1:
+                self._rebuild()
+            self._teams[team.team_number] = team
+            self._tickets[team.team_number] = self._next_ticket
+            self._update(self._next_ticket, 1)
+            self._next_ticket = self._next_ticket + 1
+            if skips:
+                self._skips[team.team_number] = skips
             return True
         return False
         
@@ -187,40 +446,154 @@ class WaitList:
         
         teams = []
         for _ in range(count):
-            team = self._queue.get_nowait()
+            team_number, team = self._teams.popitem(last=False)
+            self._update(self._tickets.pop(team_number), -1)
+            self._skips.pop(team_number, None)
             teams.append(team)
         return teams
 
+    def take(self, team):
+        """Removes a team from wherever it is, each team still ahead of it was skipped once more"""
+        for waiting in self._teams.values():
+            if waiting is team:
+                break
+            self._skips[waiting.team_number] = self._skips.get(waiting.team_number, 0) + 1
+        self.remove_team(team)
+
+    def peek(self):
+        """Returns the team at the head of the waitlist without removing it"""
+        return next(iter(self._teams.values()), None)
+
+    def window(self, count):
+        """Returns the first count teams, without removing them"""
+        return islice(self._teams.values(), count)
+
+    def skips(self, team_number):
+        """Returns how many times teams behind this one were taken before it"""
+        return self._skips.get(team_number, 0)
+
     def clear(self):
-        self._queue.queue.clear()
+        self._teams.clear()
+        self._tickets.clear()
+        self._tree = [0]
+        self._next_ticket = 0
+        self._skips.clear()
 
     def in_queue(self, proposed_team):
-        if proposed_team in self._queue.queue:
-            return True
-        return False
+        return proposed_team.team_number in self._teams
 
     def remove_team(self, team_to_remove):
-        try:
-            self._queue.queue.remove(team_to_remove)
-        except ValueError:
+        team_number = team_to_remove.team_number
+        if team_number not in self._teams:
             raise ValueError(f"Error team {team_to_remove.team_number_details()} is not on the waitlist")
-        
+        del self._teams[team_number]
+        self._update(self._tickets.pop(team_number), -1)
+        self._skips.pop(team_number, None)
+
+    def position(self, team_number):
+        """Returns the 1 based position of a team or None if the team is not waiting"""
+        ticket = self._tickets.get(team_number)
+        if ticket is None:
+            return None
+        position = 0
+        index = ticket + 1
+        while index > 0:
+            position = position + self._tree[index]
+            index = index - (index & -index)
+        return position
+
     @property
     def size(self):
-        return self._queue.qsize()
-    
-    def info(self):
-        teams = []
-        first_team = True
-        for team in self._queue.queue:
-            if first_team:
-                teams.append(f"@{team.player} & @{team.partner}")
-                first_team = False
-            else:
-                teams.append(str(team))
-        return teams
+        return len(self._teams)
+
+    def _update(self, ticket, amount):
+        index = ticket + 1
+        while index < len(self._tree):
+            self._tree[index] = self._tree[index] + amount
+            index = index + (index & -index)
+
+    def _rebuild(self):
+        """Renumbers the waiting teams from 0 and doubles the room for new tickets"""
+        capacity = max(16, 2 * len(self._teams))
+        self._tree = [0] * (capacity + 1)
+        for ticket, team_number in enumerate(self._teams):
+            self._tickets[team_number] = ticket
+            self._tree[ticket + 1] = 1
+        for index in range(1, capacity + 1):
+            parent = index + (index & -index)
+            if parent <= capacity:
+                self._tree[parent] = self._tree[parent] + self._tree[index]
+        self._next_ticket = len(self._teams)
+
+    def __contains__(self, team_number):
+        return team_number in self._teams
+
+    def __len__(self):
+        return len(self._teams)
+
+    def __iter__(self):
+        return iter(self._teams.values())
+
+
+class Matchmaker:
+    """Picks the teams that play next off the waitlist, in the order they joined it
+
+    Matchmakers only choose, the teams are taken off the waitlist by the session.
+    """
+    name = "fifo"
+
+    def opponent(self, waitlist, team):
+        """Returns the waiting team to play team"""
+        for waiting in waitlist.window(2):
+            if waiting is not team:
+                return waiting
+        raise Exception("ERROR: Not enough team(s) on the waitlist!")
+
+    def pair(self, waitlist):
+        """Returns the two waiting teams that start a new table"""
+        first = waitlist.peek()
+        if first is None:
+            raise Exception("ERROR: Not enough team(s) on the waitlist!")
+        return [first, self.opponent(waitlist, first)]
+
+
+class RematchMatchmaker(Matchmaker):
+    """Looks window teams into the waitlist for one that hasn't played the team yet
+
+    The first team that could play is taken anyway once it has been skipped max_skips
+    times, or when every team in the window is a rematch.  Teams ahead of the one taken
+    are always skipped together, so the first team has been skipped the most.
+    """
+    name = "rematch"
+
+    def __init__(self, window=8, max_skips=3):
+        self.window = window
+        self.max_skips = max_skips
+
+    def opponent(self, waitlist, team):
+        played = team.teams_played
+        first = None
+        # the team itself may be waiting too, it doesn't count toward the window
+        candidates = (waiting for waiting in waitlist if waiting is not team)
+        for waiting in islice(candidates, self.window):
+            if first is None:
+                first = waiting
+                if waitlist.skips(waiting.team_number) >= self.max_skips:
+                    return waiting
+            if waiting.team_number not in played:
+                return waiting
+        if first is None:
+            raise Exception("ERROR: Not enough team(s) on the waitlist!")
+        return first
+
+
+MATCHMAKERS = {matchmaker.name: matchmaker for matchmaker in (Matchmaker, RematchMatchmaker)}
+
 
 class Table:
+    __slots__ = ("invite_code", "_team1", "_team2", "_winner", "_loser", "_next_team", "_next_invite_code",
+                 "_game_status", "_table_number", "_revision")
+
     def __init__(self, team1, team2, table_number=-1, invite_code=None):
         if team1.equals(team2):
             raise Exception("Team is playing themselves.  Do you need to correct a table? /correcttable <table_number>, team1, team2 ")
@@ -233,6 +606,7 @@ class Table:
         self._next_invite_code = "*"
         self._game_status = True
         self._table_number = int(table_number)
+        self._revision = 0
     
     @property
     def table_number(self):
@@ -250,9 +624,12 @@ class Table:
                 f"{self._winner.team_number} | {self._loser.team_number} | "
                 f"{self._next_invite_code} | {next_team}")
 
-    def __str__(self):
+    def matchup(self):
         seperator = ":"
-        return (f"{self._table_number:3d} | {self.invite_code:10s} | {self._team1.team_number_details(seperator) } vs {self._team2.team_number_details(seperator)}\n"
+        return f"{self._table_number:3d} | {self.invite_code:10s} | {self._team1.team_number_details(seperator) } vs {self._team2.team_number_details(seperator)}"
+
+    def __str__(self):
+        return (f"{self.matchup()}\n"
                 f"    | {str(self._winner):25s} | {str(self._loser):25s}\n"
                 f"    | {self._next_invite_code:10s} | {str(self._next_team):25s}")
 
@@ -273,7 +650,41 @@ class Table:
         self._next_invite_code = ""
         if invite_code:
             self._next_invite_code = invite_code.upper()
+        self._changed()
+
+    def _changed(self):
+        self._revision = self._revision + 1
+
+    def stamp(self):
+        """Changes whenever the table or a team shown on it changes"""
+        next_revision = self._next_team._revision if isinstance(self._next_team, TeamInfo) else None
+        return (self, self._revision, self._team1._revision, self._team2._revision, next_revision)
   
+    def snapshot(self):
+        """Returns the table as a plain list, teams are saved by team number"""
+        winner = self._winner.team_number if isinstance(self._winner, TeamInfo) else None
+        next_team = self._next_team.team_number if isinstance(self._next_team, TeamInfo) else None
+        return [self._table_number, self.invite_code, self._team1.team_number, self._team2.team_number,
+                winner, next_team, self._next_invite_code, self._game_status]
+
+    @classmethod
+    def from_snapshot(cls, entry, get_team):
+        table_number, invite_code, team_1_number, team_2_number, winner, next_team, next_invite_code, active = entry
+        table = cls(team1=get_team(team_1_number), team2=get_team(team_2_number), table_number=table_number, invite_code=invite_code)
+        table.invite_code = invite_code
+        if winner is not None:
+            if table._team1.team_number == winner:
+                table._winner, table._loser = table._team1, table._team2
+            else:
+                table._winner, table._loser = table._team2, table._team1
+        if next_team is not None:
+            table._next_team = get_team(next_team)
+        elif not active:
+            table._next_team = None
+        table._next_invite_code = next_invite_code
+        table._game_status = active
+        return table
+
     @property
     def teams(self):
         return [self._team1, self._team2]
@@ -281,643 +692,1358 @@ class Table:
     def active(self):
         return self._game_status
 
-class GotNextBot:
-    
-    def __init__(self, token):
-        self._updater = Updater(token, use_context=True)
-        self._groups = set()
-        self._teams = list()
+class TableIndex:
+    """Every table of the session plus an index of the active tables by team number
+
+    The numbers of the active tables, of the tables each team played at and of the tables
+    each invite code was used at are kept sorted, for the table history views.
+    """
+    def __init__(self):
         self._tables = list()
+        self._active = dict()
+        self._active_count = 0
+        self._by_team = dict()
+        self._by_code = dict()
+        self._active_numbers = list()
+
+    def add(self, table):
+        self._tables.append(table)
+        for team in table.teams:
+            bisect.insort(self._by_team.setdefault(team.team_number, list()), table.table_number)
+        bisect.insort(self._by_code.setdefault(table.invite_code.upper(), list()), table.table_number)
+        if table.active:
+            bisect.insort(self._active_numbers, table.table_number)
+            self._active_count = self._active_count + 1
+            self._index_teams(table)
+
+    def final(self, table, winner, next_team, invite_code=None):
+        was_active = table.active
+        table.final(winner=winner, next_team=next_team, invite_code=invite_code)
+        if was_active:
+            self._active_numbers.remove(table.table_number)
+            self._active_count = self._active_count - 1
+            self._unindex_teams(table)
+
+    def update_teams(self, table, team1, team2):
+        if table.active:
+            self._unindex_teams(table)
+        for team in table.teams:
+            self._by_team[team.team_number].remove(table.table_number)
+        table._team1 = team1
+        table._team2 = team2
+        table._changed()
+        for team in table.teams:
+            bisect.insort(self._by_team.setdefault(team.team_number, list()), table.table_number)
+        if table.active:
+            self._index_teams(table)
+
+    def update_invite_code(self, table, invite_code):
+        self._by_code[table.invite_code.upper()].remove(table.table_number)
+        table.invite_code = invite_code
+        table._changed()
+        bisect.insort(self._by_code.setdefault(invite_code.upper(), list()), table.table_number)
+
+    def select(self, team_number=None, invite_code=None, active=None):
+        """Returns the tables matching every filter given, by table number"""
+        if team_number is not None:
+            tables = [self._tables[number] for number in self._by_team.get(team_number, ())]
+        elif invite_code is not None:
+            tables = [self._tables[number] for number in self._by_code.get(invite_code.upper(), ())]
+        elif active is True:
+            tables = [self._tables[number] for number in self._active_numbers]
+        else:
+            tables = self._tables
+
+        if invite_code is not None and team_number is not None:
+            tables = [table for table in tables if table.invite_code.upper() == invite_code.upper()]
+        if active is not None:
+            tables = [table for table in tables if table.active == active]
+        return tables
+
+    def get(self, table_number):
+        if 0 <= table_number < len(self._tables):
+            return self._tables[table_number]
+        return None
+
+    def active_table(self, team_number):
+        return self._active.get(team_number)
+
+    @property
+    def active_count(self):
+        return self._active_count
+
+    @property
+    def next_table_number(self):
+        return len(self._tables)
+
+    def clear(self):
+        self._tables.clear()
+        self._active.clear()
+        self._active_count = 0
+        self._by_team.clear()
+        self._by_code.clear()
+        self._active_numbers.clear()
+
+    def _index_teams(self, table):
+        for team in table.teams:
+            self._active[team.team_number] = table
+
+    def _unindex_teams(self, table):
+        for team in table.teams:
+            if self._active.get(team.team_number) is table:
+                del self._active[team.team_number]
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __iter__(self):
+        return iter(self._tables)
+
+class Command(tuple):
+    """The arguments of one update: the subcommand, when there is one, then the comma separated parameters
+
+    Each update parses its own, so handlers running at the same time never see each other's arguments.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, message, expect_subcommand=True, default=""):
+        """Splits "/command [subcommand] [argument[, argument...]]" in one pass"""
+        words = message.split(None, 2 if expect_subcommand else 1)
+        rest = words[-1] if len(words) == (3 if expect_subcommand else 2) else ""
+
+        arguments = list()
+        if rest:
+            arguments = rest.split(",")
+        if expect_subcommand:
+            subcommand = words[1] if len(words) > 1 else ""
+            arguments.insert(0, subcommand or default)
+        logger.debug(f"Message: {message}, arguments: {arguments}")
+        return cls(arguments)
+
+
+Subcommand = namedtuple("Subcommand", "name handler arguments description bulk")
+Argument = namedtuple("Argument", "name kind optional")
+
+
+def _invite_code(value):
+    if not value:
+        raise ValueError("an invite code can't be empty")
+    return value
+
+
+class Subcommands:
+    """The subcommands of one command, found by name, alias or a prefix only one of them starts with
+
+    Arguments are declared as "name[:kind]" words, optional ones in brackets and a last
+    "*name" taking whatever is left, split on spaces too when it has a kind.  A kind of
+    words joined by | takes one of those words, or a prefix only one of them starts with.  They are
+    converted before the handler is called with (session, update, command), and the
+    command's help is built from them.  A subcommand with a bulk handler also takes one
+    set of arguments per line, all converted before bulk is called with the commands.
+    """
+    KINDS = {"": str, "int": int, "code": _invite_code}
+
+    def __init__(self, command, default="help", notes=""):
+        self.command = command
+        self.default = default
+        self.notes = notes
+        self._subcommands = dict()
+        # names and aliases, sorted for the prefix search
+        self._names = list()
+        self._listed = list()
+        self._help = Subcommand("help", lambda session, update, command: update.message.reply_text(self.help()), (),
+                                f"Displays commands for the {command} command", None)
+        self._subcommands["help"] = self._help
+        self._names.append("help")
+
+    def add(self, name, handler, arguments="", description="", aliases=(), bulk=None):
+        subcommand = Subcommand(name, handler, tuple(self._argument(word) for word in arguments.split()), description, bulk)
+        for key in (name, *aliases):
+            self._subcommands[key] = subcommand
+            bisect.insort(self._names, key)
+        self._listed.append(subcommand)
+
+    def _argument(self, word):
+        optional = word.startswith("[")
+        name, _, kind = word.strip("[]").partition(":")
+        if kind not in self.KINDS and "|" not in kind:
+            raise ValueError(f"ERROR: Unknown kind {kind} for argument {name}")
+        return Argument(name, kind, optional)
+
+    def find(self, action):
+        action = action.lower()
+        subcommand = self._subcommands.get(action)
+        if subcommand is not None:
+            return subcommand
+        matches = list()
+        for name in islice(self._names, bisect.bisect_left(self._names, action), None):
+            if not name.startswith(action):
+                break
+            if self._subcommands[name] not in matches:
+                matches.append(self._subcommands[name])
+        if len(matches) == 1:
+            return matches[0]
+        if matches:
+            raise ValueError(f"ERROR: {action} could be {' or '.join(match.name for match in matches)}.  "
+                             f"See '{self.command} help' for more details")
+        raise ValueError(f"ERROR:  No such subcommand {action}.  See '{self.command} help' for more details")
+
+    def parse(self, command):
+        """Returns the subcommand of a parsed command and the command with its arguments converted"""
+        subcommand = self.find(command[0] or self.default)
+        return subcommand, self.convert(subcommand, command[1:])
+
+    def parse_lines(self, subcommand, lines):
+        """Converts the arguments on every line of a bulk command, the first line's follow the subcommand
+
+        Every line is checked before any is used, the error lists each line that is wrong.
+        """
+        argument_lines = [Command.parse(lines[0], default=self.default)[1:]]
+        argument_lines.extend(line.split(",") for line in lines[1:])
+        return self.convert_all(subcommand, argument_lines)
+
+    def convert_all(self, subcommand, argument_lines):
+        """Converts sets of arguments, taken one at a time so they can be streamed from a file
+
+        Blank sets are skipped, the rest are numbered as lines in the error listing each bad one.
+        """
+        commands = list()
+        errors = list()
+        number = 0
+        for arguments in argument_lines:
+            if not "".join(arguments).strip():
+                continue
+            number = number + 1
+            try:
+                commands.append(self.convert(subcommand, arguments))
+            except ValueError as msg:
+                errors.append(f"Line {number}: {str(msg).replace('ERROR: ', '', 1)}")
+        if errors:
+            raise ValueError("ERROR: Nothing was done, fix these lines:\n" + "\n".join(errors))
+        if not commands:
+            raise ValueError(f"ERROR: Not enough parameters.  {self.usage(subcommand)}")
+        return commands
+
+    def convert(self, subcommand, given):
+        """Returns the command for a subcommand with the given arguments converted to their kinds"""
+        given = [argument.strip() for argument in given]
+        values = [subcommand.name]
+        for position, argument in enumerate(subcommand.arguments):
+            if argument.name.startswith("*"):
+                rest = [value for value in given[position:] if value]
+                if argument.kind:
+                    rest = [self._convert(subcommand, argument, word) for value in rest for word in value.split()]
+                if not rest and not argument.optional:
+                    raise ValueError(f"ERROR: Not enough parameters.  {self.usage(subcommand)}")
+                values.extend(rest)
+                break
+            if position >= len(given) or not given[position]:
+                if not argument.optional:
+                    raise ValueError(f"ERROR: Not enough parameters.  {self.usage(subcommand)}")
+                values.append(None)
+                continue
+            values.append(self._convert(subcommand, argument, given[position]))
+        # optional arguments that weren't given at all
+        while len(values) > 1 and values[-1] is None:
+            values.pop()
+        return Command(values)
+
+    def _convert(self, subcommand, argument, value):
+        if "|" in argument.kind:
+            return self._choose(subcommand, argument, value)
+        try:
+            return self.KINDS[argument.kind](value)
+        except ValueError:
+            raise ValueError(f"ERROR: {argument.name.lstrip('*')} has to be a {'number' if argument.kind == 'int' else argument.kind}, "
+                             f"not {value}.  {self.usage(subcommand)}")
+
+    def _choose(self, subcommand, argument, value):
+        choices = argument.kind.split("|")
+        value = value.lower()
+        if value in choices:
+            return value
+        matches = [choice for choice in choices if choice.startswith(value)]
+        if len(matches) == 1:
+            return matches[0]
+        raise ValueError(f"ERROR: {argument.name.lstrip('*')} has to be {' or '.join(choices)}, "
+                         f"not {value}.  {self.usage(subcommand)}")
+
+    @staticmethod
+    def _arguments(subcommand):
+        arguments = list()
+        for argument in subcommand.arguments:
+            # a choice shows what it can be
+            name = argument.kind if "|" in argument.kind else argument.name.lstrip("*")
+            if argument.name.startswith("*"):
+                name = f"{name}..."
+            arguments.append(f"[<{name}>]" if argument.optional else f"<{name}>")
+        return ", ".join(arguments)
+
+    def usage(self, subcommand):
+        return f"/{self.command} {subcommand.name} {self._arguments(subcommand)}".rstrip()
+
+    def help(self):
+        lines = list()
+        for subcommand in (*self._listed, self._help):
+            arguments = self._arguments(subcommand)
+            lines.append(f"{subcommand.name:8s}{' ' + arguments if arguments else ''} -> {subcommand.description}")
+        if self.notes:
+            lines.append(self.notes)
+        return "\n".join(lines) + "\n"
+
+
+class RenderCache:
+    """Rendered views of a session, reused until the session's state changes
+
+    A view is kept for the state version it was built from.  The rows views are built
+    from are kept with a stamp of what they show, so after a change a view is rebuilt
+    from the rows that are still good plus the few that changed.
+    """
+    def __init__(self):
+        self._version = None
+        self._views = dict()
+        self._rows = dict()
+
+    def view(self, key, version):
+        """Returns the view built for this version, or None when it has to be built"""
+        if version != self._version:
+            self._views.clear()
+            self._version = version
+            return None
+        return self._views.get(key)
+
+    def store(self, key, version, rendered):
+        if version == self._version:
+            self._views[key] = rendered
+        return rendered
+
+    def row(self, key, stamp, render):
+        cached = self._rows.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        text = render()
+        self._rows[key] = (stamp, text)
+        return text
+
+    def clear(self):
+        self._views.clear()
+        self._rows.clear()
+        self._version = None
+
+
+class GameSession:
+    """One chat's tournament: its teams, tables, waitlist and files"""
+
+    def __init__(self, chat_id, writer, storage="text", directory=".", matchmaker="rematch"):
+        self.chat_id = chat_id
+        self.directory = directory
+        self.last_used = time.monotonic()
+        # held for the whole of a command so the session's updates run one at a time
+        self.lock = asyncio.Lock()
+        # set once GotNextBot has loaded the session's files
+        self.loaded = False
+        self._groups = set()
+        self._teams = TeamRegistry()
+        self._tables = TableIndex()
         self._max_tables = 0
         self._waitlist = WaitList()
+        self._retired = dict()
         self._action = list()
-        self._messages = list()
         self._get_number_result, self._get_string_result = range(2)
-        self._team_number = 0
         self.date_query = "%Y-%m-%d"
-        self._table_file = f"Tables_{datetime.today().strftime(self.date_query)}.txt"
-        self._team_file = f"Teams_{datetime.today().strftime(self.date_query)}.txt"
+        self._writer = writer
+        today = datetime.today().strftime(self.date_query)
+        if storage == "text":
+            self._storage = TextFileStorage(os.path.join(directory, f"Teams_{today}.txt"),
+                                            os.path.join(directory, f"Tables_{today}.txt"), self._writer)
+        elif storage == "sqlite":
+            self._storage = SQLiteStorage(os.path.join(directory, "GotNextBot.db"), self._writer)
+        else:
+            raise ValueError(f"ERROR: Unknown storage {storage}, expected text or sqlite")
+        if matchmaker not in MATCHMAKERS:
+            raise ValueError(f"ERROR: Unknown matchmaker {matchmaker}, expected {' or '.join(MATCHMAKERS)}")
+        self._matchmaker = MATCHMAKERS[matchmaker]()
+        # named the same every day, a session evicted or restarted after midnight still finds them
+        self._journal = EventJournal(os.path.join(directory, "journal.txt"), self._writer)
+        self._snapshot = Snapshot(os.path.join(directory, "snapshot.json"), self._writer)
+        self._snapshot_every = 1000
+        self._events_since_snapshot = 0
         self._game_play_type = "rise"
+        # bumped by every change, it tells the render cache which views are out of date
+        self._version = 0
+        self._renders = RenderCache()
+        self._table_page_size = 10
+        # the most tables a page can show and still fit in the one message its buttons edit
+        self._table_page_size_limit = 15
+        # the pinned board, its text is what it was last edited to
+        self._board_message_id = None
+        self._board_text = None
+        self._board_version = None
+        self._board_tables = 40
+        self._board_waitlist = 5
     
-    def load_data(self, team_file=None, table_file=None):
+    def load_data(self, team_file=None, table_file=None, journal_file=None, snapshot_file=None):
         """Load up previous data"""
-        if team_file is not None:
-            self._team_file = team_file
-        if table_file is not None:
-            self._table_file = table_file
+        self._storage.open()
+        if isinstance(self._storage, TextFileStorage):
+            if team_file is not None:
+                self._storage.team_file = team_file
+            if table_file is not None:
+                self._storage.table_file = table_file
+        if journal_file is not None:
+            self._journal = EventJournal(journal_file, self._writer)
+        if snapshot_file is not None:
+            self._snapshot = Snapshot(snapshot_file, self._writer)
+
+        # the snapshot and journal have every change, the team file only has names
+        snapshot = self._snapshot.load()
+        if snapshot is not None or self._journal.exists:
+            self._teams.leaderboard.pause()
+            generation = 0
+            if snapshot is not None:
+                self._restore_snapshot(snapshot)
+                generation = snapshot["generation"]
+
+            if self._journal.generation < generation:
+                # the last compaction stopped before the journal was started over
+                logger.warning(f"Journal {self._journal.path} is already part of the snapshot, starting it over")
+                self._journal.truncate(generation)
+            else:
+                self._replay_journal()
+            self._teams.leaderboard.resume()
+            return
 
         # getting team list
-        data = list()
-        if os.path.exists(self._team_file):
-            with open(self._team_file, "r") as read_file:
-                data = read_file.readlines()
-            # "0 | Toni &  ___"
-        for entry in data:
-            logger.debug(f"")
-            team_number = int(entry.split("|")[0])
-            team = entry.split("|")[1]
-            player = team.split("&")[0]
-            partner = team.split("&")[1]
-            found = False
+        for team_number, player, partner in self._storage.load_teams():
             logger.debug(f"Team Number: {team_number}, Player:{player}, Partner: {partner}")
             
-            for team in self._teams:
-                if team.team_number is team_number:
-                    found = True
-                    team.player = player
-                    team.partner = partner
-            if not found:
-                team = TeamInfo(player=player, partner=partner, team_number=team_number)
-                self._teams.append(team)
-        
-        # data = list()
-        # if os.path.exists(self._table_file):
-        #     with open(self._table_file, "r") as read_file:
-        #         data = read_file.readlines()
-        # table number | invite code | team1 # vs team2 # | winner # | loser # | next invite code | next team #
-
-    def are_parameters_set(self, message, parameters_expected=1, expect_subcommand=True):
-        self._messages.clear()
-        try:
-            x = command = message.split(" ")
-            logger.debug(x)
-
-            command = message.split(" ")[0]
-            if expect_subcommand:
-                subcommand = message.split(" ")[1]
-                subcommand = subcommand.strip()
-                parameters_set = message.split(subcommand)[1]
+            team = self._teams.get(team_number)
+            if team is not None:
+                team.player = player
+                team.partner = partner
             else:
-                parameters_set = message.split(command)[1]
-                subcommand = ""
-        except IndexError:
-            parameters_set = []
-            subcommand = ""
-            command = message[1:]
-        
-        logger.debug(f"Message: {message}, command: {command}, subcommand: {subcommand} parameters: {parameters_set}")
+                team = TeamInfo(player=player, partner=partner, team_number=team_number)
+                self._teams.add(team)
+        self._teams.allocator.rebuild(team.team_number for team in self._teams)
 
-        if parameters_set:
-            self._messages = parameters_set.split(",")
-            for message in self._messages:
-                message = message.strip()
+        # start the journal from the teams that were loaded
+        for team in self._teams:
+            self._record("team", team.team_number, team._player, team._partner)
 
-        if expect_subcommand:
-            self._messages.insert(0, subcommand)
-            parameters_expected += 1
-        logger.debug(f"Parameters: {self._messages}")
-        if len(self._messages) >= parameters_expected:
-            return True
-        return False
+    def _replay_journal(self):
+        """Rebuilds the state by applying every journaled event in order"""
+        started = time.perf_counter()
+        events = 0
+        for event, arguments in self._journal.replay():
+            try:
+                self._apply_event(event, arguments)
+            except Exception:
+                logger.exception(f"Unable to replay journal event {event} {arguments}")
+            events = events + 1
+        self._events_since_snapshot = events
+        logger.info(f"Replayed {events} journal event(s) in {time.perf_counter() - started:.3f}s")
+
+    def _restore_snapshot(self, snapshot):
+        """Loads the state saved by _compact"""
+        # teams that were deleted but are still on a table or the waitlist
+        self._retired = {entry[0]: TeamInfo.from_snapshot(entry) for entry in snapshot["retired"]}
+        for entry in snapshot["teams"]:
+            self._teams.add(TeamInfo.from_snapshot(entry))
+        for entry in snapshot["tables"]:
+            self._tables.add(Table.from_snapshot(entry, self._find_team))
+        skips = dict(snapshot.get("skips", ()))
+        for team_number in snapshot["waitlist"]:
+            self._waitlist.add(self._find_team(team_number), skips=skips.get(team_number, 0))
+        self._groups = set(snapshot["groups"])
+        self._max_tables = snapshot["max_tables"]
+        self._game_play_type = snapshot["play"]
+        self._board_message_id = snapshot.get("board")
+        if isinstance(self._storage, TextFileStorage) and snapshot.get("table_file"):
+            self._storage.table_file = snapshot["table_file"]
+        # the restored registry only took the live teams' numbers
+        self._settle_retired()
+
+    def _settle_retired(self):
+        """Holds the numbers of deleted teams still on a table or the waitlist, lets the others go
+
+        A number handed out again while its old team is still referenced would make
+        the tables, the journal and the snapshot mix the two teams up.
+        """
+        referenced = {id(team) for team in self._waitlist}
+        for table in self._tables:
+            referenced.update(id(team) for team in (table._team1, table._team2, table._next_team) if isinstance(team, TeamInfo))
+        for team_number, team in list(self._retired.items()):
+            if id(team) in referenced:
+                self._teams.allocator.reserve(team_number)
+            else:
+                del self._retired[team_number]
+                if team_number not in self._teams:
+                    self._teams.allocator.free(team_number)
+
+    def _find_team(self, team_number):
+        """Looks up a team, including deleted teams that can still be on a table or the waitlist"""
+        team = self._teams.get(team_number)
+        if team is None:
+            team = self._retired.get(team_number)
+        return team
+
+    def _record(self, event, *arguments):
+        """Journals a change that has already been applied, compacting the journal once it gets long"""
+        self._version = self._version + 1
+        if event in ("clear", "quit"):
+            # rows hold on to the tables and teams they show
+            self._renders.clear()
+        self._journal.record(event, *arguments)
+        self._events_since_snapshot = self._events_since_snapshot + 1
+        if self._events_since_snapshot >= self._snapshot_every:
+            self._compact()
+
+    def _compact(self):
+        """Writes a snapshot of the whole state and starts the journal over behind it"""
+        # only the deleted teams that are still referenced need saving
+        retired = dict()
+        for table in self._tables:
+            for team in (table._team1, table._team2, table._next_team):
+                if isinstance(team, TeamInfo) and self._teams.get(team.team_number) is not team:
+                    retired[team.team_number] = team
+        for team in self._waitlist:
+            if self._teams.get(team.team_number) is not team:
+                retired[team.team_number] = team
+
+        generation = self._journal.generation + 1
+        self._snapshot.save({
+            "generation": generation,
+            "teams": [team.snapshot() for team in self._teams],
+            "retired": [team.snapshot() for team in retired.values()],
+            "tables": [table.snapshot() for table in self._tables],
+            "waitlist": [team.team_number for team in self._waitlist],
+            "skips": [[team.team_number, self._waitlist.skips(team.team_number)] for team in self._waitlist
+                      if self._waitlist.skips(team.team_number)],
+            "groups": sorted(self._groups),
+            "max_tables": self._max_tables,
+            "play": self._game_play_type,
+            "board": self._board_message_id,
+            # /quit moves the text storage on to a new tables file
+            "table_file": self._storage.table_file if isinstance(self._storage, TextFileStorage) else None,
+        })
+        self._journal.truncate(generation)
+        self._events_since_snapshot = 0
+        self._storage.compact(self._teams, self._tables)
+        logger.info(f"Snapshot {generation} saved to {self._snapshot.path}")
+
+    def _apply_event(self, event, arguments):
+        """Applies one journaled event without replying or journaling it again"""
+        if event == "team":
+            team_number, player, partner = arguments
+            team = self._teams.get(team_number)
+            if team is None:
+                self._teams.add(TeamInfo(player=player, partner=partner, team_number=team_number))
+            else:
+                team.player = player
+                if partner is not None:
+                    team.partner = partner
+        elif event == "team_delete":
+            self._retired[arguments[0]] = self._teams.remove(arguments[0], free=False)
+            self._settle_retired()
+        elif event == "wins":
+            self._teams.get(arguments[0]).edit_wins(amount=arguments[1])
+        elif event == "losses":
+            self._teams.get(arguments[0]).edit_losses(amount=arguments[1])
+        elif event == "group":
+            team_number, action, group = arguments
+            team = self._teams.get(team_number)
+            if action == "add":
+                self._groups.add(group)
+                team.group.add(group)
+            else:
+                team.group.discard(group)
+        elif event == "list_add":
+            self._waitlist.add(self._find_team(arguments[0]))
+        elif event == "list_remove":
+            self._waitlist.remove_team(self._find_team(arguments[0]))
+        elif event == "list_get":
+            self._waitlist.get(count=arguments[0])
+        elif event == "list_take":
+            for team_number in arguments:
+                self._waitlist.take(self._find_team(team_number))
+        elif event == "table":
+            table_number, invite_code, team_1_number, team_2_number = arguments
+            table = Table(team1=self._find_team(team_1_number), team2=self._find_team(team_2_number),
+                          table_number=table_number, invite_code=invite_code)
+            self._tables.add(table)
+        elif event == "final":
+            table_number, winning_team_number, next_team_number, invite_code = arguments
+            table = self._tables.get(table_number)
+            winning_team = table.teams[0] if table.teams[0].team_number == winning_team_number else table.teams[1]
+            next_team = None
+            if next_team_number is not None:
+                next_team = self._find_team(next_team_number)
+            self._tables.final(table, winner=winning_team, next_team=next_team, invite_code=invite_code)
+        elif event == "table_update":
+            table_number, team_1_number, team_2_number, invite_code, winning_team_number = arguments
+            winning_team = None
+            if winning_team_number is not None:
+                winning_team = self._teams.get(winning_team_number)
+            self._correct_table(self._tables.get(table_number), team_1=self._teams.get(team_1_number),
+                                team_2=self._teams.get(team_2_number), invite_code=invite_code, winning_team=winning_team)
+        elif event == "max_tables":
+            self._max_tables = arguments[0]
+        elif event == "clear":
+            if arguments[0] == "teams":
+                self._retired.update((team.team_number, team) for team in self._teams)
+                self._teams.clear()
+            elif arguments[0] == "tables":
+                self._tables.clear()
+            elif arguments[0] == "groups":
+                self._groups.clear()
+            elif arguments[0] == "list":
+                self._waitlist.clear()
+            self._settle_retired()
+        elif event == "play":
+            self._game_play_type = arguments[0]
+        elif event == "board":
+            self._board_message_id = arguments[0]
+        elif event == "quit":
+            self._end_session()
+        else:
+            logger.warning(f"Unknown journal event {event}")
 
-    def help(self, update, context):
+    async def help(self, update, context):
         """/help (help menu)"""
-        update.message.reply_text(
+        await update.message.reply_text(
             "/add   <team_number> -> Adds a team to the waitlist\n"
             "/clear <subcommand> -> Actions to erasing items\n"
             "/list  <subcommand> -> Acions that concern the Waitlist\n"
             "/play  <subcommand> -> Changes the game play of an event"
             "/next  <winning_team_number>, <invite_code> [<add_the_losing_team_to_waitlist>] -> Puts a new team to the table\n"
-            "/stats <tag_all_teams>-> Print all the teams statistics\n"
+            "/stats [<number|percent|streak|wins|top> [<count>]] [<tag_all_teams>] -> Print the teams statistics\n"
             "/table <subcommand> -> Acions that concern Table(s)\n"
+            "/board [stop] -> Pins a message that keeps showing the active tables and the waitlist\n"
             "/team <subcommand> -> Acions that concern Team(s)\n"
             "/quit -> Prints final Results"
             "/help\n"
         )
         return ConversationHandler.END
 
-    def check_output(self, message, update):
-            result = False
-            if len(message) > 3000:
-                update.message.reply_text(message)
-                result = True
-            return result
-
-    def next_team_to_table(self, update, context):
-        self.are_parameters_set(message=update.message.text, expect_subcommand=False)
-        self._messages.insert(0, "next")
-        self._next_team(update)
+    async def _dispatch(self, subcommands, update, command=None):
+        """Runs the subcommand a message is for, returns it or None when the message was wrong"""
+        commands = None
+        try:
+            if command is None:
+                lines = update.message.text.splitlines()
+                command = Command.parse(update.message.text, default=subcommands.default)
+                subcommand = subcommands.find(command[0] or subcommands.default)
+                if subcommand.bulk is not None and len(lines) > 1:
+                    commands = subcommands.parse_lines(subcommand, lines)
+            if commands is None:
+                subcommand, command = subcommands.parse(command)
+        except ValueError as msg:
+            logger.error(msg)
+            await update.message.reply_text(f"{msg}")
+            return None
+        if commands is not None and len(commands) > 1:
+            logger.debug(f"Subcommand: {subcommand.name}, {len(commands)} lines")
+            await subcommand.bulk(self, update, commands)
+            return subcommand
+        if commands is not None:
+            command = commands[0]
+        logger.debug(f"Subcommand: {subcommand.name}, arguments: {command[1:]}")
+        await subcommand.handler(self, update, command)
+        return subcommand
+
+    async def next_team_to_table(self, update, context):
+        command = Command(("next", *Command.parse(update.message.text, expect_subcommand=False)))
+        await self._dispatch(TABLE_COMMANDS, update, command)
         return ConversationHandler.END
 
-    def add_waitlist(self, update, context):
+    async def add_waitlist(self, update, context):
         """/add (Adds a team waitlist)"""
-        if not self.are_parameters_set(message=update.message.text, expect_subcommand=False):
-            update.message.reply_text(f"ERROR: Not enough paramters.  /add <team_number>")
-            return ConversationHandler.END
-        try:
-            team_number = int(self._messages[0])
-            for team in self._teams:
-                if team.team_number is team_number:
-                    logger.debug(f"Team number {team_number}\nteam selected{str(team)}")
-                    self._add_to_waitlist(update=update, team=team)
-                    return ConversationHandler.END
-        except ValueError:
-            msg = f"ERROR: Value provided is not a number.  Team Number: {self._messages[0]}"
-            logger.exception(msg)
-            update.message.reply_text(msg)
+        command = Command(("add", *Command.parse(update.message.text, expect_subcommand=False)))
+        await self._dispatch(LIST_COMMANDS, update, command)
+        return ConversationHandler.END
+
+    async def board(self, update, context):
+        """/board [stop] (pins a message that is kept showing the active tables and the waitlist)"""
+        await self._dispatch(BOARD_COMMANDS, update)
+        return ConversationHandler.END
+
+    async def _start_board(self, update):
+        # a new board replaces the old one
+        if self._board_message_id is not None:
+            self._board_message_id = None
+            self._record("board", None)
+        self._board_text = self._render_board()
+        await update.message.reply_text(Rendered(self._board_text, pin=True, sent=self._board_posted))
+
+    async def _stop_board(self, update):
+        if not self.has_board:
+            await update.message.reply_text("ERROR: There is no board to stop.  /board starts one")
+            return
+        self._board_text = None
+        self._board_message_id = None
+        self._record("board", None)
+        await update.message.reply_text("Board stopped")
+
+    def _board_posted(self, message):
+        if self._board_text is None:
+            # stopped before it was sent
+            return
+        self._board_message_id = message.message_id
+        self._board_version = None
+        self._record("board", message.message_id)
 
-        msg = f"ERROR: Team #{team_number} is a not found."
-        logger.error(msg)
-        update.message.reply_text(msg)
+    @property
+    def has_board(self):
+        return self._board_message_id is not None or self._board_text is not None
 
+    @property
+    def board_message_id(self):
+        return self._board_message_id
+
+    def board_lost(self, message_id):
+        """Returns a new board to post in place of message_id, which was deleted, or None when the board has moved on"""
+        if self._board_message_id != message_id:
+            return None
+        self._board_message_id = None
+        self._record("board", None)
+        self._board_text = self._render_board()
+        return Rendered(self._board_text, pin=True, sent=self._board_posted)
+
+    def board_changes(self):
+        """Returns the board's text when it no longer matches the board, None when there is nothing to edit"""
+        if self._board_message_id is None or self._board_version == self._version:
+            return None
+        self._board_version = self._version
+        text = self._render_board()
+        if text == self._board_text:
+            return None
+        self._board_text = text
+        return text
+
+    def _render_board(self):
+        lines = ["---------- Board ----------", f"Active Tables: {self._tables.active_count} of {self._max_tables}"]
+        active = self._tables.select(active=True)
+        for table in active[:self._board_tables]:
+            lines.append(self._renders.row(("board", table.table_number), table.stamp(), table.matchup))
+        if len(active) > self._board_tables:
+            lines.append(f"... and {len(active) - self._board_tables} more")
+        lines.append(f"---------- Waitlist: {self._waitlist.size} ----------")
+        for position, team in enumerate(islice(self._waitlist, self._board_waitlist), start=1):
+            lines.append(f"{position} | {team.team_number_details()}")
+        if self._waitlist.size > self._board_waitlist:
+            lines.append(f"... and {self._waitlist.size - self._board_waitlist} more")
+        return "\n".join(lines)
+
+    async def print_stats(self, update, context):
+        command = Command(("stats", *Command.parse(update.message.text)))
+        await self._dispatch(PRINT_COMMANDS, update, command)
         return ConversationHandler.END
 
-    def print_stats(self, update, context):
-        self.are_parameters_set(message=update.message.text)
-        self._get_stats(update)
-    
-    def _commands_get_parameters(self, update, default=""):
-        self.are_parameters_set(message=update.message.text, parameters_expected=0)
-        
-        if self._messages[0] == "":    
-            self._messages[0] = default
-        
     # PRINT COMMANDS
     # defaults to stats
-    def print_commands(self, update, context):
+    async def print_commands(self, update, context):
         """/print all commands that display print items back to the user"""
-        self._commands_get_parameters(update, "active")
-            
-        action = self._messages[0]
-        action = action.lower()
-
-        logger.debug(f"Action: {action}")
-
-        if "all" in action:
-            self._get_all_info(update)
-        elif "active" in action:
-            self._print_tables(update=update, active_only=True)
-        elif "group" in action:
-            self._get_groups(update)
-        elif "help" in action:
-            self._help_print_commands(update)
-        elif "team" in action:
-            self._get_teams(update=update)
-        elif "table" in action:
-            self._get_tables(update)
-        elif "stat" in action:
-            self._get_stats(update)
-        elif "list" in action:
-            self._get_waitlist(update)
-        else:
-            update.message.reply_text(f"ERROR:  No such subcommand {action}.  See 'print help' for more details")
+        await self._dispatch(PRINT_COMMANDS, update)
         return ConversationHandler.END
     
-    def _print_tables(self, update, active_only=False, team_number=None):
+    async def _export(self, update, command):
+        """/print export [roster|standings|tables], [csv|json] (Sends the data as a document)"""
+        exports = {"roster": self._export_roster, "standings": self._export_standings, "tables": self._export_tables}
+        what = (command[1] if len(command) > 1 and command[1] else "roster").lower()
+        form = (command[2] if len(command) > 2 and command[2] else "csv").lower()
+        if what not in exports or form not in ("csv", "json"):
+            msg = f"ERROR: Unable to export {what} as {form}.  /print export [roster|standings|tables], [csv|json]"
+            logger.error(msg)
+            await update.message.reply_text(msg)
+            return
+        header, rows = exports[what]()
+        stamp = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+        # a temporary file, the outbox deletes it once it has been sent
+        handle, path = tempfile.mkstemp(prefix=f"Export_{what}_", suffix=f".{form}")
+        os.close(handle)
+        try:
+            count = await asyncio.to_thread(write_rows, path, header, rows, form)
+        except Exception:
+            os.remove(path)
+            raise
+        logger.info(f"Exported {count} {what} rows to {path}")
+        await update.message.reply_document(path, caption=f"{what.capitalize()}: {count} row(s)",
+                                            filename=f"Export_{what}_{stamp}.{form}", remove=True)
+
+    def _export_roster(self):
+        return (("team_number", "player", "partner"),
+                ((team.team_number, team._player, team._partner or "") for team in self._teams))
+
+    def _export_standings(self):
+        teams = self._teams.leaderboard.top(ordering="percent")
+        return (("rank", "team_number", "player", "partner", "wins", "losses", "win_percentage", "best_win_streak"),
+                ((rank, team.team_number, team._player, team._partner or "", team.wins, team.losses,
+                  round(team.win_percentage, 1), team.best_win_streak) for rank, team in enumerate(teams, start=1)))
+
+    def _export_tables(self):
+        return (("table_number", "invite_code", "team_1", "team_2", "winner", "next_team", "next_invite_code", "active"),
+                (table.snapshot() for table in self._tables.select()))
+
+    async def _print_tables(self, update, active=None, team_number=None, invite_code=None, offset=0, size=None,
+                            oldest_first=False):
+        """Displays one page of the tables, newest first, with buttons to the pages around it"""
+        key = ("tables", active, team_number, invite_code, offset, size or self._table_page_size, oldest_first)
+        table_message = self._renders.view(key, self._version)
+        if table_message is None:
+            table_message = self._renders.store(key, self._version, self._render_tables(*key[1:]))
+        await update.message.reply_text(table_message)
+
+    def _render_tables(self, active, team_number, invite_code, offset, size, oldest_first):
         space = " "
-        table_message = f"---------- Tables ----------\n"
-        table_message = table_message + f"Number of Tables: {len(self._tables)}\n"
-        active_tables = 0
-        for table in self._tables:
-            if table.active:
-                active_tables = active_tables + 1
+        table_message = Rendered("---------- Tables ----------")
+        table_message.line(f"Number of Tables: {len(self._tables)}")
+        active_tables = self._tables.active_count
 
         if active_tables > self._max_tables:
-            table_message = table_message + f"WARNING: Next {self._max_tables - active_tables} table(s) will be torn down.\n"
-            table_message = table_message + f"There are {self._max_tables} table(s) for future game play!!!\n"
-        table_message = table_message + f"Number of Active Tables: {active_tables}\n"
-        table_message = table_message + f"#{space*3}| Invite code | Matchup\n  | Winner{space*19} | Loser\n    | Next code | Next Team\n"
-
-        for table in self._tables:
-            if active_only and not table.active:
+            table_message.line(f"WARNING: Next {self._max_tables - active_tables} table(s) will be torn down.")
+            table_message.line(f"There are {self._max_tables} table(s) for future game play!!!")
+        table_message.line(f"Number of Active Tables: {active_tables}")
+        table_message.block(f"#{space*3}| Invite code | Matchup", f"  | Winner{space*19} | Loser", f"    | Next code | Next Team")
+
+        tables = self._tables.select(team_number=team_number, invite_code=invite_code, active=active)
+        total = len(tables)
+        # past the end shows the last page
+        if offset >= total:
+            offset = max(total - 1, 0) // size * size
+        if oldest_first:
+            page = tables[offset:offset + size]
+        else:
+            page = tables[max(total - offset - size, 0):total - offset][::-1]
+        # the page has to fit in one message, its buttons only edit that one, so long
+        # names can leave fewer tables on it and the next page starts after the last shown
+        room = MESSAGE_LIMIT - len(str(table_message)) - 150
+        shown = 0
+        for table in page:
+            block = "\n".join((self._renders.row(("table", table.table_number), table.stamp(), table.__str__), "-"*50))
+            if shown and len(block) >= room:
+                break
+            if len(block) >= room:
+                block = block[:room - 2] + "~"
+            # a table's lines always stay in the same message
+            table_message.block(block)
+            room = room - len(block) - 1
+            shown = shown + 1
+        page = page[:shown]
+
+        if total > len(page):
+            pages = (total + size - 1) // size
+            table_message.line(f"Tables {offset + 1}-{offset + len(page)} of {total}, page {offset // size + 1} of {pages}")
+            buttons = list()
+            if offset > 0:
+                buttons.append(("< Prev", max(offset - size, 0)))
+            if offset + len(page) < total:
+                buttons.append(("Next >", offset + len(page)))
+            state = {None: "", True: "active", False: "done"}[active]
+            order = "oldest" if oldest_first else "newest"
+            keyboard = list()
+            for label, button_offset in buttons:
+                data = f"tables:{button_offset}:{size}:{'' if team_number is None else team_number}:{state}:{order}:{invite_code or ''}"
+                # Telegram allows 64 bytes of callback data
+                if len(data.encode()) > 64:
+                    logger.warning(f"Invite code {invite_code} is too long to page through")
+                    keyboard.clear()
+                    break
+                keyboard.append(InlineKeyboardButton(label, callback_data=data))
+            if keyboard:
+                table_message.reply_markup = InlineKeyboardMarkup([keyboard])
+        return table_message
+
+    async def page_tables(self, update, context):
+        """Shows the page of tables asked for by a prev/next button"""
+        _, offset, size, team_number, state, order, invite_code = update.callback_query.data.split(":", 6)
+        await self._print_tables(update, active={"": None, "active": True, "done": False}[state],
+                                 team_number=int(team_number) if team_number else None, invite_code=invite_code or None,
+                                 offset=int(offset), size=int(size), oldest_first=order == "oldest")
+
+    def _table_query(self, arguments, **query):
+        """Reads the options of the table history views into _print_tables arguments"""
+        page = None
+        for argument in arguments:
+            words = argument.split()
+            if not words:
                 continue
-            if team_number is not None:
-                logger.debug(f"team number {team_number},  team 1 {table._team1.team_number}  team 2 {table._team2.team_number}")
-                if table._team1.team_number is not team_number and table._team2.team_number is not team_number:
-                    logger.debug("skipping table")
-                    continue
-            table_message = table_message + f"{str(table)}\n"
-            table_message = table_message + f"-"*50 +"\n"
-            if self.check_output(message=table_message, update=update):
-                table_message = f""
-        update.message.reply_text(table_message)
-
-    def _get_groups(self, update):
+            option = words[0].lower()
+            value = " ".join(words[1:])
+            try:
+                if option.isdigit() and len(words) == 1:
+                    query["team_number"] = int(option)
+                elif option == "team":
+                    query["team_number"] = int(value)
+                elif option == "code" and value:
+                    query["invite_code"] = value
+                elif option == "active":
+                    query["active"] = True
+                elif option in ("done", "finished"):
+                    query["active"] = False
+                elif option == "oldest":
+                    query["oldest_first"] = True
+                elif option == "newest":
+                    query["oldest_first"] = False
+                elif option == "page":
+                    page = max(int(value), 1)
+                elif option == "size":
+                    query["size"] = min(max(int(value), 1), self._table_page_size_limit)
+                elif option == "offset":
+                    query["offset"] = max(int(value), 0)
+                else:
+                    raise ValueError(f"ERROR: Unknown table option {argument.strip()}.  See 'table help' for more details")
+            except ValueError as error:
+                if str(error).startswith("ERROR"):
+                    raise
+                raise ValueError(f"ERROR: {option} needs a number, not {value or 'nothing'}")
+        if page is not None:
+            query["offset"] = (page - 1) * query.get("size", self._table_page_size)
+        return query
+
+    async def _get_groups(self, update):
         msg = f"Groups: {list(self._groups)}"
-        update.message.reply_text(msg)
+        await update.message.reply_text(msg)
         logger.debug(msg)
 
-    def _get_tables(self, update):
-        """/printtables (prints all the tables)"""
-        team_number = None
+    async def _get_tables(self, update, arguments, **query):
+        """/print tables [<team_number>][, <options>] (prints a page of the tables)"""
         try:
-            if len(self._messages) > 2:
-                team_number = int(self._messages[2])
-            logger.debug(f"team number -> {team_number}")
-        except ValueError:
-            msg = f"ERROR: Value provided is not a number.  Team Number: {self._messages[0]}"
-            logger.exception(msg)
-            update.message.reply_text(msg)
-
-        self._print_tables(update, team_number=team_number)
+            query = self._table_query(arguments, **query)
+        except ValueError as msg:
+            logger.error(msg)
+            await update.message.reply_text(f"{msg}")
+            return
+        await self._print_tables(update, **query)
 
-    def _get_stats(self, update):
-        """/print stats (prints all teams statistics)"""
+    async def _get_stats(self, update, arguments):
+        """/print stats [<ordering> [<count>]][, <tag_team_members>] (prints the teams statistics)"""
+        ordering = "number"
+        count = None
         tag_team_members = False
-        if len(self._messages) > 1:
-            tag_team_members = True
-        self._get_teams(update=update, stats=True, tag_team_members=tag_team_members)
-
-    def _get_all_info(self, update):
-        self._get_teams(update=update, stats=True)
-        self._get_waitlist(update=update)
-        self._print_tables(update=update)
-
-    def _help_print_commands(self, update):
-        """help command for the print command"""
-        help = (f""
-            "all     -> Displys all table, teams, and waitlist\n"
-            "active  -> Displays all tables in use\n"
-            "groups  -> Displays all the groups of a team\n"
-            "list    -> Displays the waitlist\n"
-            "tables [team number] -> Displays all the tables for the game or for an individual team\n"
-            "teams   -> Displays all the teams\n"
-            "help    -> Displays commands for the print command\n")
-        update.message.reply_text(help)
-    
+        for argument in " ".join(arguments).replace(",", " ").lower().split():
+            if argument == "top":
+                ordering = "percent"
+                count = count or 10
+            elif argument in Leaderboard.ORDERINGS:
+                ordering = argument
+            elif argument.isdigit():
+                count = int(argument)
+            else:
+                tag_team_members = True
+        await self._get_teams(update=update, stats=True, tag_team_members=tag_team_members, ordering=ordering, count=count)
+
+    async def _get_all_info(self, update):
+        await self._get_teams(update=update, stats=True)
+        await self._get_waitlist(update=update)
+        await self._print_tables(update=update)
+
     # LIST COMMANDS
     # defaults to printing waitlist
-    def list_commands(self, update, context):
+    async def list_commands(self, update, context):
         """/list all commands that deal with the waitlist"""
-        self._commands_get_parameters(update, "get")
-        
-        action = self._messages[0]
-        action = action.lower()
-        logger.debug(action)
-        logger.debug(type(action))
-        if "add" in action:
-            if len(self.messages) < 2:
-                update.message.reply_text("ERROR: Not enough parameters.  /list add <team number>")
-                return
-            try:
-                team_number = int(self._messages[1])
-                team_found = False
-                for team in self._teams:
-                    if team.team_number is team_number:
-                        logger.debug(f"Team number {team_number}\nteam selected{str(team)}")
-                        self._add_to_waitlist(update=update, team=team)
-                        team_found = True
-                        break
-                if not team_found:
-                    msg = f"ERROR: Team #{team_number} is a not found."
-                    logger.error(msg)
-                    update.message.reply_text(msg)
-
-            except ValueError:
-                msg = f"ERROR: Value provided is not a number.  Team Number: {self._messages[0]}"
-                logger.exception(msg)
-                update.message.reply_text(msg)
-
-        elif "del" in action or "remove" in action:
-            self._remove_team_from_waitlist(update)
-        elif "get" in action:
-            self._get_waitlist(update)
-        elif "help" in action:
-            self._help_list_commands(update)
-        else:
-            update.message.reply_text(f"ERROR:  No such subcommand {action}.  See 'list help' for more details")
-
+        await self._dispatch(LIST_COMMANDS, update)
         return ConversationHandler.END
 
-    def _add_to_waitlist(self, update, team, print_waitlist=True):
+    async def _add_team_to_waitlist(self, update, command):
+        """/list add <team_number>... (for the waitlist)"""
+        if len(command) > 2:
+            await self._add_teams_to_waitlist(update, command[1:])
+            return
+        team_number = command[1]
+        team = self._teams.get(team_number)
+        if team is None:
+            msg = f"ERROR: Team #{team_number} is a not found."
+            logger.error(msg)
+            await update.message.reply_text(msg)
+            return
+        logger.debug(f"Team number {team_number}\nteam selected{str(team)}")
+        await self._add_to_waitlist(update=update, team=team)
+
+    async def _add_teams_to_waitlist(self, update, team_numbers):
+        """Adds the teams in the order given, none of them when any team isn't found"""
+        missing = [f"#{team_number}" for team_number in team_numbers if team_number not in self._teams]
+        if missing:
+            msg = f"ERROR: Team(s) {', '.join(missing)} not found.  No teams were added."
+            logger.error(msg)
+            await update.message.reply_text(msg)
+            return
+        added = list()
+        skipped = list()
+        for team_number in team_numbers:
+            team = self._teams.get(team_number)
+            if self._waitlist.add(team):
+                self._record("list_add", team_number)
+                added.append(team)
+            else:
+                skipped.append(f"#{team_number}")
+        added_message = Rendered(f"Added {len(added)} team(s), {self._waitlist.size} on the waitlist.")
+        for team in added:
+            added_message.line(f"{self._waitlist.position(team.team_number)}. {team}")
+        if skipped:
+            added_message.line(f"Already on the list, not added: {', '.join(skipped)}")
+        await update.message.reply_text(added_message)
+        logger.debug(f"Waitlist: added {len(added)} teams, skipped {len(skipped)}")
+
+    async def _add_to_waitlist(self, update, team, print_waitlist=True):
         if self._waitlist.add(team):
-            waitlist = self._waitlist.info()
-            logger.debug(f"Waitlist: {waitlist}")
-            if print_waitlist:
-                self._get_waitlist(update=update)
+            self._record("list_add", team.team_number)
+            logger.debug(f"Waitlist: team {team.team_number} is number {self._waitlist.position(team.team_number)}")
+            if print_waitlist and self.has_board:
+                # the board already shows the waitlist
+                await update.message.reply_text(f"Team #{team.team_number} is number {self._waitlist.position(team.team_number)} "
+                                                f"of {self._waitlist.size} on the waitlist.")
+            elif print_waitlist:
+                await self._get_waitlist(update=update)
         else:
             msg = f"ERROR: Team: {str(team)} was already on the list.  Not adding this team."
-            update.message.reply_text(msg)
+            await update.message.reply_text(msg)
             logger.error(msg)
         
-    def _remove_team_from_waitlist(self, update):
+    async def _remove_team_from_waitlist(self, update, command):
         """/list remove (for the waitlist)"""
-        if len(self._messages) < 2:
-            update.message.reply_text("ERROR: Not enough parameters.  /list remove <team number>")
+        if len(command) < 2:
+            await update.message.reply_text("ERROR: Not enough parameters.  /list remove <team number>")
             return 
-        team_number = int(self._messages[1])
-        for team in self._teams:
-            if team.team_number is team_number:
-                team_to_remove = team
+        team_number = int(command[1])
+        team_to_remove = self._teams.get(team_number)
+        if team_to_remove is None:
+            msg = f"ERROR: Team #{team_number} is a not found."
+            logger.error(msg)
+            await update.message.reply_text(msg)
+            return
         try:
             self._waitlist.remove_team(team_to_remove=team_to_remove)
-            update.message.reply_text(f"Removed team {str(team_to_remove)} from the waitlist.")
+            self._record("list_remove", team_number)
+            await update.message.reply_text(f"Removed team {str(team_to_remove)} from the waitlist.")
         except ValueError as msg:
             logger.exception(msg)
-            update.message.reply_text(msg)
+            await update.message.reply_text(msg)
          
-    def _get_waitlist(self, update):
-        waitlist_message = f"---------- Waitlist ----------\n"
-        waitlist_message = waitlist_message + f"Number of teams on the waitlist: {self._waitlist.size}\n"
-        waitlist = self._waitlist.info()
+    async def _get_waitlist_position(self, update, command):
+        """/list position (where a team is on the waitlist)"""
+        if len(command) < 2:
+            await update.message.reply_text("ERROR: Not enough parameters.  /list position <team number>")
+            return
+        try:
+            team_number = int(command[1])
+        except ValueError:
+            msg = f"ERROR: Value provided is not a number.  Team Number: {command[1]}"
+            logger.exception(msg)
+            await update.message.reply_text(msg)
+            return
+        position = self._waitlist.position(team_number)
+        if position is None:
+            await update.message.reply_text(f"Team #{team_number} is not on the waitlist.")
+        else:
+            await update.message.reply_text(f"Team #{team_number} is number {position} of {self._waitlist.size} on the waitlist.")
+
+    async def _get_waitlist(self, update):
+        waitlist_message = self._renders.view(("waitlist",), self._version)
+        if waitlist_message is None:
+            waitlist_message = self._renders.store(("waitlist",), self._version, self._render_waitlist())
+        await update.message.reply_text(waitlist_message)
+
+    def _render_waitlist(self):
+        waitlist_message = Rendered("---------- Waitlist ----------")
+        waitlist_message.line(f"Number of teams on the waitlist: {self._waitlist.size}")
         counter = 1
-        for team in waitlist:
-            waitlist_message += f"{counter} | {str(team)}\n"
-            if self.check_output(message=waitlist_message, update=update):
-                waitlist_message = f""
-            
+        for team in self._waitlist:
+            if counter == 1:
+                waitlist_message.line(f"{counter} | {team.tag_team_members()}")
+            else:
+                waitlist_message.line(f"{counter} | {str(team)}")
             counter = counter + 1
-        update.message.reply_text(waitlist_message)
-
-    def _help_list_commands(self, update):
-        """help command for the list command"""
-        help = (f""
-            "add     [team_number]-> Adds a team to the waitlist\n"
-            "delete  [team_number]-> Removes a team from the waitlist\n"
-            "get     -> Displays the waitlist\n"
-            "help    -> Displays commands for the list command\n")
-        update.message.reply_text(help)
+        return waitlist_message
 
     # TEAM COMMANDS
-    def team_commands(self, update, context):
+    async def team_commands(self, update, context):
         """/team all commands that deal with the team object"""
-        self._commands_get_parameters(update, "help")
-            
-        action = self._messages[0]
-        action = action.lower()
+        await self._dispatch(TEAM_COMMANDS, update)
+        return ConversationHandler.END
 
-        if "create" in action:
-            self._create_team(update)
-        elif "delete" in action:
-            self._delete_team(update)
-        elif "info" in action:
-            self._get_team_info(update)
-        elif "group" in action:
-            self._group_subcommand(update)
-        elif "loss" in action:
-            self._update_wins_losses(update, change_wins=False)
-        elif "table" in action:
-            self._get_teams_tables(update)
-        elif "update" in action:
-            self._update_team(update)
-        elif "win" in action:
-            self._update_wins_losses(update, change_wins=True)
-        elif "help" in action:
-            self._help_team_commands(update)
+    async def _group_subcommand(self, update, command):
+        team_number, action, group = command[1:]
+        team = self._teams.get(team_number)
+        if team is None:
+            msg = f"ERROR: Team #{team_number} was not found"
+            logger.error(msg)
+            await update.message.reply_text(msg)
+        elif action == "add":
+            self._groups.add(group)
+            team.group.add(group)
+            self._record("group", team_number, "add", group)
+            await update.message.reply_text(f"Team {team_number} has been added to group: {group}")
+        elif group in team.group:
+            team.group.remove(group)
+            self._record("group", team_number, "delete", group)
+            await update.message.reply_text(f"Team {team_number} has been removed from group: {group}")
         else:
-            update.message.reply_text(f"ERROR:  No such subcommand {action}.  See 'team help' for more details")
-
-        return ConversationHandler.END
+            msg = f"Team {team_number} was never apart of group: {group}"
+            logger.error(msg)
+            await update.message.reply_text(msg)
 
-    def _group_subcommand(self, update):
-        if len(self._messages) < 4:
-            update.message.reply_text("ERROR: Not enough parameters: /team group <team_number>, <add|delete>, <group>")
-            return
+    async def _get_teams_tables(self, update, command):
         try:
-            msg  = ""
-            team_found = False
-            team_number = int(self._messages[1])
-            action = self._messages[2]
-            action = action.lower()
-            group = self._messages[3]
-
-            for team in self._teams:
-                if team.team_number is team_number:
-                    if "add" in action:
-                        self._groups.add(group)
-                        team.group.add(group)
-                        update.message.reply_text(f"Team {team_number} has been added to group: {group}")
-                    elif "del" in action:
-                        try:
-                            team.group.remove(group)
-                            update.message.reply_text(f"Team {team_number} has been removed from group: {group}")
-                        except KeyError:
-                            msg = f"Team {team_number} was never apart of group: {group}"
-                            logger.error(msg)
-                            update.message.reply_text(msg)
-                    else:
-                        msg = f"ERROR: Group action: {action} not found!  Valid actions are ADD or DELETE"
-        except ValueError:
-            update.message.reply_text(f"Invalid Digit: Team Number: {self._messages[0]}, Amount: {self._messages[1]}")
-            logger.exception("Invalid Digit")
+            team_number = int(command[1])
 
-    def _get_teams_tables(self, update):
-        try:
-            team_number = int(self._messages[1])
-            team_found = False
-            
-            for team in self._teams:
-                if team.team_number is team_number:
-                    self._print_tables(update, active_only=False, team_number=team_number)
-                    team_found = True
-                    break
-            if not team_found:
+            if team_number in self._teams:
+                await self._print_tables(update, team_number=team_number)
+            else:
                 msg = f"ERROR: Team #{team_number} was not found"
                 logger.error(msg)
-            update.message.reply_text(msg) 
+                await update.message.reply_text(msg)
         except ValueError:
-            update.message.reply_text(f"Invalid Digit: Team Number: {self._messages[0]}, Amount: {self._messages[1]}")
+            await update.message.reply_text(f"Invalid Digit: Team Number: {command[0]}, Amount: {command[1]}")
             logger.exception("Invalid Digit")
     
-    def _create_team(self, update):
-        """/createteam (Creates a team)"""
-        def is_number_in_use(number):
-            for team in self._teams:
-                if team.team_number is number:
-                    return True
-            return False
-
-        if len(self._messages) < 2:
-            update.message.reply_text("ERROR: Not enough parameters: /team create player[, player, team_number]")
-            return
-        
-        logger.debug(f"Parameters: {self._messages}")
-        if "&" in self._messages[1]:
-            parameters = self._messages[1].split(" & ")
+    @staticmethod
+    def _team_arguments(command):
+        """Returns the player, partner and team number of /team create, "player & partner" is both players"""
+        arguments = list(command[1:])
+        if "&" in arguments[0]:
+            arguments[0:1] = arguments[0].split("&")[:2]
+        player = arguments[0]
+        partner = arguments[1] if len(arguments) > 1 else None
+        team_number = arguments[2] if len(arguments) > 2 else None
+        if team_number is not None:
             try:
-                team_number = self._messages[2]
+                team_number = int(team_number)
             except ValueError:
-                team_number = self._team_number
-            self._messages[1] = parameters[0]
-            self._messages[2] = parameters[1]
-            self._messages[3] = team_number
-
-        partner = None
-        player = self._messages[1]
-        team_number = self._team_number
-        is_team_number = False
-
-        if len(self._messages) > 2:
-            partner = self._messages[2]
+                raise ValueError(f"ERROR: Team number provided is not a number.  Value: {team_number}")
+        return player, partner, team_number
 
-        if len(self._messages) > 3:
-            try:
-                team_number = int(self._messages[3])
-                is_team_number = True
-            except ValueError:
-                msg = f"ERROR: Team number provided is not a number.  Value: {self._messages[3]}"
-                logger.exception(msg)
-                update.message.reply_text(msg)
-                return
+    async def _create_team(self, update, command):
+        """/createteam (Creates a team)"""
+        logger.debug(f"Parameters: {command}")
+        try:
+            player, partner, team_number = self._team_arguments(command)
+        except ValueError as msg:
+            logger.exception(msg)
+            await update.message.reply_text(f"{msg}")
+            return
 
         # if number is already taken and this number was provide by a person
-        is_used = is_number_in_use(number=team_number)
-        if  is_used and is_team_number:
+        if team_number is not None and team_number in self._teams.allocator:
             msg = f"ERROR: Team number:{team_number} is already in use."
             logger.error(msg)
-            update.message.reply_text(msg)
+            await update.message.reply_text(msg)
             return
 
         # Lets find a number to use:
-        while is_used:
-            self._team_number = self._team_number + 1
-            team_number = self._team_number
-            is_used = is_number_in_use(number=team_number)
+        if team_number is None:
+            team_number = self._teams.allocator.allocate()
 
         # add team
         team = TeamInfo(player=player, partner=partner, team_number=team_number)
-        if not is_team_number:
-            self._team_number = self._team_number + 1
-        self._teams.append(team)
-        self._teams = sorted(self._teams, key=operator.attrgetter("_team_number"))
+        self._teams.add(team)
+        self._record("team", team.team_number, team._player, team._partner)
         msg = f"TEAM CREATED:\n# | Team\n{team.team_number_details()}"
-        update.message.reply_text(msg)
+        await update.message.reply_text(msg)
         logger.info(msg)
-        with open(self._team_file, "a") as write_file:
-            write_file.write(f"{team.team_number_details()}\n")
+        self._storage.save_team(team)
 
-    def _update_team(self, update):
+    async def _import_teams(self, update, command):
+        """/team import (Creates the teams of a CSV or JSON roster sent as a document)"""
+        document = update.message.document
+        if document is None:
+            msg = "ERROR: Send the roster as a document with /team import as its caption, or reply to one with /team import"
+            logger.error(msg)
+            await update.message.reply_text(msg)
+            return
+        handle, path = tempfile.mkstemp(prefix="Import_", suffix=os.path.splitext(document.file_name or "")[1])
+        os.close(handle)
+        try:
+            file = await document.get_file()
+            await file.download_to_drive(path)
+            # rows go from the file straight into the same checks as /team create
+            commands = await asyncio.to_thread(TEAM_COMMANDS.convert_all, TEAM_COMMANDS.find("create"), read_roster(path))
+        except ValueError as msg:
+            logger.error(msg)
+            await update.message.reply_text(f"{msg}")
+            return
+        finally:
+            os.remove(path)
+        logger.info(f"Importing {len(commands)} teams from {document.file_name}")
+        await self._create_teams(update, commands)
+
+    async def _create_teams(self, update, commands):
+        """/team create with a team on each line, created only when every line is good"""
+        rows = list()
+        errors = list()
+        taken = set()
+        for line, command in enumerate(commands, start=1):
+            try:
+                player, partner, team_number = self._team_arguments(command)
+            except ValueError as msg:
+                errors.append(f"Line {line}: {str(msg).replace('ERROR: ', '', 1)}")
+                continue
+            if team_number is not None and (team_number in self._teams.allocator or team_number in taken):
+                errors.append(f"Line {line}: Team number:{team_number} is already in use.")
+            taken.add(team_number)
+            rows.append((player, partner, team_number))
+        if errors:
+            msg = "ERROR: No teams were created, fix these lines:\n" + "\n".join(errors)
+            logger.error(msg)
+            await update.message.reply_text(msg)
+            return
+
+        # numbers asked for are taken first so none of them is handed out
+        teams = [TeamInfo(player=player, partner=partner, team_number=team_number)
+                 for player, partner, team_number in rows if team_number is not None]
+        for team in teams:
+            self._teams.add(team)
+        for player, partner, team_number in rows:
+            if team_number is None:
+                team = TeamInfo(player=player, partner=partner, team_number=self._teams.allocator.allocate())
+                self._teams.add(team)
+                teams.append(team)
+        teams.sort(key=lambda team: team.team_number)
+
+        created_message = Rendered(f"TEAMS CREATED: {len(teams)}", "# | Team")
+        for team in teams:
+            self._record("team", team.team_number, team._player, team._partner)
+            created_message.line(team.team_number_details())
+        await update.message.reply_text(created_message)
+        logger.info(f"Created {len(teams)} teams")
+        self._storage.save_teams(teams)
+
+    async def _update_team(self, update, command):
         """/editteam (Edit names in a team)"""
-        if len(self._messages) < 3:
+        if len(command) < 3:
             msg = f"ERROR: Incorrect parameters /team update <team_number>, player[,player]\n"
-            msg = msg + f"Parameters: {self._messages}"
+            msg = msg + f"Parameters: {command}"
             logger.error(msg)
-            update.message.reply_text(msg)
+            await update.message.reply_text(msg)
             return 
         try:
-            team_number = int(self._messages[1])
-            team_found = False
-            player1 = self._messages[2]
+            team_number = int(command[1])
+            player1 = command[2]
             player2 = None
-            if len(self._messages) > 3:
-                player2 = self._messages[3]
-            for team in self._teams:
-                if team.team_number is team_number:
-                    team_found = True
-                    team.player = player1
+            if len(command) > 3:
+                player2 = command[3]
+            team = self._teams.get(team_number)
+            if team is not None:
+                team.player = player1
+                # a partner left out stays the same, as when the journal is replayed
+                if player2 is not None:
                     team.partner = player2
-                    msg = f"Team has been modified {str(team)}"
-                    update.message.reply_text(msg)
-                    logger.debug(msg)
-                    with open(self._team_file, "a") as write_file:
-                        write_file.write(f"{team.team_number_details()}\n")
-            if not team_found:
+                self._record("team", team.team_number, team._player, team._partner)
+                msg = f"Team has been modified {str(team)}"
+                await update.message.reply_text(msg)
+                logger.debug(msg)
+                self._storage.save_team(team)
+            else:
                 msg = f"ERROR: Team number: {team_number}, Not Found"
-                update.message.reply_text(msg)
+                await update.message.reply_text(msg)
                 logger.error(msg)
         except IndexError:
-            update.message.reply_text(f"Invalid Digit: Team Number: {self._messages[1]}")
+            await update.message.reply_text(f"Invalid Digit: Team Number: {command[1]}")
             logger.exception("Invalid team number")
         except Exception:
             logger.exception("Whats going on!!!")
 
-    def _update_wins_losses(self, update, change_wins):
+    async def _update_wins_losses(self, update, command, change_wins):
         try:
-            team_number = int(self._messages[1])
+            team_number = int(command[1])
             amount = 1
-            if len(self._messages) > 2:
-                amount = int(self._messages[2])
-            for team in self._teams:
-                if team.team_number is team_number:
-                    if change_wins:
-                        old_wins = team.wins
-                        team.edit_wins(amount=amount)
-                        new_wins = team.wins
-                        update.message.reply_text(f"Team: {str(team)} changed wins from {old_wins} to {new_wins}")
-                    else:
-                        old_losses = team.losses
-                        team.edit_losses(amount=amount)
-                        new_losses = team.losses
-                        update.message.reply_text(f"Team: {str(team)} changed losses from {old_losses} to {new_losses}")
+            if len(command) > 2:
+                amount = int(command[2])
+            team = self._teams.get(team_number)
+            if team is not None:
+                if change_wins:
+                    old_wins = team.wins
+                    team.edit_wins(amount=amount)
+                    self._record("wins", team_number, amount)
+                    new_wins = team.wins
+                    await update.message.reply_text(f"Team: {str(team)} changed wins from {old_wins} to {new_wins}")
+                else:
+                    old_losses = team.losses
+                    team.edit_losses(amount=amount)
+                    self._record("losses", team_number, amount)
+                    new_losses = team.losses
+                    await update.message.reply_text(f"Team: {str(team)} changed losses from {old_losses} to {new_losses}")
         except ValueError:
-            update.message.reply_text(f"Invalid Digit: Team Number: {self._messages[0]}, Amount: {self._messages[1]}")
+            await update.message.reply_text(f"Invalid Digit: Team Number: {command[0]}, Amount: {command[1]}")
             logger.exception("Invalid Digit")
     
-    def _delete_team(self, update):
+    async def _delete_team(self, update, command):
         try:
             msg  = ""
-            team_found = False
-            team_number = int(self._messages[1])
-            for team in self._teams:
-                if team.team_number is team_number:
-                    self._teams.remove(team)
-                    team_found = True
-                    msg = f"Team #{team_number} has been removed"
-                    logger.debug(msg)
-                    break
-            if not team_found:
+            team_number = int(command[1])
+            if team_number in self._teams:
+                self._retired[team_number] = self._teams.remove(team_number, free=False)
+                self._settle_retired()
+                self._record("team_delete", team_number)
+                msg = f"Team #{team_number} has been removed"
+                logger.debug(msg)
+            else:
                 msg = f"ERROR: Team #{team_number} was not found"
                 logger.error(msg)
-            update.message.reply_text(msg) 
+            await update.message.reply_text(msg) 
         except ValueError:
-            update.message.reply_text(f"Invalid Digit: Team Number: {self._messages[0]}, Amount: {self._messages[1]}")
+            await update.message.reply_text(f"Invalid Digit: Team Number: {command[0]}, Amount: {command[1]}")
             logger.exception("Invalid Digit")
 
-    def _get_team_info(self, update):
+    async def _get_team_info(self, update, command):
         try:
-            team_found = False
-            team_number = int(self._messages[1])
-            for team in self._teams:
-                if team.team_number is team_number:
-                    msg = team.info()
-                    team_found = True
-            if not team_found:
+            team_number = int(command[1])
+            team = self._teams.get(team_number)
+            if team is not None:
+                msg = team.info()
+                rank = self._teams.leaderboard.rank(team_number)
+                msg = msg + f"Rank: {rank} of {len(self._teams)} by win percentage\n"
+            else:
                 msg = f"ERROR: Team #{team_number} was not found"
                 logger.error(msg)
-            update.message.reply_text(msg)
+            await update.message.reply_text(msg)
         except ValueError:
-            update.message.reply_text(f"Invalid Digit: Team Number: {self._messages[0]}, Amount: {self._messages[1]}")
+            await update.message.reply_text(f"Invalid Digit: Team Number: {command[0]}, Amount: {command[1]}")
             logger.exception("Invalid Digit")
 
-    def _help_team_commands(self, update):
-        """help command for the team command"""
-        help = (f""
-            "create  <team_member> [, <team_member>, <team_number>]   -> Creates a team\n"
-            "delete  <team_number> -> Deletes the team\n"
-            "group   <team_number> -> Displays all groups associated with a team\n"
-            "info    <team_number> -> Displays all information about a team\n"
-            "losses  <team_number> [, <amount>] -> Edits a team's losses\n"
-            "table   <team_number> -> Displays all tables associated with a team\n"
-            "update  <team_number> <team_member> [, <team_member>]-> Editss a team's member(s)\n"
-            "wins    <team_number> [, <amount>] -> Edits a team's wins\n"
-            "help    -> Displays commands for the team command\n")
-        update.message.reply_text(help)
+    async def _get_team_history(self, update, command):
+        """/team history <team_number|player> [, <days>] (Tables a team or a player played, this session and earlier ones)"""
+        team_or_player = command[1]
+        days = command[2] if len(command) > 2 else 30
+        since = datetime.now() - timedelta(days=days)
+        try:
+            # the tables still queued for the writer have to be on disk to be read back
+            await asyncio.to_thread(self._writer.flush)
+            # the text storage scans every archive, which must not hold up the other chats
+            if team_or_player.isdigit():
+                title = f"Team {team_or_player}"
+                tables = await asyncio.to_thread(self._storage.tables_for_team, int(team_or_player), since=since)
+            else:
+                title = team_or_player.capitalize()
+                tables = await asyncio.to_thread(self._storage.tables_for_player, team_or_player, since=since)
+        except NotImplementedError as msg:
+            await update.message.reply_text(f"{msg}")
+            logger.error(msg)
+            return
+
+        history_message = Rendered(f"---------- {title} History ----------")
+        history_message.line(f"{len(tables)} table(s) in the last {days} day(s)")
+        history_message.line(f"Played | T # | Code | Teams | Winner")
+        for session_id, table_number, invite_code, team1, team2, winner, next_team, next_invite_code, active, played in tables:
+            winner = "Active" if winner is None else winner
+            history_message.line(f"{played[:16]} | {table_number} | {invite_code} | {team1} vs {team2} | {winner}")
+        await update.message.reply_text(history_message)
 
     # TABLE COMMANDS
-    def table_commands(self, update, context):
+    async def table_commands(self, update, context):
         """/table all commands that deal with the table object"""
-        self._commands_get_parameters(update, "help")
-
-        action = self._messages[0]
-        action = action.lower()
-
-        if "create" in action:
-            self._create_table(update)
-        elif "act" in action:
-            self._print_tables(update=update, active_only=True)
-        elif "all" in action:
-            self._print_tables(update)
-        elif "del" in action:
-            self._remove_table(update)
-        elif "update" in action:
-            self._update_table(update)
-        elif "next" in action:
-            self._next_team(update)
-        elif "help" in action:
-            self._help_table_commands(update)
-        else:
-            update.message.reply_text(f"ERROR:  No such subcommand {action}.  See 'table help' for more details")
-
+        await self._dispatch(TABLE_COMMANDS, update)
         return ConversationHandler.END
 
-    def _new_table(self, update, teams, invite_code, winners_kept=False):
+    async def _new_table(self, update, teams, invite_code, winners_kept=False):
         # Create the table
-        table_number = len(self._tables)
+        table_number = self._tables.next_table_number
         table = Table(team1=teams[0], team2=teams[1], invite_code=invite_code, table_number=table_number)
+        self._tables.add(table)
 
         # Write it to a file
-        with open(self._table_file, "a") as file_writer:
-            file_writer.write(f"{table.short_info()}\n") 
+        self._storage.save_table(table)
+        self._record("table", table_number, invite_code, teams[0].team_number, teams[1].team_number)
 
         table_message = f""
         if not winners_kept:
@@ -926,193 +2052,177 @@ class GotNextBot:
             table_message += f"{tag_team} go to table {table.invite_code}\n"
         tag_team = table.teams[1].tag_team_members()
         table_message += f"{tag_team} go to table {table.invite_code}\n"
-        update.message.reply_text(table_message)
-        
-        self._tables.append(table)
+        await update.message.reply_text(table_message)
 
-    def _create_table(self, update):
+    async def _create_table(self, update, command):
         """/table create (Creates a table and add to gameplay)"""
-        if len(self._messages) < 1:
-            update.message.reply_text("ERROR: Not enough parameters.  /table create <invite code>")
+        if len(command) < 1:
+            await update.message.reply_text("ERROR: Not enough parameters.  /table create <invite code>")
         
         # adding another table to gameplay
         self._max_tables = self._max_tables + 1
+        self._record("max_tables", self._max_tables)
         invite_code = ""
-        if self._messages:
-            invite_code = self._messages[1]
+        if command:
+            invite_code = command[1]
         
         logger.debug(f"Invite code is {invite_code}")
         try:
-            teams = self._waitlist.get(count=2)
-            self._new_table(update=update, teams=teams, invite_code=invite_code)
+            teams = self._matchmaker.pair(self._waitlist)
+            for team in teams:
+                self._waitlist.take(team)
+            self._record("list_take", *[team.team_number for team in teams])
+            await self._new_table(update=update, teams=teams, invite_code=invite_code)
             
         except Exception as msg:
             logger.exception("Failure!!!")
-            update.message.reply_text(f"{msg}")
+            await update.message.reply_text(f"{msg}")
         
-    def _update_table(self, update):
+    async def _update_table(self, update, command):
         """/table update <tablenumber> <table_number>, <team number>, <team_number>[, <invite code>, <winning_team_number>"""
-        if len(self._messages) < 4:
-            update.message.reply_text("ERROR: Not enough parameters.  /edittable <table_number>, <team number>, <team_number>[, <invite code>, <winning_team_number>")
+        if len(command) < 4:
+            await update.message.reply_text("ERROR: Not enough parameters.  /edittable <table_number>, <team number>, <team_number>[, <invite code>, <winning_team_number>")
             return
         try:
-            table_number = int(self._messages[1])
-            team_1_number = int(self._messages[2])
-            team_2_number = int(self._messages[3])
+            table_number = int(command[1])
+            team_1_number = int(command[2])
+            team_2_number = int(command[3])
             team_1 = None
             team_2 = None
             invite_code = None
             winning_team_number = None
             winning_team = None
 
-            if len(self._messages) > 4:
-                invite_code = self._messages[4]
-            if len(self._messages) > 5:
-                winning_team_number = int(self._messages[5])
+            if len(command) > 4:
+                invite_code = command[4]
+            if len(command) > 5:
+                winning_team_number = int(command[5])
 
             logger.debug(f"Team Number 1: {team_1_number} Team 2: {team_2_number}  Invite Code:{invite_code} Winning Team Number {winning_team_number}")
             
-            for team in self._teams:
-                if team.team_number is team_1_number:
-                    team_1 = team
-                if team.team_number is team_2_number:
-                    team_2 = team
-                if winning_team_number is not None:
-                    if winning_team_number is team.team_number:
-                        winning_team = team
+            team_1 = self._teams.get(team_1_number)
+            team_2 = self._teams.get(team_2_number)
+            if winning_team_number is not None:
+                winning_team = self._teams.get(winning_team_number)
 
             if team_1 is None or team_2 is None:
                 msg = f"ERROR: A team was not found. Team 1: {team_1_number}, Team 2 {team_2_number}"
-                update.message.reply_text(msg)
+                await update.message.reply_text(msg)
                 logger.error(msg)
                 return
             
             if team_1.equals(team_2):
                 msg = f"ERROR: Team numbers are the same. Team 1: {team_1_number}, Team 2 {team_2_number}"
-                update.message.reply_text(msg)
+                await update.message.reply_text(msg)
                 logger.error(msg)
                 return
 
-            table_found = False
-            for table in self._tables:
-                if table_number is table.table_number:
-                    table_found = True
-                    table._team1 = team_1
-                    table._team2 = team_2
-                    if invite_code is not None:
-                        table.invite_code = invite_code
-                    if not table.active:
-                        if winning_team is not None and not table._winner.equals(winning_team):
-                            table._winner.edit_wins(-1)
-                            table._loser.edit_losses(-1)
-                            if not table._winner.equals(winning_team):
-                                if table._team1.equals(winning_team):
-                                    table._team1.edit_wins(1)
-                                    table._team2.edit_losses(1)
-                                    table._winner = team_1
-                                    table._loser = team_2
-
-                                elif table._team2.equals(winning_team):
-                                    table._team2.edit_wins(1)
-                                    table._team1.edit_losses(1)
-                                    table._winner = team_2
-                                    table._loser = team_1
-                                
-                                else:
-                                    msg = (f"ERROR: Winning team is not aprt of table {table_number}. Team 1: {team_1_number}, "
-                                            "Team 2: {team_2_number}, Winning Team: {winning_team_number}")
-
-                                    update.message.reply_text(msg)
-                                    logger.error(msg)
-
-                                    # Restore wins and loses for the original teams
-                                    table._winner.edit_wins(1)
-                                    table._loser.edit_losses(1)
-
-                                    return
-                                update.message.reply_text("WARNING: Changed table results on a non active table.")
-
-                    update.message.reply_text(f"SUCCESS: Table {table_number}:  has been updated!")
-                    logger.info(f"SUCCESS: Table {table_number}:  has been updated!")
-
-                    # Write it to a file
-                with open(self._table_file, "a") as file_writer:
-                    file_writer.write(f"{table.short_info()}\n") 
-
-            if not table_found:
+            table = self._tables.get(table_number)
+            if table is not None:
+                if not table.active and winning_team is not None and not (team_1.equals(winning_team) or team_2.equals(winning_team)):
+                    msg = (f"ERROR: Winning team is not aprt of table {table_number}. Team 1: {team_1_number}, "
+                            f"Team 2: {team_2_number}, Winning Team: {winning_team_number}")
+                    await update.message.reply_text(msg)
+                    logger.error(msg)
+                    return
+
+                if self._correct_table(table, team_1=team_1, team_2=team_2, invite_code=invite_code, winning_team=winning_team):
+                    await update.message.reply_text("WARNING: Changed table results on a non active table.")
+                self._record("table_update", table_number, team_1_number, team_2_number, invite_code, winning_team_number)
+
+                await update.message.reply_text(f"SUCCESS: Table {table_number}:  has been updated!")
+                logger.info(f"SUCCESS: Table {table_number}:  has been updated!")
+
+                # Write it to a file
+                self._storage.save_table(table)
+            else:
                 msg = f"ERROR: Table number {table_number} was not found."
-                update.message.reply_text(msg)
+                await update.message.reply_text(msg)
                 logger.error(msg)
             
         except ValueError:
-            msg = f"ERROR:  A value was not a number.  Table Number: {self._messages[1]}  Team 1 #: {self._messages[2]} Team 2 #: {self._messages[3]}"
-            if len(self._messages) > 5:
-                msg = msg + f" Invite Code: {self._messages[4]}"
-            if len(self._messages) > 6:
-                msg = msg + f" Winning Team #: {self._messages[5]}"
-            update.message.reply_text(msg)
+            msg = f"ERROR:  A value was not a number.  Table Number: {command[1]}  Team 1 #: {command[2]} Team 2 #: {command[3]}"
+            if len(command) > 5:
+                msg = msg + f" Invite Code: {command[4]}"
+            if len(command) > 6:
+                msg = msg + f" Winning Team #: {command[5]}"
+            await update.message.reply_text(msg)
             logger.exception(msg)
   
-    def _remove_table(self, update):
+    def _correct_table(self, table, team_1, team_2, invite_code=None, winning_team=None):
+        """Puts the right teams, invite code and winner on a table, returns True if a result was changed"""
+        self._tables.update_teams(table, team1=team_1, team2=team_2)
+        if invite_code is not None:
+            self._tables.update_invite_code(table, invite_code)
+        if table.active or winning_team is None or table._winner.equals(winning_team):
+            return False
+
+        table._winner.edit_wins(-1)
+        table._loser.edit_losses(-1)
+        if table._team1.equals(winning_team):
+            table._team1.edit_wins(1)
+            table._team2.edit_losses(1)
+            table._winner = team_1
+            table._loser = team_2
+        else:
+            table._team2.edit_wins(1)
+            table._team1.edit_losses(1)
+            table._winner = team_2
+            table._loser = team_1
+        return True
+
+    async def _remove_table(self, update):
         """/removetable (remove a table)"""
         if self._max_tables < 1:
-            update.message.reply_text("No tables have been assigned.  Try again chump")
+            await update.message.reply_text("No tables have been assigned.  Try again chump")
         else:
             self._max_tables = self._max_tables-1
-            update.message.reply_text(f"Tables removed!! Remaining tables {self._max_tables}")
+            self._record("max_tables", self._max_tables)
+            await update.message.reply_text(f"Tables removed!! Remaining tables {self._max_tables}")
     
-    def _next_team(self, update):
+    async def _next_team(self, update, command):
         """/next - gets a team from waitlist"""
-        if len(self._messages) < 3:
-            update.message.reply_text("ERROR: Not enough parameters.  /table next <winning_team_number>, <invite_code>[, <add_losing_team, defaults to yes>]")
+        if len(command) < 3:
+            await update.message.reply_text("ERROR: Not enough parameters.  /table next <winning_team_number>, <invite_code>[, <add_losing_team, defaults to yes>]")
         try:
-            logger.debug(f"{self._messages}")
-            team_number = int(self._messages[1])
-            invite_code = self._messages[2]
+            logger.debug(f"{command}")
+            team_number = int(command[1])
+            invite_code = command[2]
             add_to_waitlist = "yes"
-            if len(self._messages) > 3:
-                add_to_waitlist = self._messages[3]
+            if len(command) > 3:
+                add_to_waitlist = command[3]
 
-            winning_team = None
-            for team in self._teams:
-                if team.team_number is team_number:
-                    winning_team = team
-            
+            winning_team = self._teams.get(team_number)
             if winning_team is None:
                 raise Exception(f"ERROR: Team Number {team_number} not found")
 
-            active_tables = 0
             next_team = None
-            table_found = None
 
             logger.debug(f"Winning team is {str(winning_team)}  new invite code is {invite_code}")
 
-            for table in self._tables:
-                if table.active:
-                    active_tables = active_tables + 1
+            active_tables = self._tables.active_count
             logger.debug(f"Active tables: {active_tables},  max tables: {self._max_tables}")
 
-            for table in self._tables:
-                # find the winning team
-                if table.active and winning_team in table.teams:
-                    table_found = table
-                
-                    if table_found.invite_code.strip() == invite_code.strip():
-                        msg = f"WARNING:  Invite code is the same the previous game. Invite code {invite_code}"
-                        update.message.reply_text(msg)
-                        logger.warning(msg)
+            # find the winning team
+            table_found = self._tables.active_table(team_number)
+            if table_found is not None and table_found.invite_code.strip() == invite_code.strip():
+                msg = f"WARNING:  Invite code is the same the previous game. Invite code {invite_code}"
+                await update.message.reply_text(msg)
+                logger.warning(msg)
 
             if table_found is not None:
                 # Getting the next team from waitlist for this table
                 # create a new table
                 if active_tables > self._max_tables:
-                    update.message.reply_text(f"WARNING: This table is being destroyed.  Tables remaining {active_tables-1}")
+                    await update.message.reply_text(f"WARNING: This table is being destroyed.  Tables remaining {active_tables-1}")
                     logger.warning(f"Breaking down this table.  Tables remaining {active_tables}.  Max tables{self._max_tables}")
                     invite_code = "-------------"
                 else:
-                    next_team = self._waitlist.get()[0]
+                    next_team = self._matchmaker.opponent(self._waitlist, winning_team)
+                    self._waitlist.take(next_team)
+                    self._record("list_take", next_team.team_number)
                     teams = [winning_team, next_team]
-                    self._new_table(update=update, teams=teams, invite_code=invite_code, winners_kept=True)
+                    await self._new_table(update=update, teams=teams, invite_code=invite_code, winners_kept=True)
                 
                 # displaying winning streak and finializing table
                 winning_team_win_streak = winning_team.win_streak
@@ -1122,10 +2232,12 @@ class GotNextBot:
                 msg = f""
                 if losing_team.win_streak > 3:
                     msg += f"{str(losing_team)} winning streak ends at {losing_team.win_streak} games\n"
-                table_found.final(winner=winning_team, next_team=next_team, invite_code=invite_code)
+                self._tables.final(table_found, winner=winning_team, next_team=next_team, invite_code=invite_code)
+                next_team_number = next_team.team_number if next_team is not None else None
+                self._record("final", table_found.table_number, team_number, next_team_number, invite_code)
                 msg += f"{str(winning_team)} winning streak is at {winning_team.win_streak} game(s)\n"
                 msg += f"{winning_team.record}\n{losing_team.record}\n"
-                update.message.reply_text(msg)
+                await update.message.reply_text(msg)
 
                 # add teams to waitlist
                 if "yes" in add_to_waitlist.lower():
@@ -1137,203 +2249,519 @@ class GotNextBot:
                     for team in teams:
                         if team is teams[-1]:
                             print_list = True
-                        self._add_to_waitlist(update=update, team=team, print_waitlist=print_list)
+                        await self._add_to_waitlist(update=update, team=team, print_waitlist=print_list)
 
                 # Write it to a file
-                with open(self._table_file, "a") as file_writer:
-                    file_writer.write(f"{table_found.short_info()}\n") 
+                self._storage.save_table(table_found)
             else:
                 raise Exception(f"ERROR: {str(winning_team)} are not playing.")
         except (ValueError, IndexError):
             logger.exception("Failure!!!")
-            update.message.reply_text(f"Invalid team number: {team_number}")
+            await update.message.reply_text(f"Invalid team number: {team_number}")
         except Exception as msg:
             logger.exception("Failure!!!")
-            update.message.reply_text(f"{msg}")
+            await update.message.reply_text(f"{msg}")
   
-    def _get_teams(self, update, stats=False, tag_team_members=False):
-        team_message = f"---------- Teams ----------\n"
-        team_message = team_message + f"Number of teams: {len(self._teams)}\n"
+    async def _get_teams(self, update, stats=False, tag_team_members=False, ordering="number", count=None):
+        key = ("teams", stats, tag_team_members, ordering, count)
+        team_message = self._renders.view(key, self._version)
+        if team_message is None:
+            team_message = self._renders.store(key, self._version,
+                                               self._render_teams(stats, tag_team_members, ordering, count))
+        await update.message.reply_text(team_message)
+
+    def _render_teams(self, stats, tag_team_members, ordering, count):
+        renders = self._renders
+        team_message = Rendered("---------- Teams ----------")
+        team_message.line(f"Number of teams: {len(self._teams)}")
+        ranked = ordering != "number"
         if stats:
-            team_message = team_message + f"TM # | W.S | % | W | L | Team\n"
+            if ranked:
+                team_message.block(f"Ranked by {ordering}", f"RNK | TM # | W.S | % | W | L | Team")
+            else:
+                team_message.line(f"TM # | W.S | % | W | L | Team")
 
         else:
-            team_message = team_message + f" # | Team\n"
-        self._teams = sorted(self._teams, key=operator.attrgetter("_team_number"))
-        for team in self._teams:
-            if self.check_output(message=team_message, update=update):
-                team_message = f""
+            team_message.line(f" # | Team")
+        teams = self._teams
+        if ranked or count is not None:
+            teams = self._teams.leaderboard.top(count=count, ordering=ordering)
+        for rank, team in enumerate(teams, start=1):
+            stamp = (team, team._revision)
             if stats:
-                details = team.full_details(tag_team_members=tag_team_members)
-                team_message = team_message + f"{details}\n"
+                details = renders.row(("stats", team.team_number, tag_team_members), stamp,
+                                      lambda: team.full_details(tag_team_members=tag_team_members))
+                if ranked:
+                    details = f"{rank:3d} | {details}"
+                team_message.line(details)
             else:
-                details = team.team_number_details()
-                team_message = team_message + f"{details}\n"
-        update.message.reply_text(team_message)
+                team_message.line(renders.row(("team", team.team_number), stamp, team.team_number_details))
+        return team_message
    
-    def _help_table_commands(self, update):
-        """help command for the table command"""
-        help = (
-            "active  -> Displys all active table(s)\n"
-            "all     -> Displys all tables\n"
-            "create  <invite_code> -> Creates a new table\n"
-            "delete  -> Displays all tables in use\n"
-            "next    <team_number>, <invite_code> [, <add_losing_team_to_waitlist>] -> Puts a new team from the waitlist to the winners table\n"
-            "update  <table_number>, <team_number_1>, <team_number_2>[, <invite_code> [, <winner_team_number>]] -> Updates a table with correct details\n"
-            "help    -> Displays commands for the table command\n"
-            )
-        update.message.reply_text(help)
-    
     # CLEAR COMMANDS
-    def clear_commands(self, update, context):
+    async def clear_commands(self, update, context):
         """/clear all commands that deal with permently removing items in list"""
-        self._commands_get_parameters(update, "help")
-        
-        action = self._messages[0]
-        action = action.lower()
-
-        if "all" in action:
-            self._clear_everything(update)
-        elif "group" in action:
-            self._clear_groups(update)
-        elif "list" in action:
-            self._clear_waitlist(update)
-        elif "table" in action:
-            self._clear_tables(update)
-        elif "team" in action:
-            self._clear_teams(update)
-        elif "help" in action:
-            self._help_clear_commands(update)
-        else:
-            update.message.reply_text(f"ERROR:  No such subcommand {action}.  See 'clear help' for more details")
-
+        await self._dispatch(CLEAR_COMMANDS, update)
         return ConversationHandler.END
 
-    def _clear_waitlist(self, update):
-        """/clearwaitlist (clears the entire waitlist)"""
-        self._waitlist.clear()
-        update.message.reply_text("Waitlist cleared")
-            
-    def _clear_teams(self, update):
+    async def _clear_teams(self, update):
         """/clear teams: (clears all teams info)"""
+        self._retired.update((team.team_number, team) for team in self._teams)
         self._teams.clear()
-        self._team_number = 0
-        update.message.reply_text("Teams cleared")
+        self._settle_retired()
+        self._record("clear", "teams")
+        await update.message.reply_text("Teams cleared")
     
-    def _clear_tables(self, update):
+    async def _clear_tables(self, update):
         """/clear tables - clears all the tables and table history"""
         self._tables.clear()
-        update.message.reply_text("Tables cleared")
+        self._settle_retired()
+        self._record("clear", "tables")
+        await update.message.reply_text("Tables cleared")
     
-    def _clear_groups(self, update):
+    async def _clear_groups(self, update):
         """/clear tables - clears the master group list"""
-        self.groups.clear()
-        update.message.reply_text("Tables cleared")
+        self._groups.clear()
+        self._record("clear", "groups")
+        await update.message.reply_text("Groups cleared")
 
-    def _clear_waitlist(self, update):
+    async def _clear_waitlist(self, update):
         """/clear list - clears the waitlist"""
         self._waitlist.clear()
-        update.message.reply_text("Waitlist cleared")
-
-    def _clear_everything(self, update):
-        self._clear_teams(update)
-        self._clear_tables(update)
-        self._clear_group(update)
-
-    def _help_clear_commands(self, update):
-        """help command for the clear commands"""
-        help = (
-            "all   -> Clears all table, teams, and waitlist\n"
-            "group -> Clears master group list\n"
-            "list  -> Clears the waitlist\n"
-            "table -> Clears all the tables and table history\n"
-            "team  -> Clears all the teams information\n"
-            "help  -> Displays commands for the clear command\n"
-            )
-        update.message.reply_text(help)
-    
-    # GAMEPLAY COMMANDS
-    def gameplay_commands(self, update, context):
-        self._commands_get_parameters(update, "get")
-        
-        action = self._messages[0]
-        action = action.lower()
+        self._settle_retired()
+        self._record("clear", "list")
+        await update.message.reply_text("Waitlist cleared")
 
-        if "shark" in action:
-            self._game_play_type = "shark"
-        elif "rise" in action:
-            self._game_play_type = "rise"
-        elif "team" in action:
-            self._game_play_type = "team"
-        elif "get" in action:
-            pass
-        elif "help" in action:
-            self._help_clear_commands(update)
-        else:
-            update.message.reply_text(f"ERROR:  No such subcommand {action}.  See 'play help' for more details")
+    async def _clear_everything(self, update):
+        await self._clear_teams(update)
+        await self._clear_tables(update)
+        await self._clear_groups(update)
+        await self._clear_waitlist(update)
 
-        update.message.reply_text(f"Game type is {self._game_play_type}")
+    # GAMEPLAY COMMANDS
+    async def gameplay_commands(self, update, context):
+        """/play all commands that change the game play"""
+        await self._dispatch(PLAY_COMMANDS, update)
         return ConversationHandler.END
-    
-    def _help_play_commands(self, update):
-        """help command for the clear commands"""
-        help = (
-            "get   -> Gets the current game play\n"
-            "rise  -> Changes game play to rise and fly\n"
-            "shark -> Changes game play to card sharks (TBD)\n"
-            "team  -> Changes game play to team format (coming soon)\n"
-            )
-        update.message.reply_text(help)
 
-    def quit(self, update, context):
+    async def _set_game_play(self, update, game_play_type):
+        self._game_play_type = game_play_type
+        self._record("play", self._game_play_type)
+        await self._get_game_play(update)
+
+    async def _get_game_play(self, update):
+        await update.message.reply_text(f"Game type is {self._game_play_type}")
+
+    async def quit(self, update, context):
         """/quit (ends game and prints finial results teams)"""
-        active_tables = 0
-        for table in self._tables:
-            if table.active:
-                active_tables = active_tables + 1
+        active_tables = self._tables.active_count
 
         if self._max_tables > 0 or active_tables > 0:
             self._max_tables = 0
-            update.message.reply_text(f"Starting to close down this gaming session.  However there are {active_tables} active tables")
-            self._print_tables(update=update, active_only=True)
+            self._record("max_tables", self._max_tables)
+            await update.message.reply_text(f"Starting to close down this gaming session.  However there are {active_tables} active tables")
+            await self._print_tables(update=update, active=True)
     
         else:
-            update.message.reply_text("---------- Final Results ----------")
-            self._get_teams(update=update, stats=True)
+            await update.message.reply_text("---------- Final Results ----------")
+            await self._get_teams(update=update, stats=True)
             logger.warning("Game Session Ended")
 
-            self._table_file = f"Tables_{datetime.today().strftime(self.date_query)}.txt"
-
-            counter = 1
-            while os.path.exists(self._table_file):
-                self._table_file = f"Tables_{datetime.today().strftime(self.date_query)}_tourney_{counter}.txt"
-                counter = counter + 1
-
-            self._tables.clear()
-            for team in self._teams:
-                team.reset()
+            # the final results belong to the session that just ended
+            self._storage.compact(self._teams, self._tables)
+            await asyncio.to_thread(self._storage.new_session)
+            self._end_session()
+            self._record("quit")
+            self._compact()
+            self._writer.flush(wait=False)
                 
             msg = f"Tables cleared and team scores have been reset."
-            update.message.reply_text(msg)
+            await update.message.reply_text(msg)
             
-            logger.info(f"{msg} New game file is being saved to {self._table_file}.")
+            logger.info(f"{msg} New game is being saved to {self._storage.session_name}.")
 
         return ConversationHandler.END
                 
-    def error_flavorful_feedback(self, update):
+    def _end_session(self):
+        """Clears the tables and resets every team's score"""
+        self._tables.clear()
+        for team in self._teams:
+            team.reset()
+        self._settle_retired()
+
+    def close(self):
+        """Saves everything to the snapshot so the session can be dropped from memory"""
+        self._compact()
+        self._storage.close()
+        self._renders.clear()
+
+
+PRINT_COMMANDS = Subcommands("print", default="active")
+PRINT_COMMANDS.add("all", lambda session, update, command: session._get_all_info(update),
+                   description="Displays all tables, teams, and the waitlist")
+PRINT_COMMANDS.add("active", lambda session, update, command: session._get_tables(update, command[1:], active=True),
+                   "[*table_options]", "Displays the tables in use")
+PRINT_COMMANDS.add("export", GameSession._export, "[what] [format]",
+                   "Sends the roster, standings or tables as a csv or json document")
+PRINT_COMMANDS.add("groups", lambda session, update, command: session._get_groups(update),
+                   description="Displays all the groups")
+PRINT_COMMANDS.add("list", lambda session, update, command: session._get_waitlist(update),
+                   description="Displays the waitlist", aliases=("waitlist",))
+PRINT_COMMANDS.add("stats", lambda session, update, command: session._get_stats(update, arguments=command[1:]),
+                   "[*ordering]", "Displays the teams statistics by number, percent, streak, wins or top, [<count>] of them")
+PRINT_COMMANDS.add("tables", lambda session, update, command: session._get_tables(update, command[1:]),
+                   "[*table_options]", "Displays the tables for the game or for a team, see 'table help'")
+PRINT_COMMANDS.add("teams", lambda session, update, command: session._get_teams(update=update),
+                   description="Displays all the teams")
+
+LIST_COMMANDS = Subcommands("list", default="get")
+LIST_COMMANDS.add("add", GameSession._add_team_to_waitlist, "*team_numbers:int", "Adds teams to the waitlist, in the order given")
+LIST_COMMANDS.add("delete", GameSession._remove_team_from_waitlist, "team_number:int", "Removes a team from the waitlist",
+                  aliases=("remove",))
+LIST_COMMANDS.add("get", lambda session, update, command: session._get_waitlist(update), description="Displays the waitlist")
+LIST_COMMANDS.add("position", GameSession._get_waitlist_position, "team_number:int",
+                  "Displays where a team is on the waitlist")
+
+TEAM_COMMANDS = Subcommands("team")
+TEAM_COMMANDS.add("create", GameSession._create_team, "team_member [team_member] [team_number:int]",
+                  "Creates a team, or a team for each line", bulk=GameSession._create_teams)
+TEAM_COMMANDS.add("delete", GameSession._delete_team, "team_number:int", "Deletes the team")
+TEAM_COMMANDS.add("group", GameSession._group_subcommand, "team_number:int action:add|delete group",
+                  "Adds a team to a group or removes it from one")
+TEAM_COMMANDS.add("history", GameSession._get_team_history, "team_number_or_player [days:int]",
+                  "Displays the tables a team, or every team a player was on, played in this and past sessions")
+TEAM_COMMANDS.add("import", GameSession._import_teams,
+                  description="Creates the teams of a csv or json roster, sent with /team import as its caption")
+TEAM_COMMANDS.add("info", GameSession._get_team_info, "team_number:int", "Displays all information about a team")
+TEAM_COMMANDS.add("losses", lambda session, update, command: session._update_wins_losses(update, command, change_wins=False),
+                  "team_number:int [amount:int]", "Edits a team's losses", aliases=("loss",))
+TEAM_COMMANDS.add("tables", GameSession._get_teams_tables, "team_number:int", "Displays all tables associated with a team")
+TEAM_COMMANDS.add("update", GameSession._update_team, "team_number:int team_member [team_member]", "Edits a team's member(s)")
+TEAM_COMMANDS.add("wins", lambda session, update, command: session._update_wins_losses(update, command, change_wins=True),
+                  "team_number:int [amount:int]", "Edits a team's wins", aliases=("win",))
+
+TABLE_COMMANDS = Subcommands("table", notes="table_options -> [<team_number>][, team <team_number>][, code <invite_code>]"
+                                            "[, active|done][, oldest|newest][, page <n>][, size <n>][, offset <n>]")
+TABLE_COMMANDS.add("active", lambda session, update, command: session._get_tables(update, command[1:], active=True),
+                   "[*table_options]", "Displays the active table(s)")
+TABLE_COMMANDS.add("all", lambda session, update, command: session._get_tables(update, command[1:]),
+                   "[*table_options]", "Displays the tables, newest first, a page at a time")
+TABLE_COMMANDS.add("create", GameSession._create_table, "invite_code:code", "Creates a new table")
+TABLE_COMMANDS.add("delete", lambda session, update, command: session._remove_table(update),
+                   description="Takes a table out of play once its game is over")
+TABLE_COMMANDS.add("next", GameSession._next_team, "team_number:int invite_code:code [add_losing_team_to_waitlist]",
+                   "Puts a new team from the waitlist to the winners table")
+TABLE_COMMANDS.add("update", GameSession._update_table,
+                   "table_number:int team_number_1:int team_number_2:int [invite_code:code] [winner_team_number:int]",
+                   "Updates a table with correct details")
+
+CLEAR_COMMANDS = Subcommands("clear")
+CLEAR_COMMANDS.add("all", lambda session, update, command: session._clear_everything(update),
+                   description="Clears all table, teams, and waitlist")
+CLEAR_COMMANDS.add("groups", lambda session, update, command: session._clear_groups(update), description="Clears the master group list")
+CLEAR_COMMANDS.add("list", lambda session, update, command: session._clear_waitlist(update), description="Clears the waitlist",
+                   aliases=("waitlist",))
+CLEAR_COMMANDS.add("tables", lambda session, update, command: session._clear_tables(update),
+                   description="Clears all the tables and table history")
+CLEAR_COMMANDS.add("teams", lambda session, update, command: session._clear_teams(update),
+                   description="Clears all the teams information")
+
+PLAY_COMMANDS = Subcommands("play", default="get")
+PLAY_COMMANDS.add("get", lambda session, update, command: session._get_game_play(update), description="Gets the current game play")
+PLAY_COMMANDS.add("rise", lambda session, update, command: session._set_game_play(update, "rise"),
+                  description="Changes game play to rise and fly")
+PLAY_COMMANDS.add("shark", lambda session, update, command: session._set_game_play(update, "shark"),
+                  description="Changes game play to card sharks (TBD)")
+PLAY_COMMANDS.add("team", lambda session, update, command: session._set_game_play(update, "team"),
+                  description="Changes game play to team format (coming soon)")
+
+BOARD_COMMANDS = Subcommands("board", default="start")
+BOARD_COMMANDS.add("start", lambda session, update, command: session._start_board(update),
+                   description="Pins a message that is kept showing the active tables and the waitlist")
+BOARD_COMMANDS.add("stop", lambda session, update, command: session._stop_board(update), description="Stops and unpins the board")
+
+
+class BufferedUpdate:
+    """Stands in for an Update while its handler runs
+
+    Handlers call update.message.reply_text as before, the replies are kept and sent
+    together once the handler is done.
+    """
+    __slots__ = ("update", "replies")
+
+    def __init__(self, update):
+        self.update = update
+        self.replies = list()
+
+    @property
+    def message(self):
+        return self
+
+    @property
+    def text(self):
+        message = self.update.message
+        # a document's command is in its caption
+        return message.text if message.text is not None else message.caption
+
+    @property
+    def document(self):
+        message = self.update.message
+        if message.document is None and message.reply_to_message is not None:
+            return message.reply_to_message.document
+        return message.document
+
+    @property
+    def effective_chat(self):
+        return self.update.effective_chat
+
+    @property
+    def callback_query(self):
+        return self.update.callback_query
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+    async def reply_document(self, document, caption=None, filename=None, remove=False, **kwargs):
+        self.replies.append(Document(document, caption, filename, remove))
+
+
+class GotNextBot:
+    """Routes each chat's commands to its own GameSession"""
+
+    def __init__(self, token, flush_policy="interval", storage="text", base_url=None, directory="chats", idle_timeout=1800,
+                 concurrent_updates=64, board_delay=2.0, matchmaker="rematch", global_rate=30.0, interval_ms=200,
+                 evict_every=60.0):
+        # updates for different chats run at the same time, each session's lock keeps its own in order
+        builder = Application.builder().token(token).concurrent_updates(concurrent_updates)
+        builder = builder.post_init(self._start).post_stop(self._drain)
+        if base_url is not None:
+            # a self hosted Bot API server, which serves files from /file/bot<token> beside /bot<token>
+            builder = builder.base_url(base_url)
+            if base_url.endswith("/bot"):
+                builder = builder.base_file_url(f"{base_url[:-len('/bot')]}/file/bot")
+        self._application = builder.build()
+        self._outbox = Outbox(self._application.bot, global_rate=global_rate)
+        self._writer = WriteBehindWriter(flush_policy=flush_policy, interval_ms=interval_ms)
+        self._storage = storage
+        self._directory = directory
+        self._idle_timeout = idle_timeout
+        self._evict_every = evict_every
+        self._evictor = None
+        # chat id -> the evicted session still being saved
+        self._closing = dict()
+        # least recently used first
+        self._sessions = OrderedDict()
+        self._board_delay = board_delay
+        self._board_edits = dict()
+        self._matchmaker = matchmaker
+
+    def _session(self, update):
+        """Returns the chat's session, a new one is loaded from disk by the first command to hold its lock
+
+        Creating a GameSession doesn't touch the disk, so this never holds up the event loop.
+        """
+        chat_id = update.effective_chat.id
+        session = self._sessions.get(chat_id)
+        if session is None:
+            directory = os.path.join(self._directory, str(chat_id))
+            session = GameSession(chat_id, self._writer, storage=self._storage, directory=directory, matchmaker=self._matchmaker)
+            self._sessions[chat_id] = session
+        self._sessions.move_to_end(chat_id)
+        session.last_used = time.monotonic()
+        return session
+
+    async def _load_session(self, session):
+        closing = self._closing.get(session.chat_id)
+        if closing is not None:
+            # the chat's evicted session is still being saved
+            await asyncio.wait([closing])
+        # an evicted session may still have its snapshot in the writer queue
+        await asyncio.to_thread(self._writer.flush)
+        await asyncio.to_thread(os.makedirs, session.directory, exist_ok=True)
+        await asyncio.to_thread(session.load_data)
+        session.loaded = True
+        logger.info(f"Session for chat {session.chat_id} loaded from {session.directory}")
+
+    async def _run(self, handler, update, context):
+        """Runs a GameSession handler while holding its chat's lock, then queues its replies"""
+        session = self._session(update)
+        buffered = BufferedUpdate(update)
+        # nothing is awaited before the lock, so a chat's updates take it in the order they came in
+        async with session.lock:
+            if not session.loaded:
+                await self._load_session(session)
+            try:
+                return await handler(session, buffered, context)
+            finally:
+                self._reply(update, buffered.replies)
+                self._refresh_board(session)
+
+    def _refresh_board(self, session):
+        """Edits the chat's board once the burst of commands this one is part of is over"""
+        if not session.has_board or session.chat_id in self._board_edits:
+            return
+        self._board_edits[session.chat_id] = asyncio.create_task(self._edit_board(session))
+
+    async def _edit_board(self, session):
+        try:
+            wait = self._board_delay
+            deadline = time.monotonic() + 5 * self._board_delay
+            while wait > 0:
+                await asyncio.sleep(wait)
+                # every command pushes the edit back, up to the deadline so a busy chat still sees it
+                wait = min(session.last_used + self._board_delay, deadline) - time.monotonic()
+            async with session.lock:
+                text = session.board_changes()
+            if text is None:
+                return
+            message_id = session.board_message_id
+            pinned = await self._pinned(session.chat_id, message_id)
+            # pinned again once the edit shows the board is still there, one that was deleted is posted again
+            self._outbox.edit(session.chat_id, message_id, text,
+                              after=None if pinned else lambda message: self._outbox.pin(session.chat_id, message_id),
+                              missing=lambda: self._repost_board(session, message_id))
+        finally:
+            del self._board_edits[session.chat_id]
+
+    async def _pinned(self, chat_id, message_id):
+        """Returns whether message_id is the chat's pinned message"""
+        try:
+            chat = await self._application.bot.get_chat(chat_id)
+        except TelegramError:
+            logger.exception(f"Unable to see what is pinned in chat {chat_id}")
+            return True
+        return chat.pinned_message is not None and chat.pinned_message.message_id == message_id
+
+    def _repost_board(self, session, message_id):
+        board = session.board_lost(message_id)
+        if board is not None:
+            logger.warning(f"Board {message_id} of chat {session.chat_id} was deleted, posting it again")
+            self._outbox.send(session.chat_id, [board])
+
+    def _reply(self, update, texts):
+        message = update.effective_message
+        chat_id = update.effective_chat.id
+        message_thread_id = message.message_thread_id if getattr(message, "is_topic_message", False) else None
+        if update.callback_query is not None and texts:
+            # a button shows what it asked for in the message it is on, or in a new one once that is gone
+            page = texts[0]
+            self._outbox.edit(chat_id, message.message_id, page,
+                              missing=lambda: self._outbox.send(chat_id, [page], message_thread_id))
+            texts = texts[1:]
+        self._outbox.send(chat_id, texts, message_thread_id)
+
+    async def _start(self, application):
+        self._evictor = asyncio.create_task(self._evict_periodically())
+
+    async def _evict_periodically(self):
+        """Drops idle sessions even when no updates arrive to do it"""
+        while True:
+            await asyncio.sleep(self._evict_every)
+            try:
+                await self._evict_idle()
+            except Exception:
+                logger.exception("Unable to save an idle session")
+
+    async def _drain(self, application):
+        if self._evictor is not None:
+            self._evictor.cancel()
+            self._evictor = None
+        if self._closing:
+            await asyncio.wait(list(self._closing.values()))
+        await asyncio.gather(*self._board_edits.values(), return_exceptions=True)
+        await self._outbox.drain()
+
+    async def _evict_idle(self):
+        """Writes sessions that have been idle too long to disk and drops them"""
+        expired = time.monotonic() - self._idle_timeout
+        while self._sessions:
+            chat_id, session = next(iter(self._sessions.items()))
+            if session.last_used > expired or session.lock.locked():
+                break
+            del self._sessions[chat_id]
+            # one that never loaded has nothing to save, and saving it would write over what is on disk
+            if not session.loaded:
+                continue
+            closing = asyncio.ensure_future(asyncio.to_thread(session.close))
+            self._closing[chat_id] = closing
+            try:
+                # shielded so stopping the bot doesn't cut the save short, _drain waits for it
+                await asyncio.shield(closing)
+            finally:
+                if closing.done():
+                    del self._closing[chat_id]
+            logger.info(f"Session for chat {chat_id} was idle, saved to {session.directory}")
+
+    async def team_commands(self, update, context):
+        """/team all commands that deal with the team object"""
+        return await self._run(GameSession.team_commands, update, context)
+
+    async def table_commands(self, update, context):
+        """/table all commands that deal with the table object"""
+        return await self._run(GameSession.table_commands, update, context)
+
+    async def list_commands(self, update, context):
+        """/list all commands that deal with the waitlist"""
+        return await self._run(GameSession.list_commands, update, context)
+
+    async def clear_commands(self, update, context):
+        """/clear all commands that deal with permently removing items in list"""
+        return await self._run(GameSession.clear_commands, update, context)
+
+    async def print_commands(self, update, context):
+        """/print all commands that display print items back to the user"""
+        return await self._run(GameSession.print_commands, update, context)
+
+    async def gameplay_commands(self, update, context):
+        """/play all commands that change the game play"""
+        return await self._run(GameSession.gameplay_commands, update, context)
+
+    async def add_waitlist(self, update, context):
+        """/add (Adds a team waitlist)"""
+        return await self._run(GameSession.add_waitlist, update, context)
+
+    async def next_team_to_table(self, update, context):
+        """/next (Records a winner and seats the next team)"""
+        return await self._run(GameSession.next_team_to_table, update, context)
+
+    async def print_stats(self, update, context):
+        """/stats (Displays the team stats)"""
+        return await self._run(GameSession.print_stats, update, context)
+
+    async def help(self, update, context):
+        """/help (help menu)"""
+        return await self._run(GameSession.help, update, context)
+
+    async def quit(self, update, context):
+        """/quit (ends game and prints finial results teams)"""
+        return await self._run(GameSession.quit, update, context)
+
+    async def board(self, update, context):
+        """/board [stop] (pins a message that is kept showing the active tables and the waitlist)"""
+        async def board(session, update, context):
+            board_message_id = session.board_message_id
+            result = await GameSession.board(session, update, context)
+            if board_message_id is not None and session.board_message_id != board_message_id:
+                self._outbox.unpin(session.chat_id, board_message_id)
+            return result
+        return await self._run(board, update, context)
+
+    async def page_tables(self, update, context):
+        """prev/next buttons under a page of tables"""
+        await update.callback_query.answer()
+        return await self._run(GameSession.page_tables, update, context)
+
+    async def error_flavorful_feedback(self, update, context):
         """invalid command case"""
-        logger.info("we get here")
+        logger.opt(exception=context.error).error(f"Unable to handle update {update}")
+        if not isinstance(update, Update) or update.message is None:
+            return
         messages = ["Are we speaking the same language?!?!", "Try again mother fucker!!!", "I don't understand BS!!!", "Bruh WTF?!?!",
                     "Not today.  You ain't gonna break my shit today.", "If at first you don't succeed...Try try again!", "Ahh Sugar Honey Ice Tea!"]
-        random_number = randint(0, len(messages-1))
-        update.message.reply_text(messages[random_number])
-        return ConversationHandler.END
-        
-    def main(self):
-        logger.debug("starting handler")
+        random_number = randint(0, len(messages) - 1)
+        self._reply(update, [messages[random_number]])
         
-        dp = self._updater.dispatcher
-
+    def add_handlers(self):
         conv_handler = ConversationHandler(
             entry_points=[
                 CommandHandler("team", self.team_commands),
@@ -1348,23 +2776,95 @@ class GotNextBot:
                 CommandHandler("next", self.next_team_to_table),
                 CommandHandler("stats", self.print_stats),
                 CommandHandler("help", self.help),
+                CommandHandler("board", self.board),
                 CommandHandler("quit", self.quit), CommandHandler("exit", self.quit)
                 ],
             states={},
             fallbacks=[CommandHandler("quit", self.quit), CommandHandler("exit", self.quit)],
         )
-        dp.add_handler(conv_handler)
-        dp.add_error_handler(self.error_flavorful_feedback)
-        self._updater.start_polling()
-
-        self._updater.idle()
+        self._application.add_handler(conv_handler)
+        self._application.add_handler(CallbackQueryHandler(self.page_tables, pattern="^tables:"))
+        self._application.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/team(@\w+)?\s+import"),
+                                                     self.team_commands))
+        self._application.add_error_handler(self.error_flavorful_feedback)
+
+    def main(self, webhook_url=None, listen="0.0.0.0", port=8443, url_path="", cert=None, key=None, secret_token=None,
+             max_connections=40):
+        logger.debug("starting handler")
+        self.add_handlers()
+        serve(self._application, webhook_url=webhook_url, listen=listen, port=port, url_path=url_path, cert=cert, key=key,
+              secret_token=secret_token, max_connections=max_connections)
+        self.close()
+
+    async def process_updates(self, connection):
+        """Handles the updates a ShardedBot front process sends down connection, until it sends None"""
+        async with self._application:
+            await self._application.start()
+            await self._start(self._application)
+            while True:
+                data = await asyncio.to_thread(connection.recv)
+                if data is None:
+                    break
+                await self._application.update_queue.put(Update.de_json(data, self._application.bot))
+            # stop() lets the updates already handed over finish
+            await self._application.stop()
+            await self._drain(self._application)
+
+    def close(self):
+        """Saves every session and waits for the writer to finish"""
+        for session in self._sessions.values():
+            if session.loaded:
+                session.close()
+        self._sessions.clear()
+        self._writer.close()
+
+
+def serve(application, webhook_url=None, listen="0.0.0.0", port=8443, url_path="", cert=None, key=None, secret_token=None,
+          max_connections=40):
+    """Long polls for updates, or listens for Telegram to push them when webhook_url is set"""
+    # runs the event loop until Ctrl-C, every handler is a coroutine on it
+    if webhook_url is None:
+        application.run_polling()
+    else:
+        # Telegram opens at most max_connections at once, concurrent_updates bounds the handlers
+        logger.info(f"Listening for updates on {listen}:{port}/{url_path}, webhook {webhook_url}")
+        application.run_webhook(listen=listen, port=port, url_path=url_path, cert=cert, key=key,
+                                webhook_url=webhook_url, secret_token=secret_token, max_connections=max_connections)
 
 def run_pgm():
+    parser = argparse.ArgumentParser(description="GotNextBot")
+    parser.add_argument("--token", default=os.environ.get("GOTNEXTBOT_TOKEN"), help="bot token, defaults to $GOTNEXTBOT_TOKEN")
+    parser.add_argument("--storage", choices=("text", "sqlite"), default="text")
+    parser.add_argument("--matchmaker", choices=tuple(MATCHMAKERS), default="rematch",
+                        help="fifo plays teams in waitlist order, rematch looks ahead for teams that haven't met")
+    parser.add_argument("--flush-policy", choices=WriteBehindWriter.POLICIES, default="interval",
+                        help="when journal records are pushed to disk")
+    parser.add_argument("--interval-ms", type=int, default=200, help="how often the interval flush policy pushes to disk")
+    parser.add_argument("--webhook-url", help="public URL Telegram posts updates to, polls when not set")
+    parser.add_argument("--listen", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--url-path", default="")
+    parser.add_argument("--cert", help="TLS certificate, when Telegram talks to the listener directly")
+    parser.add_argument("--key", help="TLS private key")
+    parser.add_argument("--secret-token", default=os.environ.get("GOTNEXTBOT_WEBHOOK_SECRET"))
+    parser.add_argument("--concurrent-updates", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=0, help="worker processes to shard the chats across, 0 runs everything here")
+    arguments = parser.parse_args()
+    if not arguments.token:
+        parser.error("a bot token is required, use --token or set GOTNEXTBOT_TOKEN")
+
     date = datetime.today().strftime("%Y-%m-%d")
     logger.add(f"Log_{date}_GotNextBot.txt")
-    my_bot = GotNextBot(token=)
-    my_bot.load_data()
-    my_bot.main()
+    if arguments.workers > 0:
+        from shards import ShardedBot
+        my_bot = ShardedBot(token=arguments.token, workers=arguments.workers, storage=arguments.storage,
+                            concurrent_updates=arguments.concurrent_updates, matchmaker=arguments.matchmaker,
+                            flush_policy=arguments.flush_policy, interval_ms=arguments.interval_ms)
+    else:
+        my_bot = GotNextBot(token=arguments.token, storage=arguments.storage, concurrent_updates=arguments.concurrent_updates,
+                            matchmaker=arguments.matchmaker, flush_policy=arguments.flush_policy, interval_ms=arguments.interval_ms)
+    my_bot.main(webhook_url=arguments.webhook_url, listen=arguments.listen, port=arguments.port, url_path=arguments.url_path,
+                cert=arguments.cert, key=arguments.key, secret_token=arguments.secret_token)
 
 if __name__ == "__main__":
     run_pgm()